@@ -1,23 +1,46 @@
+import time
+
+# Medición del arranque (ver /_warmup): desde aquí hasta el final del módulo
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import uuid
 import json
+import zlib
+import shutil
+import tempfile
+import hashlib
+import base64
+import csv
 import io
-from datetime import datetime
-from typing import Optional, Dict, Any
-
-from flask import Flask, request, jsonify
+import heapq
+import random
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Union
+
+import click
+from flask import Flask, Response, request, jsonify, g, redirect
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
-from google.cloud import storage
-from google.cloud import firestore
-
-import firebase_admin
-from firebase_admin import auth as fb_auth
-from firebase_admin import credentials
-
-import google.generativeai as genai
-import PyPDF2
+import gemini_client
+import jobs
+import metrics
+import pdftext
+import responses
+import search
+import services
+import sunat_extractor
+
+# Los SDKs de GCP/Firebase/Gemini se importan en el primer uso (ver services.py)
+firestore = services.registry.lazy_module("google.cloud.firestore")
+storage = services.registry.lazy_module("google.cloud.storage")
+genai = services.registry.lazy_module("google.generativeai")
+gexceptions = services.registry.lazy_module("google.api_core.exceptions")
 
 # -----------------------------------------------------------------------------
 # Configuración básica
@@ -28,74 +51,574 @@ BUCKET_NAME = os.environ.get("BUCKET_NAME", "factoria-5ee80.firebasestorage.app"
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 GEMINI_MODEL_ID = os.environ.get("GEMINI_MODEL_ID", "models/gemini-2.5-flash")
 
-# Inicializa Firebase Admin con ADC (cuenta de servicio de Cloud Run)
-if not firebase_admin._apps:
-    firebase_admin.initialize_app()
-
-# Clientes de GCP
-storage_client = storage.Client()
-firestore_client = firestore.Client()
+# Cliente de Gemini: límite de tasa compartido, reintentos, deadline y circuit breaker
+GEMINI_RPM = float(os.environ.get("GEMINI_RPM", "15"))
+GEMINI_TPM = float(os.environ.get("GEMINI_TPM", "250000"))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "30"))  # por intento
+GEMINI_DEADLINE_SECONDS = float(os.environ.get("GEMINI_DEADLINE_SECONDS", "90"))  # espera + intentos + backoff
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET_SECONDS = float(os.environ.get("GEMINI_BREAKER_RESET_SECONDS", "30"))
+
+# Prompts por lotes en /invoices/process-batch: varias facturas por llamada a Gemini
+GEMINI_BATCH_MAX_INVOICES = int(os.environ.get("GEMINI_BATCH_MAX_INVOICES", "10"))  # 1 = una llamada por factura
+# Límites del modelo; si la API informa límites menores se usan esos
+GEMINI_INPUT_TOKEN_LIMIT = int(os.environ.get("GEMINI_INPUT_TOKEN_LIMIT", "1048576"))
+GEMINI_OUTPUT_TOKEN_LIMIT = int(os.environ.get("GEMINI_OUTPUT_TOKEN_LIMIT", "65536"))
+GEMINI_OUTPUT_TOKENS_PER_INVOICE = 400  # un objeto del esquema de extracción, con margen
+
+# Procesamiento por lotes (POST /invoices/process-batch)
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+BATCH_MAX_INVOICES = int(os.environ.get("BATCH_MAX_INVOICES", "500"))
+
+# Subidas de PDF: tamaño máximo y bloques de lectura / subida resumable a GCS
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "20"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 256 * 1024
+GCS_UPLOAD_CHUNK_SIZE = int(os.environ.get("GCS_UPLOAD_CHUNK_MB", "4")) * 1024 * 1024  # múltiplo de 256 KB
+PDF_MAGIC = b"%PDF-"
+
+# URLs firmadas (V4) para subir/descargar PDFs directo a Cloud Storage
+UPLOAD_URL_TTL_MINUTES = int(os.environ.get("UPLOAD_URL_TTL_MINUTES", "15"))
+DOWNLOAD_URL_TTL_MINUTES = int(os.environ.get("DOWNLOAD_URL_TTL_MINUTES", "60"))
+# Los PDFs no cambian una vez subidos: el navegador puede cachearlos mientras viva la URL
+PDF_CACHE_CONTROL = f"private, max-age={DOWNLOAD_URL_TTL_MINUTES * 60}"
+DOWNLOAD_URL_CACHE_SIZE = 5000
+
+# Cola de trabajos en segundo plano (POST /invoices/<id>/process -> 202)
+JOB_QUEUE_BACKEND = os.environ.get("JOB_QUEUE_BACKEND", "sqlite")
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "/tmp/neo-jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+
+# Paginación de GET /invoices
+INVOICES_DEFAULT_PAGE_SIZE = 100
+INVOICES_MAX_PAGE_SIZE = int(os.environ.get("INVOICES_MAX_PAGE_SIZE", "500"))
+VALID_STATUSES = ["Recibida", "Por Pagar", "Pagada", "Vencida"]
+
+# Exportación (GET /invoices/export): facturas leídas por página de Firestore
+INVOICES_EXPORT_PAGE_SIZE = int(os.environ.get("INVOICES_EXPORT_PAGE_SIZE", "500"))
+INVOICES_EXPORT_FIELDS = [
+    "invoiceId", "supplierUid", "supplierEmail", "supplierRuc", "status", "processed",
+    "es_factura", "numero_factura", "ruc_emisor", "razon_social_emisor",
+    "fecha_emision", "fecha_vencimiento", "moneda", "monto_total", "concepto",
+    "extractor", "confidence", "originalFilename", "createdAt", "processedAt",
+]
+
+# Respuestas de más de este tamaño se comprimen si el cliente lo acepta
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+
+# Cambios de estado en lote (PATCH /invoices/status)
+STATUS_BULK_MAX_ITEMS = int(os.environ.get("STATUS_BULK_MAX_ITEMS", "2000"))
+FIRESTORE_BATCH_LIMIT = 500  # escrituras por batch que acepta Firestore
+STATUS_UPDATE_ATTEMPTS = 3
+# Facturas por batch: el resto del límite es para el shard de contadores y el de la versión
+STATUS_CHUNK_SIZE = FIRESTORE_BATCH_LIMIT - 2
+
+# Barrido de facturas vencidas (POST /admin/sweep-overdue, flask sweep-overdue)
+OVERDUE_FROM_STATUSES = ["Recibida", "Por Pagar"]
+OVERDUE_STATUS = "Vencida"
+OVERDUE_PAGE_SIZE = STATUS_CHUNK_SIZE  # una página = un batch
+OVERDUE_SWEEP_UID = "overdue-sweep"  # lastUpdatedBy de los cambios automáticos
+SWEEP_MAX_SECONDS = float(os.environ.get("SWEEP_MAX_SECONDS", "240"))
+SWEEP_TOKEN = os.environ.get("SWEEP_TOKEN")
+LOCAL_TZ = timezone(timedelta(hours=-5))  # Perú: UTC-5, sin horario de verano
+
+# Índice de facturas duplicadas invoice_keys/{ruc}_{numero} (GET /invoices/duplicates, backfill)
+INVOICE_KEYS_PAGE_SIZE = 500
+
+# Búsqueda (GET /invoices/search) sobre searchTokens: cada página de resultados
+# se ordena por relevancia dentro de una ventana de SEARCH_WINDOW coincidencias,
+# leyendo como máximo SEARCH_MAX_SCAN facturas por request
+SEARCH_DEFAULT_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_WINDOW = int(os.environ.get("SEARCH_WINDOW", "100"))
+SEARCH_MAX_SCAN = int(os.environ.get("SEARCH_MAX_SCAN", "500"))
+SEARCH_INDEX_PAGE_SIZE = 500
+
+# Paginación de GET /suppliers (Auth devuelve como máximo 1000 usuarios por página)
+SUPPLIERS_DEFAULT_PAGE_SIZE = 100
+SUPPLIERS_MAX_PAGE_SIZE = 1000
+
+# Caché de proveedores (email/RUC) usada por GET /invoices y GET /suppliers
+SUPPLIER_CACHE_TTL = int(os.environ.get("SUPPLIER_CACHE_TTL", "300"))
+SUPPLIER_CACHE_SIZE = int(os.environ.get("SUPPLIER_CACHE_SIZE", "5000"))
+
+# Extracción de texto de PDFs (pool de procesos con presupuesto y timeout)
+PDF_TEXT_BACKEND = os.environ.get("PDF_TEXT_BACKEND", "pypdf2")
+PDF_TEXT_MAX_CHARS = int(os.environ.get("PDF_TEXT_MAX_CHARS", "4000"))  # lo que se envía a Gemini
+PDF_TEXT_MAX_PAGES = int(os.environ.get("PDF_TEXT_MAX_PAGES", "20"))
+PDF_TEXT_TIMEOUT = float(os.environ.get("PDF_TEXT_TIMEOUT", "20"))
+PDF_TEXT_PROCESSES = int(os.environ.get("PDF_TEXT_PROCESSES", "2"))
+# Extraer el texto al subir (en paralelo con la subida a Storage) y guardarlo en pdf_texts/{sha256}
+PDF_TEXT_ON_UPLOAD = os.environ.get("PDF_TEXT_ON_UPLOAD", "true").lower() in ("1", "true", "yes")
+# PDFs más grandes no se extraen al subir (se extraen al procesar): acota la copia temporal por subida
+PDF_TEXT_UPLOAD_MAX_MB = int(os.environ.get("PDF_TEXT_UPLOAD_MAX_MB", "5"))
+
+# Extractor local de facturas SUNAT: Gemini solo si su confianza queda por debajo (101 = siempre Gemini)
+LOCAL_EXTRACTION_MIN_CONFIDENCE = int(os.environ.get("LOCAL_EXTRACTION_MIN_CONFIDENCE", "85"))
+
+# Caché de ID tokens verificados (evita verify_id_token en cada request)
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "10000"))
+# Rutas de admin: comprobar también tokens revocados / usuarios deshabilitados
+AUTH_CHECK_REVOKED_ADMIN = os.environ.get("AUTH_CHECK_REVOKED_ADMIN", "false").lower() in ("1", "true", "yes")
+AUTH_REVOKED_CHECK_TTL = int(os.environ.get("AUTH_REVOKED_CHECK_TTL", "60"))
+
+# GET /metrics: además de los admins, acepta este token (para el scraper de Prometheus)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Contadores materializados del dashboard (stats/global/shards/{k})
+STATS_RECENT_SIZE = 5
+# Shards de los contadores y de la versión de los listados (stats/version/shards/{k}):
+# cada escritura sube uno al azar, así ningún documento recibe más de ~1 escritura/s
+STATS_SHARDS = int(os.environ.get("STATS_SHARDS", "10"))
+
+# Versión del prompt de extracción: cambiarla invalida los resultados cacheados en pdf_hashes
+EXTRACTION_PROMPT_VERSION = "1"
+
+# Backends: "gcp" (producción) o "fake" (fakes.py en memoria, para benchmarks y pruebas locales)
+NEO_BACKENDS = os.environ.get("NEO_BACKENDS", "gcp")
+
+def _init_firebase_auth():
+    import firebase_admin
+    from firebase_admin import auth
+
+    # Inicializa Firebase Admin con ADC (cuenta de servicio de Cloud Run)
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app()
+    return auth
+
+
+def _init_gemini_model():
+    genai.configure(api_key=GEMINI_API_KEY)
+    # Inicializar el modelo una sola vez
+    model = genai.GenerativeModel(GEMINI_MODEL_ID)
+    print(f"✅ Gemini AI listo con modelo: {GEMINI_MODEL_ID} (Google AI SDK)")
+    return model
+
+
+# Clientes de GCP y Gemini: se crean en el primer uso
+services.registry.register("firestore", lambda: firestore.Client())
+services.registry.register("storage", lambda: storage.Client())
+services.registry.register("auth", _init_firebase_auth)
+services.registry.register("gemini", _init_gemini_model)
+
+firestore_client = services.registry.proxy("firestore")
+storage_client = services.registry.proxy("storage")
+fb_auth = services.registry.proxy("auth")
+GEMINI_MODEL = services.registry.proxy("gemini")
+# Una sola instancia para toda la app: el limitador y el circuito se comparten entre hilos
+gemini_api = gemini_client.GeminiClient(
+    GEMINI_MODEL,
+    rpm=GEMINI_RPM,
+    tpm=GEMINI_TPM,
+    timeout=GEMINI_TIMEOUT,
+    deadline=GEMINI_DEADLINE_SECONDS,
+    max_retries=GEMINI_MAX_RETRIES,
+    breaker_threshold=GEMINI_BREAKER_THRESHOLD,
+    breaker_reset_seconds=GEMINI_BREAKER_RESET_SECONDS,
+)
 
 # Configurar Google AI (Gemini API)
-GEMINI_AI_ENABLED = False
-GEMINI_MODEL = None
+GEMINI_AI_ENABLED = bool(GEMINI_API_KEY)
+if not GEMINI_AI_ENABLED:
+    print(f"⚠️ GEMINI_API_KEY no configurada - IA deshabilitada")
 
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        # Inicializar el modelo una sola vez
-        GEMINI_MODEL = genai.GenerativeModel(GEMINI_MODEL_ID)
+if NEO_BACKENDS == "fake":
+    import fakes
+
+    _fake_backends = fakes.make_backends()
+    services.registry.override("firestore", _fake_backends["firestore_client"])
+    services.registry.override("storage", _fake_backends["storage_client"])
+    services.registry.override("auth", _fake_backends["auth"])
+    services.registry.override("gemini", _fake_backends["gemini_model"])
+    GEMINI_AI_ENABLED = True
+    print("🧪 Usando backends en memoria (NEO_BACKENDS=fake)")
+
+# Al arrancar, inicializar todo en segundo plano (la primera request no paga el costo)
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "false").lower() in ("1", "true", "yes")
+
+
+def configure_backends(firestore_client=None, storage_client=None, auth=None, gemini_model=None):
+    """
+    Reemplaza los clientes que usa la app (ej. por los de fakes.py). Los
+    argumentos en None se dejan como están.
+    """
+    global GEMINI_AI_ENABLED
+    if firestore_client is not None:
+        services.registry.override("firestore", firestore_client)
+    if storage_client is not None:
+        services.registry.override("storage", storage_client)
+    if auth is not None:
+        services.registry.override("auth", auth)
+    if gemini_model is not None:
+        services.registry.override("gemini", gemini_model)
         GEMINI_AI_ENABLED = True
-        print(f"✅ Gemini AI listo con modelo: {GEMINI_MODEL_ID} (Google AI SDK)")
-    except Exception as e:
-        print(f"⚠️ No se pudo preparar Gemini: {e}")
-        GEMINI_AI_ENABLED = False
-else:
-    print(f"⚠️ GEMINI_API_KEY no configurada - IA deshabilitada")
+    # Las cachés en memoria pertenecen a los backends anteriores
+    token_cache.clear()
+    supplier_directory.clear()
 
 # Flask
 app = Flask(__name__)
+# Werkzeug rechaza con 413 los bodies más grandes antes de leerlos (margen para el multipart)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES + 64 * 1024
 CORS(app, origins=[
     "http://localhost:8080",
     "https://factoria-5ee80.web.app",
     "https://factoria-5ee80.firebaseapp.com"
 ])
+# JSON con orjson y compresión gzip/brotli de las respuestas grandes
+responses.init_app(app, min_size=COMPRESS_MIN_BYTES)
 
 # -----------------------------------------------------------------------------
 # Utilidades
 # -----------------------------------------------------------------------------
-def _extract_bearer_uid_and_role() -> tuple[str, Optional[str]]:
+class TokenCache:
+    """
+    Caché LRU de ID tokens ya verificados: sha256(token) -> (uid, role) hasta
+    el `exp` del token. Un token repetido (el frontend reusa el mismo durante
+    una hora) cuesta una búsqueda en un dict en vez de verificar la firma RSA.
+
+    Con check_revoked=True además se consulta a Auth si el token fue revocado
+    o el usuario deshabilitado, como mucho cada `revoked_check_ttl` segundos
+    por token.
+
+    Los certificados públicos de Google los cachea firebase_admin según su
+    Cache-Control (varias horas): solo un miss que coincide con su expiración
+    paga la descarga. No hay API pública para refrescar esa caché por fuera.
+    """
+
+    def __init__(self, max_entries: int, revoked_check_ttl: int):
+        self.max_entries = max_entries
+        self.revoked_check_ttl = revoked_check_ttl
+        # clave -> [exp, uid, role, último chequeo de revocación (monotonic) o None]
+        self._entries: "OrderedDict[bytes, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revoked_checks = 0
+
+    @staticmethod
+    def _role(decoded: Dict[str, Any]) -> Optional[str]:
+        # Extraer rol de custom claims
+        return decoded.get("role") or decoded.get("claims", {}).get("role")
+
+    def verify(self, id_token: str, check_revoked: bool = False) -> tuple[str, Optional[str]]:
+        """Devuelve (uid, role); lanza la excepción de fb_auth si el token no es válido."""
+        key = hashlib.sha256(id_token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            fresh = entry is not None and (
+                not check_revoked
+                or (entry[3] is not None and time.monotonic() - entry[3] < self.revoked_check_ttl)
+            )
+            if fresh:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        try:
+            decoded = fb_auth.verify_id_token(id_token, check_revoked=check_revoked)
+        except Exception:
+            with self._lock:
+                self._entries.pop(key, None)
+            raise
+
+        uid, role = decoded["uid"], self._role(decoded)
+        with self._lock:
+            if check_revoked:
+                self.revoked_checks += 1
+            self._entries[key] = [decoded["exp"], uid, role, time.monotonic() if check_revoked else None]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return uid, role
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revokedChecks": self.revoked_checks,
+            }
+
+
+token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_REVOKED_CHECK_TTL)
+
+
+def _extract_bearer_uid_and_role(check_revoked: bool = False) -> tuple[str, Optional[str]]:
     """
     Lee el header Authorization: Bearer <idToken> y devuelve (uid, role).
     Lanza ValueError si falta o es inválido.
+    Los tokens ya verificados se resuelven desde token_cache.
     """
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
         raise ValueError("Falta Authorization: Bearer <idToken>")
 
     id_token = auth_header.split(" ", 1)[1].strip()
-    decoded = fb_auth.verify_id_token(id_token)
-    uid = decoded["uid"]
-    
-    # Extraer rol de custom claims
-    role = decoded.get("role") or decoded.get("claims", {}).get("role")
-    
-    return uid, role
+    return token_cache.verify(id_token, check_revoked=check_revoked)
+
 
+class UploadTooLargeError(ValueError):
+    """El archivo supera MAX_UPLOAD_BYTES."""
 
-def extract_text_from_pdf(file_stream) -> str:
+
+def _scan_pdf_upload(stream, max_bytes: int = MAX_UPLOAD_BYTES) -> tuple[str, int]:
+    """
+    Recorre el stream de la subida por bloques: valida la firma %PDF- con el
+    primer bloque, aplica el tamaño máximo y calcula el SHA-256.
+    Devuelve (sha256, tamaño) y deja el stream al inicio para subirlo.
+    Lanza ValueError si no es PDF o UploadTooLargeError si es muy grande.
     """
-    Extrae texto de un PDF usando PyPDF2.
+    sha = hashlib.sha256()
+    size = 0
+    first = True
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+        if first:
+            # La especificación permite basura antes del encabezado dentro del primer KB
+            if PDF_MAGIC not in chunk[:1024]:
+                raise ValueError("el archivo no es un PDF válido")
+            first = False
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(f"el archivo supera el máximo de {max_bytes // (1024 * 1024)} MB")
+        sha.update(chunk)
+    if first:
+        raise ValueError("archivo vacío")
+    stream.seek(0)
+    return sha.hexdigest(), size
+
+
+pdf_text_extractor = pdftext.PdfTextExtractor(
+    backend=PDF_TEXT_BACKEND,
+    max_chars=PDF_TEXT_MAX_CHARS,
+    max_pages=PDF_TEXT_MAX_PAGES,
+    timeout=PDF_TEXT_TIMEOUT,
+    processes=PDF_TEXT_PROCESSES,
+)
+
+
+def _extract_pdf_text_result(pdf_bytes: Union[bytes, str]) -> Optional[Dict[str, Any]]:
+    """
+    Extrae texto de un PDF (bytes o ruta de un archivo local; solo hasta PDF_TEXT_MAX_CHARS / PDF_TEXT_MAX_PAGES)
+    en el pool de procesos de pdftext. Devuelve el resultado completo de
+    pdftext (texto, páginas, calidad) o None si no se pudo leer.
     """
     try:
-        pdf_reader = PyPDF2.PdfReader(file_stream)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
+        with metrics.stage("pdf_parse"):
+            result = pdf_text_extractor.extract(pdf_bytes)
+        metrics.pdf_pages.observe(result["pagesRead"], kind="read")
+        metrics.pdf_pages.observe(result["totalPages"], kind="total")
+        if result["truncated"]:
+            print(f"✂️ Texto recortado: {result['pagesRead']}/{result['totalPages']} páginas en {result['elapsedMs']} ms")
+        return result
+    except pdftext.PdfTextError as e:
         print(f"Error extracting text from PDF: {e}")
-        return ""
+        return None
+
+
+def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+    """Texto del PDF (ver _extract_pdf_text_result); "" si no se pudo leer."""
+    result = _extract_pdf_text_result(pdf_bytes)
+    return result["text"] if result else ""
+
+
+def _pdf_text_version() -> str:
+    """Identifica parser + presupuesto + formato con que se guardó un texto en pdf_texts."""
+    return f"{PDF_TEXT_BACKEND}:{PDF_TEXT_MAX_CHARS}:{PDF_TEXT_MAX_PAGES}:{pdftext.TEXT_FORMAT_VERSION}"
+
+
+def _get_pdf_text(pdf_sha256: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Lee el texto guardado en pdf_texts/{sha256} si es de la versión actual.
+    Devuelve {"text", "pagesRead", "totalPages", "quality", ...} o None.
+    """
+    if not pdf_sha256:
+        return None
+    try:
+        with metrics.stage("firestore_read"):
+            snap = firestore_client.collection("pdf_texts").document(pdf_sha256).get()
+    except Exception as e:
+        print(f"Error leyendo texto guardado: {e}")
+        return None
+    data = snap.to_dict() if snap.exists else None
+    if not data or data.get("textVersion") != _pdf_text_version():
+        metrics.pdf_text_sidecar.inc(result="miss")
+        return None
+    metrics.pdf_text_sidecar.inc(result="hit")
+    data["text"] = zlib.decompress(data["text"]).decode("utf-8")
+    return data
+
+
+def _store_pdf_text(pdf_sha256: str, result: Dict[str, Any]):
+    """
+    Guarda el texto extraído (comprimido con zlib) en pdf_texts/{sha256} y
+    marca la versión en pdf_hashes/{sha256}, para que una subida con los
+    mismos bytes no lo vuelva a extraer. Procesar o reprocesar la factura
+    lee este texto en vez de descargar y parsear el PDF.
+    """
+    text = result["text"]
+    version = _pdf_text_version()
+    try:
+        batch = firestore_client.batch()
+        batch.set(firestore_client.collection("pdf_texts").document(pdf_sha256), {
+            "text": zlib.compress(text.encode("utf-8")),
+            "compression": "zlib",
+            "chars": len(text),
+            "pagesRead": result["pagesRead"],
+            "totalPages": result["totalPages"],
+            "truncated": result["truncated"],
+            "quality": result["quality"],
+            "backend": result["backend"],
+            "textVersion": version,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        })
+        batch.set(firestore_client.collection("pdf_hashes").document(pdf_sha256), {"textVersion": version}, merge=True)
+        with metrics.stage("firestore_write"):
+            batch.commit()
+        metrics.pdf_text_sidecar.inc(result="stored")
+    except Exception as e:
+        # El texto guardado es una optimización: sin él se descarga y parsea al procesar
+        print(f"Error guardando texto del PDF: {e}")
+
+
+def _extract_and_store_pdf_text(pdf_sha256: str, pdf_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Extracción al subir (corre en _upload_text_pool mientras se sube a Storage).
+    Recibe la ruta de una copia temporal del PDF y la borra al terminar.
+    """
+    try:
+        result = _extract_pdf_text_result(pdf_path)
+    finally:
+        try:
+            os.unlink(pdf_path)
+        except OSError:
+            pass
+    if result is not None:
+        _store_pdf_text(pdf_sha256, result)
+    return result
+
+
+def _spool_upload_copy(stream) -> str:
+    """
+    Copia el stream de la subida por bloques a un archivo temporal con nombre
+    (el del multipart de Werkzeug no tiene ruta) y lo deja al inicio. El
+    proceso de pdftext lo abre por ruta: no se copian bytes entre procesos.
+    """
+    tmp = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False)
+    try:
+        with tmp:
+            shutil.copyfileobj(stream, tmp, UPLOAD_CHUNK_SIZE)
+    except Exception:
+        os.unlink(tmp.name)
+        raise
+    finally:
+        stream.seek(0)
+    return tmp.name
+
+
+# Hilos que esperan la extracción de texto de las subidas (el parseo corre en el pool de pdftext)
+_upload_text_pool = ThreadPoolExecutor(max_workers=max(2, PDF_TEXT_PROCESSES * 2), thread_name_prefix="upload-text")
+
+
+# Instrucciones y esquema comunes al prompt individual y al prompt por lotes
+EXTRACTION_INSTRUCTIONS = """Si es una factura peruana, extrae:
+- Monto total (número con decimales)
+- Moneda (PEN, USD, etc.)
+- RUC del emisor (11 dígitos)
+- Razón social del emisor
+- Fecha de emisión (YYYY-MM-DD)
+- Fecha de vencimiento (YYYY-MM-DD)
+- Número de factura
+- Concepto/descripción
+
+Si NO es una factura, resume el contenido principal del documento."""
+
+EXTRACTION_SCHEMA = """{
+    "es_factura": true o false,
+    "resumen": "breve resumen si no es factura",
+    "monto_total": "valor o null",
+    "moneda": "PEN/USD o null",
+    "ruc_emisor": "número o null",
+    "razon_social_emisor": "nombre o null",
+    "fecha_emision": "YYYY-MM-DD o null",
+    "fecha_vencimiento": "YYYY-MM-DD o null",
+    "numero_factura": "número o null",
+    "concepto": "descripción",
+    "confidence": número del 0 al 100
+}"""
+
+# Campos de texto del esquema (string o null) para validar los resultados por lotes
+EXTRACTION_TEXT_FIELDS = [
+    "resumen", "moneda", "ruc_emisor", "razon_social_emisor",
+    "fecha_emision", "fecha_vencimiento", "numero_factura", "concepto",
+]
+
+
+def _gemini_response_text(response) -> str:
+    """Texto de la respuesta de Gemini; lanza ValueError si viene vacía."""
+    # Parseo robusto: algunas versiones devuelven .text; otras requieren candidates/parts
+    response_text = getattr(response, "text", None)
+    if not response_text:
+        # Fallback robusto
+        cand = (getattr(response, "candidates", []) or [None])[0]
+        if cand and hasattr(cand, "content") and cand.content and cand.content.parts:
+            response_text = "".join(getattr(p, "text", "") or "" for p in cand.content.parts)
+
+    if not response_text:
+        raise ValueError("Gemini no devolvió texto")
+    return response_text.strip()
+
+
+def _parse_gemini_json(response_text: str, opening: str = "{", closing: str = "}") -> Any:
+    """
+    Parsea el JSON de una respuesta de Gemini, quitando bloques ```json. Si
+    falla, reintenta con lo que haya entre el primer `opening` y el último `closing`.
+    """
+    # Limpiar bloques ```json
+    if "```json" in response_text:
+        response_text = response_text.split("```json", 1)[1].split("```", 1)[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```", 1)[1].split("```", 1)[0].strip()
+
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        start = response_text.find(opening)
+        end = response_text.rfind(closing)
+        if start != -1 and end != -1 and end > start:
+            return json.loads(response_text[start:end+1])
+        raise
+
+
+def _gemini_error_data(e: Exception) -> Dict[str, Any]:
+    """Resultado de extracción para un error de Gemini (no se guarda en la factura)."""
+    return {
+        "error": str(e),
+        # Gemini saturado o caído: el cliente puede reintentar más tarde (503)
+        "retryable": isinstance(e, gemini_client.GeminiError) and e.retryable,
+        "es_factura": False,
+        "resumen": f"Error al procesar: {str(e)}",
+        "monto_total": None,
+        "moneda": None,
+        "ruc_emisor": None,
+        "razon_social_emisor": None,
+        "fecha_emision": None,
+        "fecha_vencimiento": None,
+        "numero_factura": None,
+        "concepto": "Error en procesamiento",
+        "confidence": 0
+    }
 
 
 def process_invoice_with_gemini(pdf_text: str) -> Dict[str, Any]:
@@ -118,101 +641,204 @@ def process_invoice_with_gemini(pdf_text: str) -> Dict[str, Any]:
         }
     
     try:
-        # Limitar texto a 4000 caracteres para no exceder límites
-        texto_limitado = pdf_text[:4000] if len(pdf_text) > 4000 else pdf_text
+        # Limitar texto a PDF_TEXT_MAX_CHARS caracteres para no exceder límites
+        texto_limitado = pdf_text[:PDF_TEXT_MAX_CHARS]
         
         prompt = f"""
 Analiza el siguiente documento y extrae información relevante.
 
-Si es una factura peruana, extrae:
-- Monto total (número con decimales)
-- Moneda (PEN, USD, etc.)
-- RUC del emisor (11 dígitos)
-- Razón social del emisor
-- Fecha de emisión (YYYY-MM-DD)
-- Fecha de vencimiento (YYYY-MM-DD)
-- Número de factura
-- Concepto/descripción
-
-Si NO es una factura, resume el contenido principal del documento.
+{EXTRACTION_INSTRUCTIONS}
 
 Texto del documento:
 {texto_limitado}
 
 Devuelve SOLO un objeto JSON válido con esta estructura (sin comentarios):
-{{
-    "es_factura": true o false,
-    "resumen": "breve resumen si no es factura",
-    "monto_total": "valor o null",
-    "moneda": "PEN/USD o null",
-    "ruc_emisor": "número o null",
-    "razon_social_emisor": "nombre o null",
-    "fecha_emision": "YYYY-MM-DD o null",
-    "fecha_vencimiento": "YYYY-MM-DD o null",
-    "numero_factura": "número o null",
-    "concepto": "descripción",
-    "confidence": número del 0 al 100
-}}
+{EXTRACTION_SCHEMA}
 """
         
         # Usar el modelo ya inicializado
-        response = GEMINI_MODEL.generate_content(prompt)
-        
-        # Parseo robusto: algunas versiones devuelven .text; otras requieren candidates/parts
-        response_text = getattr(response, "text", None)
-        if not response_text:
-            # Fallback robusto
-            cand = (getattr(response, "candidates", []) or [None])[0]
-            if cand and hasattr(cand, "content") and cand.content and cand.content.parts:
-                response_text = "".join(getattr(p, "text", "") or "" for p in cand.content.parts)
+        metrics.gemini_chars.observe(len(prompt), kind="prompt")
+        response = gemini_api.generate(prompt)
         
-        if not response_text:
-            raise ValueError("Gemini no devolvió texto")
-        
-        response_text = response_text.strip()
+        response_text = _gemini_response_text(response)
+        metrics.gemini_chars.observe(len(response_text), kind="response")
         
         print(f"🤖 Respuesta de Gemini: {response_text[:200]}...")
         
-        # Limpiar bloques ```json
-        if "```json" in response_text:
-            response_text = response_text.split("```json", 1)[1].split("```", 1)[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```", 1)[1].split("```", 1)[0].strip()
-        
-        # Intentar parsear JSON; si falla, buscar el primer/último { }
-        try:
-            extracted_data = json.loads(response_text)
-        except json.JSONDecodeError:
-            start = response_text.find("{")
-            end = response_text.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                extracted_data = json.loads(response_text[start:end+1])
-            else:
-                raise
+        extracted_data = _parse_gemini_json(response_text)
         
         print(f"✅ Datos extraídos: {extracted_data}")
         
         return extracted_data
         
     except Exception as e:
+        if not isinstance(e, gemini_client.GeminiError):
+            # Gemini respondió pero no con el JSON pedido (los fallos de la llamada ya cuentan en "gemini")
+            metrics.record_error("gemini_parse")
         print(f"❌ Error procesando con Gemini: {e}")
         import traceback
         traceback.print_exc()
         
-        return {
-            "error": str(e),
-            "es_factura": False,
-            "resumen": f"Error al procesar: {str(e)}",
-            "monto_total": None,
-            "moneda": None,
-            "ruc_emisor": None,
-            "razon_social_emisor": None,
-            "fecha_emision": None,
-            "fecha_vencimiento": None,
-            "numero_factura": None,
-            "concepto": "Error en procesamiento",
-            "confidence": 0
-        }
+        return _gemini_error_data(e)
+
+
+_gemini_limits: Optional[tuple] = None
+
+
+def _gemini_token_limits() -> tuple[int, int]:
+    """
+    Límites (entrada, salida) de tokens del modelo según la API, acotados por
+    GEMINI_INPUT_TOKEN_LIMIT / GEMINI_OUTPUT_TOKEN_LIMIT. Se consulta una vez.
+    """
+    global _gemini_limits
+    if _gemini_limits is None:
+        limits = (GEMINI_INPUT_TOKEN_LIMIT, GEMINI_OUTPUT_TOKEN_LIMIT)
+        if GEMINI_API_KEY and NEO_BACKENDS != "fake":
+            try:
+                services.registry.get("gemini")  # genai.configure con la API key
+                info = genai.get_model(GEMINI_MODEL_ID)
+                limits = (min(limits[0], info.input_token_limit), min(limits[1], info.output_token_limit))
+            except Exception as e:
+                print(f"⚠️ No se pudieron leer los límites de {GEMINI_MODEL_ID}: {e}")
+        _gemini_limits = limits
+    return _gemini_limits
+
+
+def gemini_batch_limits() -> tuple[int, int]:
+    """
+    Tamaño máximo de un prompt por lotes: (facturas, tokens de entrada).
+    La salida del modelo limita cuántos objetos JSON caben en la respuesta; la
+    entrada, el contexto y el cupo de tokens/min del limitador.
+    """
+    input_limit, output_limit = _gemini_token_limits()
+    # 20% de margen: la estimación de tokens es aproximada (~4 caracteres por token)
+    by_output = int(output_limit * 0.8) // GEMINI_OUTPUT_TOKENS_PER_INVOICE
+    max_items = max(1, min(GEMINI_BATCH_MAX_INVOICES, by_output))
+    max_input_tokens = int(min(input_limit, GEMINI_TPM) * 0.8) - len(EXTRACTION_INSTRUCTIONS + EXTRACTION_SCHEMA) // 4
+    return max_items, max_input_tokens
+
+
+def gemini_batch_item_tokens(pdf_text: str) -> int:
+    """Tokens estimados que ocupa una factura dentro de un prompt por lotes."""
+    return len(pdf_text[:PDF_TEXT_MAX_CHARS]) // 4 + 16  # delimitadores
+
+
+def _validate_extraction(item: Any) -> Optional[Dict[str, Any]]:
+    """Devuelve el objeto (sin invoiceId) si cumple el esquema de extracción; si no, None."""
+    if not isinstance(item, dict) or not isinstance(item.get("es_factura"), bool):
+        return None
+    confidence = item.get("confidence")
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 100:
+        return None
+    if not isinstance(item.get("monto_total"), (str, int, float, type(None))) or isinstance(item.get("monto_total"), bool):
+        return None
+    if any(not isinstance(item.get(field), (str, type(None))) for field in EXTRACTION_TEXT_FIELDS):
+        return None
+    return {k: v for k, v in item.items() if k != "invoiceId"}
+
+
+def process_invoices_with_gemini_batch(texts: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Extrae varias facturas ({invoiceId: texto}) con un solo prompt: cada texto
+    va entre delimitadores <<<FACTURA id>>> / <<<FIN id>>> y Gemini devuelve un
+    arreglo JSON con un objeto por invoiceId. Las facturas que falten en la
+    respuesta o no cumplan el esquema se procesan de a una con
+    process_invoice_with_gemini. Devuelve {invoiceId: datos extraídos}.
+    """
+    if len(texts) == 1 or not GEMINI_AI_ENABLED:
+        return {invoice_id: process_invoice_with_gemini(text) for invoice_id, text in texts.items()}
+
+    # "<<<" dentro del texto podría cerrar un bloque antes de tiempo
+    blocks = "\n\n".join(
+        f"<<<FACTURA {invoice_id}>>>\n{text[:PDF_TEXT_MAX_CHARS].replace('<<<', '<< <')}\n<<<FIN {invoice_id}>>>"
+        for invoice_id, text in texts.items()
+    )
+    prompt = f"""
+Analiza los siguientes {len(texts)} documentos y extrae información relevante de cada uno.
+
+{EXTRACTION_INSTRUCTIONS}
+
+Cada documento va entre <<<FACTURA id>>> y <<<FIN id>>>; analízalos por separado.
+
+{blocks}
+
+Devuelve SOLO un arreglo JSON válido con un objeto por documento (sin comentarios).
+Cada objeto incluye "invoiceId" (el id de su delimitador) y esta estructura:
+{EXTRACTION_SCHEMA}
+"""
+    output_tokens = len(texts) * GEMINI_OUTPUT_TOKENS_PER_INVOICE
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        metrics.gemini_chars.observe(len(prompt), kind="batch_prompt")
+        response = gemini_api.generate(
+            prompt,
+            output_tokens=output_tokens,
+            generation_config={"max_output_tokens": min(_gemini_token_limits()[1], output_tokens * 2)},
+        )
+        response_text = _gemini_response_text(response)
+        metrics.gemini_chars.observe(len(response_text), kind="batch_response")
+
+        items = _parse_gemini_json(response_text, "[", "]")
+        if not isinstance(items, list):
+            raise ValueError("Gemini no devolvió un arreglo JSON")
+        for item in items:
+            invoice_id = item.get("invoiceId") if isinstance(item, dict) else None
+            if invoice_id in texts and invoice_id not in results:
+                extracted_data = _validate_extraction(item)
+                if extracted_data is not None:
+                    results[invoice_id] = extracted_data
+    except gemini_client.GeminiError as e:
+        if e.retryable:
+            # Gemini saturado o caído: repetir de a una solo multiplicaría la carga
+            print(f"❌ Prompt por lotes de {len(texts)} facturas falló: {e}")
+            metrics.gemini_batch_items.inc(len(texts), outcome="error")
+            return {invoice_id: _gemini_error_data(e) for invoice_id in texts}
+        print(f"❌ Prompt por lotes de {len(texts)} facturas rechazado: {e} - se procesan de a una")
+    except Exception as e:
+        metrics.record_error("gemini_parse")
+        print(f"❌ Respuesta inválida del prompt por lotes: {e} - se procesan de a una")
+
+    missing = [invoice_id for invoice_id in texts if invoice_id not in results]
+    metrics.gemini_batch_items.inc(len(results), outcome="ok")
+    if missing:
+        metrics.gemini_batch_items.inc(len(missing), outcome="fallback")
+        print(f"↩️ {len(missing)} de {len(texts)} facturas sin resultado válido en el lote - llamadas individuales")
+    print(f"🤖 Lote de Gemini: {len(results)}/{len(texts)} facturas en un solo prompt")
+    for invoice_id in missing:
+        results[invoice_id] = process_invoice_with_gemini(texts[invoice_id])
+    return results
+
+
+def _extract_locally(pdf_text: str) -> Optional[Dict[str, Any]]:
+    """
+    Resultado de sunat_extractor si alcanza LOCAL_EXTRACTION_MIN_CONFIDENCE y
+    trae todos los campos obligatorios (moneda, vencimiento...); si no, None.
+    """
+    with metrics.stage("local_extract"):
+        local_data = sunat_extractor.extract_invoice_fields(pdf_text)
+    complete = sunat_extractor.is_complete(local_data)
+    if complete and local_data["confidence"] >= LOCAL_EXTRACTION_MIN_CONFIDENCE:
+        print(f"⚡ Extracción local con confianza {local_data['confidence']} - sin llamar a Gemini")
+        return local_data
+
+    metrics.record_error("local_extract")
+    reason = "" if complete else " y campos obligatorios faltantes"
+    print(f"🔎 Extracción local con confianza {local_data['confidence']}{reason} - usando Gemini")
+    return None
+
+
+def extract_invoice_data(pdf_text: str) -> Dict[str, Any]:
+    """
+    Extrae los datos de la factura: primero con reglas locales (sunat_extractor)
+    y solo si su confianza no llega a LOCAL_EXTRACTION_MIN_CONFIDENCE con Gemini.
+    """
+    local_data = _extract_locally(pdf_text)
+    if local_data is not None:
+        return local_data
+
+    extracted_data = process_invoice_with_gemini(pdf_text)
+    extracted_data.setdefault("extractor", "gemini")
+    return extracted_data
 
 
 def require_admin(uid: str, role: Optional[str]):
@@ -223,9 +849,559 @@ def require_admin(uid: str, role: Optional[str]):
         raise ValueError("Se requiere rol de administrador")
 
 
+# -----------------------------------------------------------------------------
+# Directorio de proveedores
+# -----------------------------------------------------------------------------
+class SupplierDirectory:
+    """
+    Resuelve la información de proveedores (Auth + colección suppliers) por
+    lotes: un auth.get_users por cada 100 UIDs y un get_all de Firestore, en
+    lugar de dos RPCs por proveedor. Los resultados quedan en una caché LRU
+    con TTL en memoria del proceso.
+    """
+
+    PROFILE_FIELDS = ["ruc", "razonSocial", "representanteLegal", "direccion", "status"]
+    AUTH_BATCH_SIZE = 100  # máximo permitido por auth.get_users
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry(uid: str, user=None, profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "uid": uid,
+            "found": user is not None,
+            "email": user.email if user else None,
+            "displayName": user.display_name if user else None,
+            "createdAt": user.user_metadata.creation_timestamp if user else None,
+            "role": (user.custom_claims or {}).get("role") if user else None,
+            "profileExists": profile is not None,
+            "profile": {f: (profile or {}).get(f) for f in SupplierDirectory.PROFILE_FIELDS},
+        }
+
+    def _get_cached(self, uid: str) -> Optional[Dict[str, Any]]:
+        item = self._entries.get(uid)
+        if item is None:
+            return None
+        expires_at, entry = item
+        if expires_at < time.monotonic():
+            del self._entries[uid]
+            return None
+        self._entries.move_to_end(uid)
+        return entry
+
+    def _store(self, entries: Dict[str, Dict[str, Any]]):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for uid, entry in entries.items():
+                self._entries[uid] = (expires_at, entry)
+                self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fetch_profiles(self, uids: List[str]) -> Dict[str, Dict[str, Any]]:
+        coll = firestore_client.collection("suppliers")
+        refs = [coll.document(uid) for uid in uids]
+        return {
+            snap.id: snap.to_dict() or {}
+            for snap in firestore_client.get_all(refs, field_paths=self.PROFILE_FIELDS)
+            if snap.exists
+        }
+
+    def get_many(self, uids, known_users=None, known_profiles=None) -> Dict[str, Dict[str, Any]]:
+        """
+        Devuelve {uid: info} para los UIDs pedidos (sin duplicados).
+        `known_users` permite pasar UserRecords ya obtenidos (ej. desde list_users)
+        para no volver a pedirlos a Auth; `known_profiles` ({uid: datos}) hace lo
+        mismo con los perfiles de la colección suppliers.
+        """
+        wanted = list(dict.fromkeys(u for u in uids if u))
+        result: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        with self._lock:
+            for uid in wanted:
+                entry = self._get_cached(uid)
+                if entry is None:
+                    missing.append(uid)
+                else:
+                    result[uid] = entry
+            self.hits += len(result)
+            self.misses += len(missing)
+        if not missing:
+            return result
+
+        users = {u.uid: u for u in (known_users or []) if u.uid in missing}
+        to_lookup = [uid for uid in missing if uid not in users]
+        for i in range(0, len(to_lookup), self.AUTH_BATCH_SIZE):
+            chunk = to_lookup[i:i + self.AUTH_BATCH_SIZE]
+            lookup = fb_auth.get_users([fb_auth.UidIdentifier(uid) for uid in chunk])
+            users.update({u.uid: u for u in lookup.users})
+
+        profiles = {uid: p for uid, p in (known_profiles or {}).items() if uid in missing}
+        to_fetch = [uid for uid in missing if uid not in profiles]
+        if to_fetch:
+            profiles.update(self._fetch_profiles(to_fetch))
+        fetched = {uid: self._entry(uid, users.get(uid), profiles.get(uid)) for uid in missing}
+        self._store(fetched)
+        result.update(fetched)
+        return result
+
+    def enrich_invoices(self, items: List[Dict[str, Any]]):
+        """
+        Agrega supplierEmail y supplierRuc a facturas serializadas (vistas de
+        admin), resolviendo los proveedores distintos en lote. Si falla, las
+        facturas quedan sin esos campos en vez de fallar la respuesta.
+        """
+        try:
+            suppliers = self.get_many(item.get("supplierUid") for item in items)
+        except Exception as e:
+            print(f"Error obteniendo info del proveedor: {e}")
+            return
+        for data in items:
+            supplier = suppliers.get(data.get("supplierUid"))
+            if supplier and supplier["found"]:
+                data["supplierEmail"] = supplier["email"]
+            if supplier and supplier["profileExists"]:
+                data["supplierRuc"] = supplier["profile"]["ruc"]
+
+    def invalidate(self, uid: str):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+supplier_directory = SupplierDirectory(SUPPLIER_CACHE_TTL, SUPPLIER_CACHE_SIZE)
+
+
+# -----------------------------------------------------------------------------
+# Contadores del dashboard (stats/global/shards/{k})
+# -----------------------------------------------------------------------------
+# Los totales que antes se calculaban recorriendo toda la colección (facturas
+# por estado, procesadas, proveedores distintos) están repartidos en
+# STATS_SHARDS documentos: cada escritura sobre facturas suma su delta con
+# Increment en un shard al azar, en la misma transacción/batch y sin leerlo,
+# y el dashboard los suma. Las últimas STATS_RECENT_SIZE facturas se leen con
+# una consulta por createdAt.
+# Los proveedores ya contados se marcan en stats/global/suppliers/{uid}.
+#
+# La versión que valida los ETag de los listados vive aparte, repartida en
+# stats/version/shards/{k}: la suben todas las escrituras que cambian campos
+# listados (facturas, trabajos, perfiles).
+
+def _stats_ref():
+    return firestore_client.collection("stats").document("global")
+
+
+def _stats_supplier_ref(supplier_uid: str):
+    return _stats_ref().collection("suppliers").document(supplier_uid)
+
+
+def _counter_shards():
+    return _stats_ref().collection("shards")
+
+
+def _add_stats_delta(writer, by_status: Optional[Dict[str, int]] = None, total: int = 0,
+                     processed: int = 0, suppliers: int = 0):
+    """Suma los contadores en un shard al azar, dentro de la transacción o batch `writer`."""
+    shard = _counter_shards().document(str(random.randrange(STATS_SHARDS)))
+    writer.set(shard, _stats_delta(by_status, total, processed, suppliers), merge=True)
+
+
+def _stats_delta(by_status: Optional[Dict[str, int]] = None, total: int = 0, processed: int = 0,
+                 suppliers: int = 0) -> Dict[str, Any]:
+    """
+    Cambios para aplicar a un shard de contadores con set(..., merge=True):
+    Increment (atómicos también en batches sin transacción).
+    """
+    delta: Dict[str, Any] = {"updatedAt": firestore.SERVER_TIMESTAMP}
+    if total:
+        delta["total_invoices"] = firestore.Increment(total)
+    if processed:
+        delta["processed_count"] = firestore.Increment(processed)
+    if suppliers:
+        delta["total_suppliers"] = firestore.Increment(suppliers)
+    status_changes = {
+        status: firestore.Increment(n) for status, n in (by_status or {}).items()
+        if n and status in VALID_STATUSES
+    }
+    if status_changes:
+        delta["by_status"] = status_changes
+    return delta
+
+
+def _version_shards():
+    return firestore_client.collection("stats").document("version").collection("shards")
+
+
+def _bump_list_version(writer):
+    """
+    Sube la versión de los listados en un shard al azar, dentro de la
+    transacción o batch `writer` que cambia los campos listados.
+    """
+    writer.set(_version_shards().document(str(random.randrange(STATS_SHARDS))), {
+        "version": firestore.Increment(1),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def _recent_entry(invoice_id: str, data: Dict[str, Any], created_at: Optional[str]) -> Dict[str, Any]:
+    return {
+        "invoiceId": invoice_id,
+        "status": data.get("status"),
+        "monto_total": data.get("monto_total"),
+        "createdAt": created_at,
+    }
+
+
+def _run_in_transaction(callback):
+    """Ejecuta callback(transaction) en una transacción de Firestore (con reintentos)."""
+    return firestore.transactional(callback)(firestore_client.transaction())
+
+
+def _not_modified(etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """
+    Respuesta 304 si el If-None-Match del cliente coincide con el ETag actual
+    (se revisa antes de consultar Firestore o serializar); None si no.
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return _with_validators(Response(status=304), etag, last_modified)
+
+
+def _with_validators(response: Response, etag: str, last_modified: Optional[datetime] = None) -> Response:
+    """
+    ETag débil + Last-Modified. `no-cache` hace que el navegador guarde la
+    respuesta pero la revalide siempre (If-None-Match) en el siguiente fetch.
+    """
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Authorization")
+    return response
+
+
+def _stats_version() -> tuple[Optional[int], Optional[datetime]]:
+    """
+    (versión, última escritura) de los listados: suma de los shards de
+    stats/version (una consulta de STATS_SHARDS documentos chicos). Sube con
+    cada escritura de campos listados, así que sirve de validador barato.
+    (None, None) si todavía no hay shards.
+    """
+    snaps = list(_version_shards().select(["version"]).stream())
+    if not snaps:
+        return None, None
+    version = sum((snap.to_dict() or {}).get("version") or 0 for snap in snaps)
+    return version, max(snap.update_time for snap in snaps)
+
+
+def _recent_invoices() -> List[Dict[str, Any]]:
+    """Las últimas STATS_RECENT_SIZE facturas (una consulta chica por createdAt)."""
+    q = (firestore_client.collection("invoices").select(["status", "monto_total", "createdAt"])
+         .order_by("createdAt", direction=firestore.Query.DESCENDING).limit(STATS_RECENT_SIZE))
+    recent = []
+    for doc in q.stream():
+        data = doc.to_dict() or {}
+        created_at = data.get("createdAt")
+        recent.append(_recent_entry(doc.id, data, created_at.isoformat() if created_at else None))
+    return recent
+
+
+def read_dashboard_stats() -> Dict[str, Any]:
+    """
+    Suma los shards de contadores (una consulta) y agrega las facturas
+    recientes. Sin shards (base nueva o contadores nunca reconstruidos) los
+    contadores valen cero: reconstruirlos es `flask rebuild-stats`, no algo
+    que haga una request.
+    """
+    snaps = list(_counter_shards().stream())
+    if not snaps:
+        print("⚠️ Sin contadores del dashboard: ejecute flask --app app rebuild-stats")
+    stats = {
+        "total_invoices": 0,
+        "by_status": {status: 0 for status in VALID_STATUSES},
+        "processed_count": 0,
+        "total_suppliers": 0,
+    }
+    for snap in snaps:
+        data = snap.to_dict() or {}
+        for key in ("total_invoices", "processed_count", "total_suppliers"):
+            stats[key] += data.get(key) or 0
+        for status, n in (data.get("by_status") or {}).items():
+            if status in stats["by_status"]:
+                stats["by_status"][status] += n or 0
+    stats["recent_invoices"] = _recent_invoices()
+    return stats
+
+
+def rebuild_dashboard_stats(write: bool = True) -> Dict[str, Any]:
+    """
+    Recalcula los contadores recorriendo la colección una sola vez (solo los
+    campos necesarios) y, si write, los deja en el shard 0 (borrando los demás)
+    junto con las marcas de proveedores. Se usa para reconciliar o para
+    inicializar los contadores.
+    """
+    stats = {
+        "total_invoices": 0,
+        "by_status": {status: 0 for status in VALID_STATUSES},
+        "processed_count": 0,
+        "total_suppliers": 0,
+        "recent_invoices": [],
+    }
+    suppliers: Dict[str, str] = {}
+    recent_heap: List[tuple] = []
+
+    fields = ["status", "processed", "supplierUid", "createdAt", "monto_total"]
+    for doc in firestore_client.collection("invoices").select(fields).stream():
+        data = doc.to_dict() or {}
+        stats["total_invoices"] += 1
+        status = data.get("status", "Recibida")
+        if status in stats["by_status"]:
+            stats["by_status"][status] += 1
+        if data.get("processed"):
+            stats["processed_count"] += 1
+        if data.get("supplierUid"):
+            suppliers.setdefault(data["supplierUid"], doc.id)
+        created_at = data.get("createdAt")
+        if hasattr(created_at, "timestamp"):
+            item = (created_at.timestamp(), doc.id, data)
+            if len(recent_heap) < STATS_RECENT_SIZE:
+                heapq.heappush(recent_heap, item)
+            else:
+                heapq.heappushpop(recent_heap, item)
+
+    stats["total_suppliers"] = len(suppliers)
+    for _, invoice_id, data in sorted(recent_heap, reverse=True):
+        stats["recent_invoices"].append(_recent_entry(invoice_id, data, data["createdAt"].isoformat()))
+
+    if write:
+        refs = [(_stats_supplier_ref(uid), first_invoice) for uid, first_invoice in suppliers.items()]
+        for i in range(0, len(refs), 500):
+            batch = firestore_client.batch()
+            for ref, first_invoice in refs[i:i + 500]:
+                batch.set(ref, {"firstInvoiceId": first_invoice})
+            batch.commit()
+        batch = firestore_client.batch()
+        for shard in _counter_shards().select([]).stream():
+            if shard.id != "0":
+                batch.delete(shard.reference)
+        batch.set(_counter_shards().document("0"), {
+            **{key: value for key, value in stats.items() if key != "recent_invoices"},
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+        batch.set(_stats_ref(), {"rebuiltAt": firestore.SERVER_TIMESTAMP}, merge=True)
+        # Los contadores cambiaron: invalidar el ETag del dashboard
+        _bump_list_version(batch)
+        batch.commit()
+    return stats
+
+
+_INVOICE_NUMBER = re.compile(r"([A-Z0-9]{1,4})-0*(\d{1,8})")
+
+
+def _invoice_key(ruc: Any, numero: Any) -> Optional[str]:
+    """
+    Clave única de una factura en invoice_keys: "{ruc}_{serie}-{número}"
+    (ej. 20100047218_F001-123). El número va sin ceros a la izquierda para
+    que F001-00000123 y F001-123 coincidan. None si falta el RUC (11 dígitos)
+    o el número no tiene la forma serie-número.
+    """
+    ruc = re.sub(r"\D", "", str(ruc or ""))
+    match = _INVOICE_NUMBER.fullmatch(re.sub(r"\s", "", str(numero or "")).upper())
+    if len(ruc) != 11 or not match:
+        return None
+    return f"{ruc}_{match.group(1)}-{match.group(2)}"
+
+
+def _invoice_keys_coll():
+    return firestore_client.collection("invoice_keys")
+
+
+def rebuild_invoice_keys(write: bool = True, page_size: int = INVOICE_KEYS_PAGE_SIZE) -> Dict[str, int]:
+    """
+    Construye invoice_keys sobre las facturas ya procesadas, de la más antigua
+    a la más nueva (la primera con cada clave queda como original). Lee por
+    páginas (solo los campos necesarios) y resuelve las claves de cada página
+    con un único get_all; las escrituras van en batches de FIRESTORE_BATCH_LIMIT.
+    """
+    fields = ["processed", "es_factura", "ruc_emisor", "numero_factura", "supplierUid",
+              "createdAt", "invoiceKey", "duplicateOf"]
+    q = (firestore_client.collection("invoices").select(fields)
+         .order_by("createdAt", direction=firestore.Query.ASCENDING))
+    owners: Dict[str, str] = {}  # clave -> factura original (las ya vistas en esta corrida)
+    counts = {"scanned": 0, "indexed": 0, "duplicates": 0, "updated": 0}
+    cursor = None
+    while True:
+        page_q = q.start_after(cursor) if cursor is not None else q
+        docs = list(page_q.limit(page_size).stream())
+        if not docs:
+            break
+        counts["scanned"] += len(docs)
+
+        keyed = []
+        for doc in docs:
+            data = doc.to_dict() or {}
+            key = _invoice_key(data.get("ruc_emisor"), data.get("numero_factura")) \
+                if data.get("processed") and data.get("es_factura") else None
+            if key:
+                keyed.append((doc, data, key))
+
+        # Dueños actuales de las claves de la página que aún no conocemos: un get_all
+        unknown = {key for _, _, key in keyed if key not in owners}
+        if unknown:
+            refs = [_invoice_keys_coll().document(key) for key in unknown]
+            for snap in firestore_client.get_all(refs, field_paths=["invoiceId"]):
+                if snap.exists:
+                    owners[snap.id] = (snap.to_dict() or {}).get("invoiceId")
+
+        writes = []
+        for doc, data, key in keyed:
+            owner = owners.get(key)
+            if owner is None:
+                owners[key] = owner = doc.id
+                counts["indexed"] += 1
+                writes.append(("set", _invoice_keys_coll().document(key), {
+                    "invoiceId": doc.id,
+                    "supplierUid": data.get("supplierUid"),
+                    "createdAt": firestore.SERVER_TIMESTAMP,
+                }))
+            duplicate_of = owner if owner != doc.id else None
+            if duplicate_of:
+                counts["duplicates"] += 1
+            if data.get("invoiceKey") != key or data.get("duplicateOf") != duplicate_of:
+                counts["updated"] += 1
+                writes.append(("update", doc.reference, {
+                    "invoiceKey": key,
+                    "duplicateOf": duplicate_of,
+                    "isDuplicate": duplicate_of is not None,
+                }))
+
+        if write:
+            for i in range(0, len(writes), FIRESTORE_BATCH_LIMIT - 1):
+                batch = firestore_client.batch()
+                for op, ref, payload in writes[i:i + FIRESTORE_BATCH_LIMIT - 1]:
+                    getattr(batch, op)(ref, payload)
+                # duplicateOf / isDuplicate salen en GET /invoices
+                _bump_list_version(batch)
+                batch.commit()
+
+        if len(docs) < page_size:
+            break
+        cursor = docs[-1]
+    return counts
+
+
+@app.cli.command("backfill-invoice-keys")
+@click.option("--dry-run", is_flag=True, help="Solo cuenta, sin escribir")
+@click.option("--page-size", default=INVOICE_KEYS_PAGE_SIZE, show_default=True)
+def backfill_invoice_keys_command(dry_run: bool, page_size: int):
+    """Construye invoice_keys y marca duplicados (flask --app app backfill-invoice-keys)."""
+    counts = rebuild_invoice_keys(write=not dry_run, page_size=page_size)
+    print(f"{'🔍' if dry_run else '✅'} {counts['scanned']} facturas leídas, {counts['indexed']} claves nuevas, "
+          f"{counts['duplicates']} duplicadas, {counts['updated']} facturas {'a actualizar' if dry_run else 'actualizadas'}")
+
+
+def rebuild_search_index(write: bool = True, page_size: int = SEARCH_INDEX_PAGE_SIZE) -> Dict[str, int]:
+    """
+    Recalcula searchTokens de todas las facturas (tras cambiar los campos o
+    la normalización de search.py). Lee por páginas solo los campos indexados
+    y escribe en batches únicamente las facturas cuyo índice cambió.
+    """
+    fields = list(search.FIELD_WEIGHTS) + ["searchTokens", "createdAt"]
+    q = (firestore_client.collection("invoices").select(fields)
+         .order_by("createdAt", direction=firestore.Query.ASCENDING))
+    counts = {"scanned": 0, "updated": 0}
+    cursor = None
+    while True:
+        page_q = q.start_after(cursor) if cursor is not None else q
+        docs = list(page_q.limit(page_size).stream())
+        if not docs:
+            break
+        counts["scanned"] += len(docs)
+        writes = []
+        for doc in docs:
+            data = doc.to_dict() or {}
+            tokens = search.index_tokens(data)
+            if data.get("searchTokens") != tokens:
+                writes.append((doc.reference, tokens))
+        counts["updated"] += len(writes)
+        if write:
+            for i in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+                batch = firestore_client.batch()
+                for ref, tokens in writes[i:i + FIRESTORE_BATCH_LIMIT]:
+                    batch.update(ref, {"searchTokens": tokens})
+                batch.commit()
+        if len(docs) < page_size:
+            break
+        cursor = docs[-1]
+    return counts
+
+
+@app.cli.command("rebuild-search-index")
+@click.option("--dry-run", is_flag=True, help="Solo cuenta, sin escribir")
+@click.option("--page-size", default=SEARCH_INDEX_PAGE_SIZE, show_default=True)
+def rebuild_search_index_command(dry_run: bool, page_size: int):
+    """Recalcula searchTokens de las facturas (flask --app app rebuild-search-index)."""
+    counts = rebuild_search_index(write=not dry_run, page_size=page_size)
+    print(f"{'🔍' if dry_run else '✅'} {counts['scanned']} facturas leídas, "
+          f"{counts['updated']} {'a actualizar' if dry_run else 'actualizadas'}")
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Reconstruye los contadores del dashboard desde la colección invoices (flask --app app rebuild-stats)."""
+    before = read_dashboard_stats()
+    stats = rebuild_dashboard_stats(write=True)
+    for key in ("total_invoices", "processed_count", "total_suppliers", "by_status"):
+        if before.get(key) != stats[key]:
+            print(f"🔧 {key}: {before.get(key)} -> {stats[key]}")
+    print(f"✅ Contadores del dashboard reconstruidos: {stats['total_invoices']} facturas")
+
+
 # -----------------------------------------------------------------------------
 # Rutas
 # -----------------------------------------------------------------------------
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _add_server_timing(response):
+    """Histograma por endpoint y header Server-Timing con las etapas medidas."""
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.http_duration.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    header = metrics.server_timing_header(elapsed)
+    if header:
+        response.headers["Server-Timing"] = header
+    return response
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Body mayor que MAX_CONTENT_LENGTH (rechazado antes de leerlo)."""
+    return jsonify({
+        "error": "archivo demasiado grande",
+        "detail": f"el máximo permitido es {MAX_UPLOAD_MB} MB"
+    }), 413
+
+
 @app.get("/health")
 def health():
     """Health check endpoint"""
@@ -236,10 +1412,32 @@ def health():
             "firestore": "ok",
             "storage": "ok",
             "gemini_ai": "disabled" if not GEMINI_AI_ENABLED else "ok"
+        },
+        "gemini": gemini_api.stats(),
+        "caches": {
+            "auth": token_cache.stats(),
+            "suppliers": supplier_directory.stats()
         }
     }), 200
 
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Métricas del proceso en formato Prometheus (etapas del pipeline, requests,
+    cachés y cola). Requiere un admin o `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    auth_header = request.headers.get("Authorization", "")
+    if not (METRICS_TOKEN and auth_header == f"Bearer {METRICS_TOKEN}"):
+        try:
+            uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+            require_admin(uid, role)
+        except Exception as e:
+            return jsonify({"error": "no autorizado", "detail": str(e)}), 403
+
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.get("/_debug/gemini-models")
 def debug_gemini_models():
     """
@@ -258,248 +1456,1588 @@ def debug_gemini_models():
             "total": len(models)
         }), 200
     except Exception as e:
-        return jsonify({"enabled": True, "error": str(e)}), 500
+        return jsonify({"enabled": True, "error": str(e)}), 500
+
+
+def _create_invoice_record(invoice_id: str, uid: str, gcs_path: str, safe_name: str,
+                           pdf_sha256: Optional[str], pdf_size: int, deduplicated: bool):
+    """
+    Crea invoices/{invoice_id} junto con los contadores del dashboard, en una
+    transacción que solo lee la marca del proveedor (no los contadores).
+    Lanza AlreadyExists si la factura ya existe.
+    """
+    doc_ref = firestore_client.collection("invoices").document(invoice_id)
+    doc = {
+        "supplierUid": uid,
+        "storagePath": gcs_path,
+        "originalFilename": safe_name,
+        "pdfSha256": pdf_sha256,
+        "pdfSize": pdf_size,
+        "deduplicated": deduplicated,
+        "status": "Recibida",
+        # Campos de IA vacíos (se llenarán al procesar)
+        "monto_total": None,
+        "moneda": None,
+        "ruc_emisor": None,
+        "razon_social_emisor": None,
+        "fecha_emision": None,
+        "fecha_vencimiento": None,
+        "numero_factura": None,
+        "concepto": None,
+        "confidence": None,
+        "processed": False,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+    }
+    doc["searchTokens"] = search.index_tokens(doc)
+    supplier_marker_ref = _stats_supplier_ref(uid)
+
+    def _create(transaction):
+        new_supplier = not supplier_marker_ref.get(transaction=transaction).exists
+        transaction.create(doc_ref, doc)
+        if new_supplier:
+            transaction.set(supplier_marker_ref, {"firstInvoiceId": invoice_id})
+        _add_stats_delta(transaction, by_status={"Recibida": 1}, total=1, suppliers=int(new_supplier))
+        _bump_list_version(transaction)
+
+    with metrics.stage("firestore_write"):
+        _run_in_transaction(_create)
+
+
+@app.post("/invoices")
+def create_invoice():
+    """
+    Recibe un PDF, lo sube a Cloud Storage y crea documento en Firestore.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role()
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 401
+
+    # Validar archivo
+    if "file" not in request.files:
+        return jsonify({"error": "falta el archivo 'file' en form-data"}), 400
+
+    file = request.files["file"]
+    if not file or file.filename == "":
+        return jsonify({"error": "archivo vacío"}), 400
+
+    # Verificar que sea PDF
+    if not file.filename.lower().endswith('.pdf'):
+        return jsonify({"error": "solo se permiten archivos PDF"}), 400
+
+    # Nombre seguro y ruta en el bucket
+    invoice_id = f"inv_{uuid.uuid4().hex[:12]}"
+    safe_name = secure_filename(file.filename or "factura.pdf")
+    gcs_path = f"invoices/{uid}/{invoice_id}.pdf"
+
+    # Validar y calcular el SHA-256 por bloques, sin cargar el archivo en memoria
+    # (Werkzeug ya dejó la parte del multipart en un archivo temporal)
+    try:
+        with metrics.stage("pdf_scan"):
+            pdf_sha256, pdf_size = _scan_pdf_upload(file.stream)
+    except UploadTooLargeError as e:
+        return jsonify({"error": "archivo demasiado grande", "detail": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": "solo se permiten archivos PDF", "detail": str(e)}), 400
+
+    # Si este proveedor ya subió los mismos bytes, reutilizar ese objeto
+    try:
+        hash_ref = firestore_client.collection("pdf_hashes").document(pdf_sha256)
+        with metrics.stage("firestore_read"):
+            hash_doc = hash_ref.get()
+        existing_path = ((hash_doc.to_dict() or {}).get("blobs") or {}).get(uid) if hash_doc.exists else None
+    except Exception as e:
+        print(f"Error leyendo índice de hashes: {e}")
+        hash_doc, existing_path = None, None
+
+    # Extraer el texto en paralelo con la subida (salvo que ya esté guardado para estos bytes)
+    text_future = None
+    text_version = (hash_doc.to_dict() or {}).get("textVersion") if hash_doc is not None and hash_doc.exists else None
+    if PDF_TEXT_ON_UPLOAD and text_version != _pdf_text_version() \
+            and pdf_size <= PDF_TEXT_UPLOAD_MAX_MB * 1024 * 1024:
+        try:
+            pdf_path = _spool_upload_copy(file.stream)
+            text_future = _upload_text_pool.submit(_extract_and_store_pdf_text, pdf_sha256, pdf_path)
+        except Exception as e:
+            # Sin texto al subir se extrae al procesar
+            print(f"Error preparando extracción al subir: {e}")
+
+    deduplicated = existing_path is not None
+    if deduplicated:
+        gcs_path = existing_path
+        print(f"♻️ PDF duplicado ({pdf_sha256[:12]}), se reutiliza {gcs_path}")
+    else:
+        # Subir a Cloud Storage
+        try:
+            bucket = storage_client.bucket(BUCKET_NAME)
+            # Con chunk_size la subida es resumable y se envía por bloques
+            blob = bucket.blob(gcs_path, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
+            
+            # Metadata en la misma subida (sin un patch() adicional)
+            blob.cache_control = PDF_CACHE_CONTROL
+            blob.metadata = {"sha256": pdf_sha256, "supplierUid": uid}
+            
+            with metrics.stage("gcs_upload"):
+                blob.upload_from_file(file.stream, content_type="application/pdf", size=pdf_size)
+            metrics.stage_bytes.inc(pdf_size, stage="gcs_upload")
+            
+        except Exception as e:
+            print(f"Error subiendo a Storage: {e}")
+            return jsonify({"error": "error subiendo a Storage", "detail": str(e)}), 500
+
+        # Registrar el objeto en el índice pdf_hashes/{sha256}
+        try:
+            with metrics.stage("firestore_write"):
+                if hash_doc is not None and hash_doc.exists:
+                    hash_ref.update({f"blobs.{uid}": gcs_path})
+                else:
+                    hash_ref.set({
+                        "sha256": pdf_sha256,
+                        "size": pdf_size,
+                        "blobs": {uid: gcs_path},
+                        "firstInvoiceId": invoice_id,
+                        "createdAt": firestore.SERVER_TIMESTAMP,
+                    }, merge=True)
+        except Exception as e:
+            # El índice es una optimización: no bloquea la subida
+            print(f"Error actualizando índice de hashes: {e}")
+
+    # Crear documento en Firestore
+    try:
+        _create_invoice_record(invoice_id, uid, gcs_path, safe_name, pdf_sha256, pdf_size, deduplicated)
+    except Exception as e:
+        print(f"Error escribiendo en Firestore: {e}")
+        return jsonify({"error": "error escribiendo en Firestore", "detail": str(e)}), 500
+
+    # Esperar el texto: así un /process inmediato ya lo encuentra guardado
+    if text_future is not None:
+        try:
+            text_future.result(timeout=PDF_TEXT_TIMEOUT + 5)
+        except Exception as e:
+            print(f"Error extrayendo texto al subir: {e}")
+
+    return jsonify({
+        "invoiceId": invoice_id,
+        "status": "Recibida",
+        "storagePath": gcs_path,
+        "pdfSha256": pdf_sha256,
+        "deduplicated": deduplicated,
+        "message": "Factura subida. Use /invoices/<id>/process para procesar con IA"
+    }), 201
+
+
+def _signing_kwargs() -> Dict[str, Any]:
+    """
+    Las credenciales por defecto de Cloud Run no tienen clave privada: en ese
+    caso se firma con IAM signBlob pasando el email de la cuenta de servicio y
+    su access token (requiere roles/iam.serviceAccountTokenCreator sobre sí
+    misma). Con una clave de cuenta de servicio no hace falta nada.
+    """
+    credentials = getattr(storage_client, "_credentials", None)
+    if credentials is None:
+        return {}
+    from google.auth.credentials import Signing
+
+    if isinstance(credentials, Signing):
+        return {}
+    if not credentials.valid:
+        from google.auth.transport import requests as google_requests
+
+        credentials.refresh(google_requests.Request())
+    return {"service_account_email": credentials.service_account_email, "access_token": credentials.token}
+
+
+_download_urls: "OrderedDict[tuple, tuple]" = OrderedDict()
+_download_urls_lock = threading.Lock()
+
+
+def _signed_download_url(storage_path: str, filename: Optional[str]) -> tuple[str, datetime]:
+    """
+    URL firmada de lectura del PDF. Se reutiliza mientras le quede más de la
+    mitad de su vida: la misma URL permite que el navegador use su caché
+    (el objeto se sirve con Cache-Control PDF_CACHE_CONTROL).
+    Devuelve (url, expira_en).
+    """
+    now = datetime.now(timezone.utc)
+    ttl = timedelta(minutes=DOWNLOAD_URL_TTL_MINUTES)
+    safe_name = secure_filename(filename or "") or "factura.pdf"
+    # El nombre va firmado en la URL (response_disposition): forma parte de la clave
+    key = (storage_path, safe_name)
+    with _download_urls_lock:
+        cached = _download_urls.get(key)
+        if cached and cached[1] - now > ttl / 2:
+            _download_urls.move_to_end(key)
+            return cached
+
+    blob = storage_client.bucket(BUCKET_NAME).blob(storage_path)
+    url = blob.generate_signed_url(
+        version="v4",
+        expiration=ttl,
+        method="GET",
+        response_type="application/pdf",
+        response_disposition=f'inline; filename="{safe_name}"',
+        **_signing_kwargs(),
+    )
+    entry = (url, now + ttl)
+    with _download_urls_lock:
+        _download_urls[key] = entry
+        while len(_download_urls) > DOWNLOAD_URL_CACHE_SIZE:
+            _download_urls.popitem(last=False)
+    return entry
+
+
+def _is_invoice_id(value: str) -> bool:
+    return len(value) == 16 and value.startswith("inv_") and all(c in "0123456789abcdef" for c in value[4:])
+
+
+@app.post("/invoices/upload-url")
+def create_invoice_upload_url():
+    """
+    Devuelve una URL firmada (V4) para subir el PDF directo a Cloud Storage
+    con una subida resumable, sin pasar los bytes por el backend.
+    Body: {"filename": "factura.pdf", "size": 12345, "contentType": "application/pdf"}
+    El cliente hace POST a uploadUrl con los headers indicados, recibe la URL
+    de la sesión en Location, envía el archivo con PUT y luego llama a
+    POST /invoices/<invoiceId>/finalize.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role()
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 401
+
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or ""
+    content_type = data.get("contentType") or "application/pdf"
+    if not filename.lower().endswith(".pdf") or content_type != "application/pdf":
+        return jsonify({"error": "solo se permiten archivos PDF"}), 400
+    size = data.get("size")
+    if size is not None:
+        if not isinstance(size, int) or size <= len(PDF_MAGIC):
+            return jsonify({"error": "body inválido", "detail": "'size' debe ser el tamaño del archivo en bytes"}), 400
+        if size > MAX_UPLOAD_BYTES:
+            return jsonify({
+                "error": "archivo demasiado grande",
+                "detail": f"el máximo permitido es {MAX_UPLOAD_MB} MB"
+            }), 413
+
+    invoice_id = f"inv_{uuid.uuid4().hex[:12]}"
+    gcs_path = f"invoices/{uid}/{invoice_id}.pdf"
+    # Headers firmados: el cliente debe enviarlos tal cual al iniciar la sesión
+    headers = {
+        "Content-Type": "application/pdf",
+        "x-goog-resumable": "start",
+        "x-goog-content-length-range": f"0,{MAX_UPLOAD_BYTES}",
+        "Cache-Control": PDF_CACHE_CONTROL,
+        "x-goog-meta-supplieruid": uid,
+    }
+    try:
+        blob = storage_client.bucket(BUCKET_NAME).blob(gcs_path)
+        upload_url = blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(minutes=UPLOAD_URL_TTL_MINUTES),
+            method="POST",
+            content_type="application/pdf",
+            headers={k: v for k, v in headers.items() if k != "Content-Type"},
+            **_signing_kwargs(),
+        )
+    except Exception as e:
+        print(f"Error firmando URL de subida: {e}")
+        return jsonify({"error": "error generando URL de subida", "detail": str(e)}), 500
+
+    return jsonify({
+        "invoiceId": invoice_id,
+        "uploadUrl": upload_url,
+        "method": "POST",
+        "headers": headers,
+        "storagePath": gcs_path,
+        "maxBytes": MAX_UPLOAD_BYTES,
+        "expiresAt": (datetime.now(timezone.utc) + timedelta(minutes=UPLOAD_URL_TTL_MINUTES)).isoformat(),
+        "finalizeUrl": f"/invoices/{invoice_id}/finalize"
+    }), 200
+
+
+@app.post("/invoices/<invoice_id>/finalize")
+def finalize_invoice_upload(invoice_id: str):
+    """
+    Verifica el PDF subido con la URL de /invoices/upload-url (existe, tamaño,
+    tipo y firma %PDF- leyendo solo el primer KB) y crea la factura.
+    Body opcional: {"filename": "factura.pdf"} (nombre original a mostrar).
+    El SHA-256 se calcula al procesar, cuando el backend descarga el PDF.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role()
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 401
+
+    if not _is_invoice_id(invoice_id):
+        return jsonify({"error": "invoiceId inválido"}), 400
+
+    data = request.get_json(silent=True) or {}
+    safe_name = secure_filename(data.get("filename") or "factura.pdf") or "factura.pdf"
+    gcs_path = f"invoices/{uid}/{invoice_id}.pdf"
+
+    try:
+        bucket = storage_client.bucket(BUCKET_NAME)
+        with metrics.stage("gcs_metadata"):
+            blob = bucket.get_blob(gcs_path)
+        if blob is None:
+            return jsonify({
+                "error": "archivo no encontrado",
+                "detail": "suba el PDF con la URL de /invoices/upload-url antes de finalizar"
+            }), 404
+
+        rejection = None
+        if blob.size is None or blob.size > MAX_UPLOAD_BYTES:
+            rejection = ({"error": "archivo demasiado grande", "detail": f"el máximo permitido es {MAX_UPLOAD_MB} MB"}, 413)
+        else:
+            with metrics.stage("gcs_download"):
+                head = blob.download_as_bytes(start=0, end=1023)
+            # Misma regla que _scan_pdf_upload: la firma puede venir tras basura en el primer KB
+            if PDF_MAGIC not in head:
+                rejection = ({"error": "solo se permiten archivos PDF", "detail": "el archivo no tiene la firma %PDF-"}, 400)
+        if rejection:
+            # Misma etapa que la validación de POST /invoices
+            metrics.record_error("pdf_scan")
+            # No dejar en el bucket objetos que nunca serán facturas
+            blob.delete()
+            return jsonify(rejection[0]), rejection[1]
+    except Exception as e:
+        print(f"Error verificando el PDF subido: {e}")
+        return jsonify({"error": "error verificando el archivo", "detail": str(e)}), 500
+
+    try:
+        _create_invoice_record(invoice_id, uid, gcs_path, safe_name, None, blob.size, False)
+    except gexceptions.AlreadyExists:
+        return jsonify({"error": "la factura ya fue registrada", "invoiceId": invoice_id}), 409
+    except Exception as e:
+        print(f"Error escribiendo en Firestore: {e}")
+        return jsonify({"error": "error escribiendo en Firestore", "detail": str(e)}), 500
+
+    return jsonify({
+        "invoiceId": invoice_id,
+        "status": "Recibida",
+        "storagePath": gcs_path,
+        "pdfSize": blob.size,
+        "message": "Factura registrada. Use /invoices/<id>/process para procesar con IA"
+    }), 201
+
+
+@app.get("/invoices/<invoice_id>/download-url")
+def get_invoice_download_url(invoice_id: str):
+    """
+    URL firmada para ver/descargar el PDF de una factura (dueño o admin).
+    Con ?redirect=true responde 302 directo a la URL.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role()
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 401
+
+    try:
+        with metrics.stage("firestore_read"):
+            doc = firestore_client.collection("invoices").document(invoice_id).get(
+                field_paths=["supplierUid", "storagePath", "originalFilename"]
+            )
+        if not doc.exists:
+            return jsonify({"error": "factura no encontrada"}), 404
+        data = doc.to_dict() or {}
+        if role != "admin" and data.get("supplierUid") != uid:
+            return jsonify({"error": "no autorizado", "detail": "la factura pertenece a otro proveedor"}), 403
+
+        url, expires_at = _signed_download_url(data["storagePath"], data.get("originalFilename"))
+    except Exception as e:
+        print(f"Error generando URL de descarga: {e}")
+        return jsonify({"error": "error generando URL de descarga", "detail": str(e)}), 500
+
+    # La respuesta se puede reutilizar mientras la URL siga vigente (con margen)
+    max_age = max(0, int((expires_at - datetime.now(timezone.utc)).total_seconds()) - 60)
+    if request.args.get("redirect", "").lower() in ("1", "true"):
+        response = redirect(url, code=302)
+    else:
+        response = jsonify({"invoiceId": invoice_id, "url": url, "expiresAt": expires_at.isoformat()})
+    response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    response.vary.add("Authorization")
+    return response
+
+
+def _extraction_version() -> str:
+    """Identifica modelo + prompt con que se obtuvo un resultado cacheado."""
+    return f"{GEMINI_MODEL_ID}:{EXTRACTION_PROMPT_VERSION}"
+
+
+def _get_cached_extraction(pdf_sha256: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Devuelve la extracción guardada en pdf_hashes/{sha256} si es de la versión actual."""
+    if not pdf_sha256:
+        return None
+    try:
+        with metrics.stage("firestore_read"):
+            hash_doc = firestore_client.collection("pdf_hashes").document(pdf_sha256).get(
+                field_paths=["extraction", "extractionVersion"]
+            )
+    except Exception as e:
+        print(f"Error leyendo caché de extracción: {e}")
+        return None
+    if not hash_doc.exists:
+        return None
+    cached = hash_doc.to_dict() or {}
+    if cached.get("extractionVersion") != _extraction_version() or not cached.get("extraction"):
+        return None
+    return cached["extraction"]
+
+
+def _store_cached_extraction(pdf_sha256: Optional[str], extracted_data: Dict[str, Any]):
+    """Guarda la extracción para reutilizarla en subidas con el mismo contenido."""
+    if not pdf_sha256 or not GEMINI_AI_ENABLED:
+        # Sin Gemini son datos de ejemplo: no se cachean
+        return
+    try:
+        firestore_client.collection("pdf_hashes").document(pdf_sha256).set({
+            "extraction": extracted_data,
+            "extractionVersion": _extraction_version(),
+            "extractedAt": firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+    except Exception as e:
+        print(f"Error guardando caché de extracción: {e}")
+
+
+def _prepare_invoice_extraction(invoice_id: str, use_cache: bool = True) -> tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+    """
+    Primera parte del pipeline: lectura en Firestore, caché de extracción y
+    texto del PDF (guardado en pdf_texts o, si no está, descarga y parseo).
+    Devuelve (preparado, None) o (None, (cuerpo, código HTTP)) si la factura
+    no se puede procesar. Si el resultado sale de la caché, preparado
+    trae "extracted_data"; si no, trae "pdf_text" para extraer.
+    """
+    # Obtener documento de Firestore
+    try:
+        doc_ref = firestore_client.collection("invoices").document(invoice_id)
+        with metrics.stage("firestore_read"):
+            doc = doc_ref.get()
+        
+        if not doc.exists:
+            return None, ({"error": "factura no encontrada"}, 404)
+        
+        data = doc.to_dict()
+        storage_path = data["storagePath"]
+        pdf_sha256 = data.get("pdfSha256")
+        
+    except Exception as e:
+        return None, ({"error": "error leyendo Firestore", "detail": str(e)}, 500)
+
+    extracted_data = _get_cached_extraction(pdf_sha256) if use_cache else None
+    from_cache = extracted_data is not None
+    computed_sha256 = False
+    pdf_text = ""
+
+    # Texto guardado al subir (o en un procesamiento anterior): sin descarga ni parseo
+    stored_text = None if from_cache else _get_pdf_text(pdf_sha256)
+
+    if from_cache:
+        print(f"♻️ Extracción reutilizada desde caché ({pdf_sha256[:12]}): {invoice_id}")
+    elif stored_text is not None:
+        pdf_text = stored_text["text"]
+        print(f"📄 Texto guardado ({stored_text['pagesRead']} págs., calidad {stored_text['quality']}): {invoice_id}")
+    else:
+        # Descargar PDF de Cloud Storage
+        try:
+            bucket = storage_client.bucket(BUCKET_NAME)
+            blob = bucket.blob(storage_path)
+            
+            # Descargar contenido
+            with metrics.stage("gcs_download"):
+                pdf_bytes = blob.download_as_bytes()
+            metrics.stage_bytes.inc(len(pdf_bytes), stage="gcs_download")
+            
+            # Subidas con URL firmada: el hash se calcula aquí, con el PDF ya descargado
+            if not pdf_sha256:
+                pdf_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+                computed_sha256 = True
+                extracted_data = _get_cached_extraction(pdf_sha256) if use_cache else None
+                from_cache = extracted_data is not None
+            
+            # Extraer texto y guardarlo para los próximos procesamientos
+            text_result = None if from_cache else _extract_pdf_text_result(pdf_bytes)
+            if text_result is not None:
+                pdf_text = text_result["text"]
+                _store_pdf_text(pdf_sha256, text_result)
+            
+        except Exception as e:
+            print(f"Error descargando de Storage: {e}")
+            return None, ({"error": "error descargando PDF", "detail": str(e)}, 500)
+
+    if not from_cache and (not pdf_text or len(pdf_text.strip()) < 50):
+        return None, ({
+            "error": "No se pudo extraer texto del PDF",
+            "detail": "El PDF podría estar escaneado o no contener texto"
+        }, 400)
+
+    return {
+        "invoiceId": invoice_id,
+        "doc_ref": doc_ref,
+        "pdf_sha256": pdf_sha256,
+        "computed_sha256": computed_sha256,
+        "pdf_text": pdf_text,
+        "extracted_data": extracted_data,
+        "from_cache": from_cache,
+    }, None
+
+
+def _finish_invoice_extraction(prepared: Dict[str, Any],
+                               extracted_data: Optional[Dict[str, Any]] = None) -> tuple[Dict[str, Any], int]:
+    """
+    Segunda parte del pipeline: extrae los datos (si no vienen dados, con
+    extract_invoice_data) y los escribe en la factura y en las estadísticas.
+    """
+    invoice_id = prepared["invoiceId"]
+    doc_ref = prepared["doc_ref"]
+    pdf_sha256 = prepared["pdf_sha256"]
+    from_cache = prepared["from_cache"]
+
+    # Procesar con Gemini
+    try:
+        if extracted_data is None:
+            extracted_data = extract_invoice_data(prepared["pdf_text"])
+        
+        # Verificar si hubo error en el procesamiento
+        if extracted_data.get("error"):
+            print(f"❌ Error en IA: {extracted_data.get('error')}")
+            return {
+                "error": "Error al procesar con IA",
+                "detail": extracted_data.get("error"),
+                "resumen": extracted_data.get("resumen", "No se pudo procesar el documento"),
+                "retryable": bool(extracted_data.get("retryable")),
+            }, 503 if extracted_data.get("retryable") else 500
+        
+        # Solo actualizar si el procesamiento fue exitoso
+        invoice_updates = {
+            "es_factura": extracted_data.get("es_factura", False),
+            "resumen": extracted_data.get("resumen"),
+            "monto_total": extracted_data.get("monto_total"),
+            "moneda": extracted_data.get("moneda"),
+            "ruc_emisor": extracted_data.get("ruc_emisor"),
+            "razon_social_emisor": extracted_data.get("razon_social_emisor"),
+            "fecha_emision": extracted_data.get("fecha_emision"),
+            "fecha_vencimiento": extracted_data.get("fecha_vencimiento"),
+            "numero_factura": extracted_data.get("numero_factura"),
+            "concepto": extracted_data.get("concepto"),
+            "confidence": extracted_data.get("confidence", 0),
+            "extractor": extracted_data.get("extractor"),
+            "extractionFromCache": from_cache,
+            "processed": True,
+            "processedAt": firestore.SERVER_TIMESTAMP
+        }
+        if prepared["computed_sha256"]:
+            invoice_updates["pdfSha256"] = pdf_sha256
+        # Clave (RUC, número) para detectar la misma factura subida dos veces
+        invoice_key = _invoice_key(extracted_data.get("ruc_emisor"), extracted_data.get("numero_factura")) \
+            if invoice_updates["es_factura"] else None
+        duplicate: Dict[str, Optional[str]] = {}
+
+        def _finish(transaction):
+            snap = doc_ref.get(transaction=transaction)
+            previous = snap.to_dict() or {}
+            was_processed = bool(previous.get("processed"))
+            # Dueños de la clave nueva y de la anterior (si al reprocesar cambió), en un get_all
+            old_key = previous.get("invoiceKey") if previous.get("invoiceKey") != invoice_key else None
+            key_refs = [_invoice_keys_coll().document(k) for k in (invoice_key, old_key) if k]
+            owners = {
+                key_snap.id: (key_snap.to_dict() or {}).get("invoiceId")
+                for key_snap in (firestore_client.get_all(key_refs, transaction=transaction) if key_refs else [])
+                if key_snap.exists
+            }
+            owner = owners.get(invoice_key) if invoice_key else None
+            duplicate_of = owner if owner and owner != invoice_id else None
+
+            transaction.update(doc_ref, {
+                **invoice_updates,
+                "invoiceKey": invoice_key,
+                "duplicateOf": duplicate_of,
+                "isDuplicate": duplicate_of is not None,
+                "searchTokens": search.index_tokens({**previous, **invoice_updates}),
+            })
+            if invoice_key and owner is None:
+                transaction.set(_invoice_keys_coll().document(invoice_key), {
+                    "invoiceId": invoice_id,
+                    "supplierUid": previous.get("supplierUid"),
+                    "createdAt": firestore.SERVER_TIMESTAMP,
+                })
+            if old_key and owners.get(old_key) == invoice_id:
+                # El reproceso cambió el RUC/número: liberar la clave anterior
+                transaction.delete(_invoice_keys_coll().document(old_key))
+            if not was_processed:
+                _add_stats_delta(transaction, processed=1)
+            _bump_list_version(transaction)
+            duplicate["of"] = duplicate_of
+
+        with metrics.stage("firestore_write"):
+            _run_in_transaction(_finish)
+        if duplicate.get("of"):
+            print(f"⚠️ Factura duplicada: {invoice_id} tiene el mismo RUC y número que {duplicate['of']} ({invoice_key})")
+        
+        if not from_cache and extracted_data.get("extractor") != "local":
+            # El resultado local es barato de recalcular: solo se cachean las respuestas de Gemini
+            _store_cached_extraction(pdf_sha256, extracted_data)
+        
+        print(f"✅ Documento procesado exitosamente: {invoice_id}")
+        
+        return {
+            "message": "Documento procesado exitosamente con IA",
+            "invoiceId": invoice_id,
+            "extracted_data": extracted_data,
+            "es_factura": extracted_data.get("es_factura", False),
+            "fromCache": from_cache,
+            "duplicateOf": duplicate.get("of"),
+        }, 200
+        
+    except Exception as e:
+        print(f"❌ Error procesando con IA: {e}")
+        import traceback
+        traceback.print_exc()
+        return {
+            "error": "Error al procesar con IA",
+            "detail": str(e)
+        }, 500
+
+
+def _process_invoice_pipeline(invoice_id: str, use_cache: bool = True) -> tuple[Dict[str, Any], int]:
+    """
+    Ejecuta el pipeline de IA de una factura: lectura en Firestore, descarga del
+    PDF, extracción de texto, Gemini y escritura del resultado.
+    Si ya se extrajo un PDF con el mismo SHA-256 (y use_cache), reutiliza ese
+    resultado sin descargar ni llamar a Gemini.
+    Devuelve (cuerpo, código HTTP). No usa el request actual, por lo que puede
+    ejecutarse desde hilos de trabajo (ver /invoices/process-batch).
+    """
+    prepared, error = _prepare_invoice_extraction(invoice_id, use_cache=use_cache)
+    if error is not None:
+        return error
+    return _finish_invoice_extraction(prepared, prepared["extracted_data"])
+
+
+def _run_process_invoice_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler de la cola para trabajos "process_invoice"."""
+    body, status_code = _process_invoice_pipeline(payload["invoiceId"], use_cache=payload.get("useCache", True))
+    if status_code != 200:
+        raise jobs.JobError(body.get("error", "error procesando factura"), {"statusCode": status_code, **body})
+    return body
+
+
+def _record_job_on_invoice(job: Dict[str, Any]):
+    """
+    Refleja el estado del último trabajo en `lastJob` de la factura (un solo
+    campo, no uno por trabajo: el documento no crece con cada reproceso).
+    """
+    invoice_id = job["payload"].get("invoiceId")
+    if not invoice_id:
+        return
+    batch = firestore_client.batch()
+    batch.update(firestore_client.collection("invoices").document(invoice_id), {
+        "lastJobId": job["jobId"],
+        "lastJob": {
+            "jobId": job["jobId"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "createdAt": job["createdAt"],
+            "startedAt": job["startedAt"],
+            "finishedAt": job["finishedAt"],
+            "queuedMs": job["queuedMs"],
+            "runMs": job["runMs"],
+            "error": job["error"],
+        }
+    })
+    # El campo lastJob sale en GET /invoices: sube la versión que usa su ETag
+    _bump_list_version(batch)
+    batch.commit()
+
+
+job_queue = jobs.create_queue(JOB_QUEUE_BACKEND, JOB_QUEUE_PATH)
+job_workers = jobs.JobWorkerPool(
+    job_queue,
+    {"process_invoice": _run_process_invoice_job},
+    workers=JOB_WORKERS,
+    on_update=_record_job_on_invoice,
+)
+
+# Estado de cachés, cola y extractor como gauges de /metrics
+metrics.registry.gauge_callback(
+    "neo_cache_events", "Entradas, aciertos y fallos de las cachés en memoria", ("cache", "kind"),
+    lambda: {
+        (cache, kind): value
+        for cache, stats in (("auth", token_cache.stats()), ("suppliers", supplier_directory.stats()))
+        for kind, value in stats.items()
+    },
+)
+metrics.registry.gauge_callback(
+    "neo_jobs", "Trabajos en la cola por estado", ("status",),
+    lambda: {(status,): value for status, value in job_queue.stats().items()},
+)
+metrics.registry.gauge_callback(
+    "neo_gemini_limiter", "Fracción de la tasa configurada en uso y llamadas sin cupo", ("kind",),
+    lambda: {(kind,): value for kind, value in gemini_api.limiter.stats().items()},
+)
+metrics.registry.gauge_callback(
+    "neo_gemini_circuit_open", "1 si el circuito de Gemini está abierto o en prueba", (),
+    lambda: {(): 0 if gemini_api.breaker.state == gemini_client.CircuitBreaker.CLOSED else 1},
+)
+metrics.registry.gauge_callback(
+    "neo_pdf_text_events", "Timeouts y fallos de la extracción de texto", ("kind",),
+    lambda: {(kind,): pdf_text_extractor.stats()[kind] for kind in ("timeouts", "failures")},
+)
+
+
+@app.post("/invoices/<invoice_id>/process")
+def process_invoice(invoice_id: str):
+    """
+    Encola el procesamiento de una factura con Google AI (Gemini API).
+    SOLO puede ser llamado por un administrador.
+    Responde 202 con el jobId; el estado se consulta en GET /jobs/<jobId>.
+    Query opcional: ?refresh=true para no reutilizar la extracción cacheada.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+        require_admin(uid, role)  # Solo admin puede procesar con IA
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 403
+
+    try:
+        doc = firestore_client.collection("invoices").document(invoice_id).get(field_paths=["status"])
+        if not doc.exists:
+            return jsonify({"error": "factura no encontrada"}), 404
+    except Exception as e:
+        return jsonify({"error": "error leyendo Firestore", "detail": str(e)}), 500
+
+    try:
+        job = job_workers.submit("process_invoice", {
+            "invoiceId": invoice_id,
+            "requestedBy": uid,
+            # ?refresh=true ignora la extracción cacheada (ej. tras cambiar el prompt)
+            "useCache": request.args.get("refresh", "").lower() not in ("1", "true"),
+        })
+    except Exception as e:
+        print(f"Error encolando trabajo: {e}")
+        return jsonify({"error": "error encolando trabajo", "detail": str(e)}), 500
+
+    return jsonify({
+        "message": "Procesamiento encolado",
+        "invoiceId": invoice_id,
+        "jobId": job["jobId"],
+        "status": job["status"],
+        "statusUrl": f"/jobs/{job['jobId']}"
+    }), 202, {"Location": f"/jobs/{job['jobId']}"}
+
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id: str):
+    """
+    Estado de un trabajo en segundo plano: queued | running | done | failed,
+    con tiempos (queuedMs, runMs) y el resultado o error. Solo admins.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+        require_admin(uid, role)
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 403
+
+    try:
+        job = job_queue.get(job_id)
+        if job is not None:
+            return jsonify(jobs.with_timings(job)), 200
+
+        # El trabajo pudo encolarse en otra instancia: buscarlo como último trabajo de una factura
+        docs = firestore_client.collection("invoices")\
+            .where("lastJobId", "==", job_id)\
+            .select(["lastJob"]).limit(1).stream()
+        for d in docs:
+            summary = (d.to_dict() or {}).get("lastJob") or {}
+            return jsonify({"payload": {"invoiceId": d.id}, **summary}), 200
+
+        return jsonify({"error": "trabajo no encontrado"}), 404
+    except Exception as e:
+        print(f"Error leyendo trabajo: {e}")
+        return jsonify({"error": "error leyendo trabajo", "detail": str(e)}), 500
+
+
+def _body_int(data: Dict[str, Any], key: str, default: int) -> int:
+    """Entero opcional del body JSON; ValueError si viene con otro tipo (lista, texto, null...)."""
+    if key not in data:
+        return default
+    value = data[key]
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"'{key}' debe ser un número entero")
+    return value
+
+
+def _resolve_batch_invoice_ids(data: Dict[str, Any], limit: int) -> List[str]:
+    """
+    Obtiene los IDs a procesar a partir del body de /invoices/process-batch.
+    Acepta una lista explícita ("invoiceIds") o un filtro ("filter": {"processed": false}).
+    Lanza ValueError si el body no es válido.
+    """
+    if "invoiceIds" in data:
+        invoice_ids = data["invoiceIds"]
+        if not isinstance(invoice_ids, list) or not all(isinstance(i, str) and i for i in invoice_ids):
+            raise ValueError("'invoiceIds' debe ser una lista de IDs")
+        # Quitar duplicados conservando el orden
+        return list(dict.fromkeys(invoice_ids))[:limit]
+
+    filters = data.get("filter")
+    if not isinstance(filters, dict) or not filters:
+        raise ValueError("envíe 'invoiceIds' o un 'filter' (ej. {\"processed\": false})")
+
+    unknown = set(filters) - {"processed", "status", "supplierUid"}
+    if unknown:
+        raise ValueError(f"filtros no soportados: {', '.join(sorted(unknown))}")
+
+    q = firestore_client.collection("invoices")
+    for field, value in filters.items():
+        q = q.where(field, "==", value)
+
+    # Solo necesitamos los IDs: proyectar __name__ evita traer los documentos completos
+    return [d.id for d in q.select(["__name__"]).limit(limit).stream()]
+
+
+@app.post("/invoices/process-batch")
+def process_invoice_batch():
+    """
+    Procesa varias facturas con IA usando un pool de hilos acotado. Solo admins.
+    Body: {"invoiceIds": ["inv_..."]} o {"filter": {"processed": false}, "limit": 100}
+    Opcionales: "workers" (máx. BATCH_MAX_WORKERS), "stream" (true por defecto),
+    "refresh" (true para ignorar extracciones cacheadas) y "batchPrompt"
+    (true por defecto: las facturas que necesitan Gemini se envían de a varias
+    por prompt, hasta GEMINI_BATCH_MAX_INVOICES).
+    Con stream=true responde NDJSON: una línea por factura terminada y una línea
+    final con el resumen. Con stream=false devuelve un único JSON al terminar.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+        require_admin(uid, role)
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        # Validar los números antes de consultar Firestore: un tipo inválido es un 400
+        limit = max(1, min(_body_int(data, "limit", BATCH_MAX_INVOICES), BATCH_MAX_INVOICES))
+        workers = _body_int(data, "workers", BATCH_MAX_WORKERS)
+        invoice_ids = _resolve_batch_invoice_ids(data, limit)
+        use_cache = not data.get("refresh", False)
+        batch_prompts = GEMINI_AI_ENABLED and GEMINI_BATCH_MAX_INVOICES > 1 and data.get("batchPrompt", True) is not False
+    except ValueError as e:
+        return jsonify({"error": "body inválido", "detail": str(e)}), 400
+    except Exception as e:
+        print(f"Error obteniendo facturas del lote: {e}")
+        return jsonify({"error": "error leyendo Firestore", "detail": str(e)}), 500
+
+    workers = max(1, min(workers, BATCH_MAX_WORKERS, len(invoice_ids) or 1))
+    total = len(invoice_ids)
+
+    gemini_batches: List[int] = []  # facturas por prompt por lotes enviado
+
+    def _result(invoice_id: str, started: float, body: Dict[str, Any], status_code: int) -> Dict[str, Any]:
+        return {
+            "invoiceId": invoice_id,
+            "ok": status_code == 200,
+            "statusCode": status_code,
+            "elapsedMs": round((time.monotonic() - started) * 1000),
+            "result": body,
+        }
+
+    def _run_one(invoice_id: str) -> Dict[str, Any]:
+        started = time.monotonic()
+        try:
+            body, status_code = _process_invoice_pipeline(invoice_id, use_cache=use_cache)
+        except Exception as e:
+            body, status_code = {"error": "error inesperado", "detail": str(e)}, 500
+        return _result(invoice_id, started, body, status_code)
+
+    def _prepare_one(invoice_id: str) -> tuple[str, Any]:
+        """
+        Descarga y extrae el texto; si alcanza con la caché o el extractor local
+        termina la factura aquí ("done"). Si no, queda esperando un prompt por lotes.
+        """
+        started = time.monotonic()
+        try:
+            prepared, error = _prepare_invoice_extraction(invoice_id, use_cache=use_cache)
+            if error is not None:
+                return "done", _result(invoice_id, started, *error)
+            extracted_data = prepared["extracted_data"]
+            if extracted_data is None:
+                extracted_data = _extract_locally(prepared["pdf_text"])
+            if extracted_data is None:
+                prepared["started"] = started
+                return "gemini", prepared
+            return "done", _result(invoice_id, started, *_finish_invoice_extraction(prepared, extracted_data))
+        except Exception as e:
+            return "done", _result(invoice_id, started, {"error": "error inesperado", "detail": str(e)}, 500)
+
+    def _extract_group(group: List[Dict[str, Any]]) -> tuple[str, List[Dict[str, Any]]]:
+        """Un prompt de Gemini para todo el grupo y escritura de cada resultado."""
+        extracted = process_invoices_with_gemini_batch({p["invoiceId"]: p["pdf_text"] for p in group})
+        results = []
+        for prepared in group:
+            extracted_data = extracted[prepared["invoiceId"]]
+            extracted_data.setdefault("extractor", "gemini")
+            results.append(_result(prepared["invoiceId"], prepared["started"],
+                                   *_finish_invoice_extraction(prepared, extracted_data)))
+        return "batch", results
+
+    def _iter_results():
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice-batch")
+        try:
+            futures = [pool.submit(_run_one, invoice_id) for invoice_id in invoice_ids]
+            for fut in as_completed(futures):
+                yield fut.result()
+        finally:
+            # Si el cliente corta el stream, no seguimos gastando llamadas a Gemini
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _iter_results_batched():
+        """
+        Igual que _iter_results, pero las facturas que necesitan Gemini se
+        juntan en grupos (según gemini_batch_limits) y cada grupo va en un prompt.
+        """
+        max_items, max_tokens = gemini_batch_limits()
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice-batch")
+        gemini_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-batch")
+        pending: List[Dict[str, Any]] = []
+        pending_tokens = 0
+        try:
+            running = {pool.submit(_prepare_one, invoice_id) for invoice_id in invoice_ids}
+            preparing = len(running)
+
+            def _flush():
+                nonlocal pending, pending_tokens
+                running.add(gemini_pool.submit(_extract_group, pending))
+                gemini_batches.append(len(pending))
+                pending, pending_tokens = [], 0
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    running.discard(fut)
+                    kind, outcome = fut.result()
+                    if kind == "batch":
+                        yield from outcome
+                        continue
+                    preparing -= 1
+                    if kind == "done":
+                        yield outcome
+                        continue
+                    tokens = gemini_batch_item_tokens(outcome["pdf_text"])
+                    if pending and pending_tokens + tokens > max_tokens:
+                        _flush()
+                    pending.append(outcome)
+                    pending_tokens += tokens
+                    if len(pending) >= max_items:
+                        _flush()
+                # Ya no llegan más facturas: enviar el último grupo aunque esté incompleto
+                if not preparing and pending:
+                    _flush()
+        finally:
+            # Si el cliente corta el stream, no seguimos gastando llamadas a Gemini
+            pool.shutdown(wait=False, cancel_futures=True)
+            gemini_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _summary(results: List[Dict[str, Any]], started: float) -> Dict[str, Any]:
+        succeeded = sum(1 for r in results if r["ok"])
+        return {
+            "total": total,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "workers": workers,
+            "geminiBatches": len(gemini_batches),
+            "batchedInvoices": sum(gemini_batches),
+            "elapsedMs": round((time.monotonic() - started) * 1000),
+        }
+
+    started = time.monotonic()
+    print(f"📦 Lote de {total} facturas con {workers} hilos" + (" (prompts por lotes)" if batch_prompts else ""))
+    iter_results = _iter_results_batched if batch_prompts else _iter_results
+
+    if data.get("stream", True) is False:
+        results = list(iter_results())
+        order = {invoice_id: i for i, invoice_id in enumerate(invoice_ids)}
+        results.sort(key=lambda r: order[r["invoiceId"]])
+        return jsonify({"results": results, "summary": _summary(results, started)}), 200
+
+    def _generate():
+        results = []
+        for result in iter_results():
+            results.append(result)
+            yield json.dumps({"type": "result", "done": len(results), "total": total, **result}) + "\n"
+        yield json.dumps({"type": "summary", **_summary(results, started)}) + "\n"
+
+    return Response(_generate(), status=200, mimetype="application/x-ndjson")
+
+
+def _encode_invoice_cursor(doc) -> str:
+    """Cursor opaco con (createdAt, id) del último documento de la página."""
+    created_at = (doc.to_dict() or {}).get("createdAt")
+    stamp = created_at.rfc3339() if hasattr(created_at, "rfc3339") else created_at.isoformat()
+    raw = json.dumps({"t": stamp, "id": doc.id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_invoice_cursor(token: str, coll):
+    """
+    Reconstruye el cursor como un DocumentSnapshot sintético: Firestore agrega
+    __name__ como desempate y no hace falta leer el documento de nuevo.
+    Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+        created_at = DatetimeWithNanoseconds.from_rfc3339(raw["t"])
+        doc_id = raw["id"]
+    except Exception:
+        raise ValueError("cursor 'start_after' inválido")
+    return firestore.DocumentSnapshot(
+        coll.document(doc_id), {"createdAt": created_at},
+        exists=True, read_time=None, create_time=None, update_time=None,
+    )
+
+
+def _parse_date_arg(value: str, end_of_range: bool = False) -> tuple[datetime, bool]:
+    """
+    Convierte 'YYYY-MM-DD' o un datetime ISO en datetime UTC.
+    Para el fin de rango con solo fecha devuelve el inicio del día siguiente
+    (límite exclusivo), para que el día indicado quede incluido.
+    Devuelve (datetime, es_exclusivo).
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"fecha inválida: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end_of_range and len(value) == 10:
+        return parsed + timedelta(days=1), True
+    return parsed, False
+
+
+def _build_invoices_query(uid: str, role: Optional[str], args) -> tuple[Any, Dict[str, Any]]:
+    """
+    Arma la consulta de facturas a partir de los filtros del query string:
+    status, supplierUid (solo admin), processed, created_from, created_to.
+    Cada combinación de igualdades + createdAt tiene su índice compuesto en
+    firestore.indexes.json. Devuelve (query, filtros aplicados).
+    Lanza ValueError si algún filtro es inválido.
+    """
+    coll = firestore_client.collection("invoices")
+    q = coll
+    applied: Dict[str, Any] = {}
+
+    # Proveedor solo ve las suyas; admin puede filtrar por proveedor
+    supplier_uid = uid if role != "admin" else args.get("supplierUid")
+    if supplier_uid:
+        q = q.where("supplierUid", "==", supplier_uid)
+        applied["supplierUid"] = supplier_uid
+
+    status = args.get("status")
+    if status:
+        if status not in VALID_STATUSES:
+            raise ValueError(f"estado inválido. Debe ser uno de: {', '.join(VALID_STATUSES)}")
+        q = q.where("status", "==", status)
+        applied["status"] = status
+
+    processed = args.get("processed")
+    if processed:
+        if processed.lower() not in ("true", "false"):
+            raise ValueError("'processed' debe ser true o false")
+        applied["processed"] = processed.lower() == "true"
+        q = q.where("processed", "==", applied["processed"])
+
+    created_from = args.get("created_from")
+    if created_from:
+        start, _ = _parse_date_arg(created_from)
+        q = q.where("createdAt", ">=", start)
+        applied["created_from"] = created_from
+
+    created_to = args.get("created_to")
+    if created_to:
+        end, exclusive = _parse_date_arg(created_to, end_of_range=True)
+        q = q.where("createdAt", "<" if exclusive else "<=", end)
+        applied["created_to"] = created_to
+
+    q = q.order_by("createdAt", direction=firestore.Query.DESCENDING)
+    return q, applied
+
+
+def _serialize_invoice(d) -> Dict[str, Any]:
+    """Documento de factura -> dict para JSON."""
+    data = d.to_dict() or {}
+    data["invoiceId"] = d.id
+    data.pop("searchTokens", None)  # índice de búsqueda, no se expone
+    # Los timestamps de Firestore (createdAt, processedAt, ...) los convierte
+    # a ISO 8601 el serializador JSON (responses.py)
+    return data
+
+
+@app.get("/invoices")
+def list_invoices():
+    """
+    Lista facturas. Si es admin, ve todas. Si es proveedor, solo las suyas.
+    Query opcional:
+      page_size (default 100, máx. INVOICES_MAX_PAGE_SIZE), start_after (cursor
+      devuelto en nextCursor), status, supplierUid (solo admin), processed
+      (true/false), created_from y created_to (YYYY-MM-DD o ISO 8601).
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role()
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 401
+
+    # Consulta Firestore según el rol y los filtros
+    try:
+        page_size = int(request.args.get("page_size", INVOICES_DEFAULT_PAGE_SIZE))
+        if page_size < 1:
+            raise ValueError("'page_size' debe ser mayor que 0")
+        page_size = min(page_size, INVOICES_MAX_PAGE_SIZE)
+        q, applied = _build_invoices_query(uid, role, request.args)
+        cursor = request.args.get("start_after")
+        if cursor:
+            q = q.start_after(_decode_invoice_cursor(cursor, firestore_client.collection("invoices")))
+    except ValueError as e:
+        return jsonify({"error": "parámetros inválidos", "detail": str(e)}), 400
+
+    # Validador: versión de los listados (cambia con cada escritura de facturas)
+    # combinada con el usuario y los parámetros de la consulta
+    etag, last_modified = None, None
+    try:
+        version, last_modified = _stats_version()
+        if version is not None:
+            query_key = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+            etag = "inv-" + hashlib.sha1(f"{version}|{uid}|{role}|{query_key}".encode()).hexdigest()[:20]
+            not_modified = _not_modified(etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+    except Exception as e:
+        print(f"Error leyendo versión de facturas: {e}")
+
+    try:
+        # Se pide un documento extra para saber si hay otra página
+        docs = list(q.limit(page_size + 1).stream())
+        has_more = len(docs) > page_size
+        docs = docs[:page_size]
+        
+        # Serializar a JSON
+        items = [_serialize_invoice(d) for d in docs]
+        
+        # Si es admin, agregar info del proveedor (email y RUC)
+        if role == "admin":
+            supplier_directory.enrich_invoices(items)
+        
+        response = jsonify({
+            "items": items,
+            "total": len(items),
+            "pageSize": page_size,
+            "filters": applied,
+            "nextCursor": _encode_invoice_cursor(docs[-1]) if has_more else None
+        })
+        if etag:
+            _with_validators(response, etag, last_modified)
+        return response, 200
+        
+    except Exception as e:
+        print(f"Error listando facturas: {e}")
+        return jsonify({"error": "error listando facturas", "detail": str(e)}), 500
 
 
-@app.post("/invoices")
-def create_invoice():
+@app.get("/invoices/duplicates")
+def list_duplicate_invoices():
     """
-    Recibe un PDF, lo sube a Cloud Storage y crea documento en Firestore.
+    Lista las facturas marcadas como duplicadas (mismo RUC emisor y número que
+    otra ya procesada), de la más reciente a la más antigua. Solo admin.
+    Cada item incluye "original" con la factura que tiene la clave.
+    Query opcional: page_size y start_after (cursor devuelto en nextCursor).
     """
     try:
-        uid, role = _extract_bearer_uid_and_role()
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+        require_admin(uid, role)
     except Exception as e:
-        return jsonify({"error": "no autorizado", "detail": str(e)}), 401
-
-    # Validar archivo
-    if "file" not in request.files:
-        return jsonify({"error": "falta el archivo 'file' en form-data"}), 400
-
-    file = request.files["file"]
-    if not file or file.filename == "":
-        return jsonify({"error": "archivo vacío"}), 400
-
-    # Verificar que sea PDF
-    if not file.filename.lower().endswith('.pdf'):
-        return jsonify({"error": "solo se permiten archivos PDF"}), 400
-
-    # Nombre seguro y ruta en el bucket
-    invoice_id = f"inv_{uuid.uuid4().hex[:12]}"
-    safe_name = secure_filename(file.filename or "factura.pdf")
-    gcs_path = f"invoices/{uid}/{invoice_id}.pdf"
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 403
 
-    # Subir a Cloud Storage
+    coll = firestore_client.collection("invoices")
     try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(gcs_path)
-        
-        # Leer el contenido del archivo
-        file_content = file.read()
-        
-        # Subir a Cloud Storage
-        blob.upload_from_string(file_content, content_type="application/pdf")
-        blob.cache_control = "no-cache"
-        blob.patch()
-        
-    except Exception as e:
-        print(f"Error subiendo a Storage: {e}")
-        return jsonify({"error": "error subiendo a Storage", "detail": str(e)}), 500
+        page_size = int(request.args.get("page_size", INVOICES_DEFAULT_PAGE_SIZE))
+        if page_size < 1:
+            raise ValueError("'page_size' debe ser mayor que 0")
+        page_size = min(page_size, INVOICES_MAX_PAGE_SIZE)
+        q = coll.where("isDuplicate", "==", True).order_by("createdAt", direction=firestore.Query.DESCENDING)
+        cursor = request.args.get("start_after")
+        if cursor:
+            q = q.start_after(_decode_invoice_cursor(cursor, coll))
+    except ValueError as e:
+        return jsonify({"error": "parámetros inválidos", "detail": str(e)}), 400
 
-    # Crear documento en Firestore
     try:
-        doc_ref = firestore_client.collection("invoices").document(invoice_id)
-        doc = {
-            "supplierUid": uid,
-            "storagePath": gcs_path,
-            "originalFilename": safe_name,
-            "status": "Recibida",
-            # Campos de IA vacíos (se llenarán al procesar)
-            "monto_total": None,
-            "moneda": None,
-            "ruc_emisor": None,
-            "razon_social_emisor": None,
-            "fecha_emision": None,
-            "fecha_vencimiento": None,
-            "numero_factura": None,
-            "concepto": None,
-            "confidence": None,
-            "processed": False,
-            "createdAt": firestore.SERVER_TIMESTAMP,
+        docs = list(q.limit(page_size + 1).stream())
+        has_more = len(docs) > page_size
+        docs = docs[:page_size]
+        items = [_serialize_invoice(d) for d in docs]
+
+        # Las facturas originales de la página, en un solo get_all
+        original_ids = list(dict.fromkeys(item["duplicateOf"] for item in items if item.get("duplicateOf")))
+        originals = {
+            snap.id: _serialize_invoice(snap)
+            for snap in (firestore_client.get_all([coll.document(i) for i in original_ids]) if original_ids else [])
+            if snap.exists
         }
-        doc_ref.set(doc)
+        for item in items:
+            item["original"] = originals.get(item.get("duplicateOf"))
+
+        return jsonify({
+            "items": items,
+            "total": len(items),
+            "pageSize": page_size,
+            "nextCursor": _encode_invoice_cursor(docs[-1]) if has_more else None
+        }), 200
     except Exception as e:
-        print(f"Error escribiendo en Firestore: {e}")
-        return jsonify({"error": "error escribiendo en Firestore", "detail": str(e)}), 500
+        print(f"Error listando facturas duplicadas: {e}")
+        return jsonify({"error": "error listando facturas duplicadas", "detail": str(e)}), 500
 
-    return jsonify({
-        "invoiceId": invoice_id,
-        "status": "Recibida",
-        "storagePath": gcs_path,
-        "message": "Factura subida. Use /invoices/<id>/process para procesar con IA"
-    }), 201
 
+def _encode_search_cursor(scan_cursor: Optional[str], offset: int) -> str:
+    """Cursor de búsqueda: ventana (cursor de Firestore donde empieza) + posición dentro de ella."""
+    raw = json.dumps({"s": scan_cursor, "o": offset}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-@app.post("/invoices/<invoice_id>/process")
-def process_invoice(invoice_id: str):
+
+def _decode_search_cursor(token: str) -> tuple[Optional[str], int]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        offset = int(raw["o"])
+        if offset < 0:
+            raise ValueError
+        return raw["s"], offset
+    except Exception:
+        raise ValueError("cursor 'cursor' inválido")
+
+
+def _search_window(terms: List[str], scan_cursor: Optional[str],
+                   max_scan: int) -> tuple[List[Dict[str, Any]], Optional[str], int]:
     """
-    Procesa una factura específica con Google AI (Gemini API) para extraer datos.
-    SOLO puede ser llamado por un administrador.
+    Una ventana de resultados: recorre por createdAt DESC las facturas cuyo
+    searchTokens contiene el término más selectivo, filtra en memoria por los
+    demás y ordena por relevancia (a igual puntaje, la más reciente primero).
+    Se detiene al juntar SEARCH_WINDOW coincidencias o leer `max_scan`
+    facturas. Devuelve (facturas, cursor de la ventana siguiente, leídas).
+    """
+    coll = firestore_client.collection("invoices")
+    fields = [f for f in INVOICES_EXPORT_FIELDS if f not in ("invoiceId", "supplierEmail", "supplierRuc")]
+    q = (coll.where("searchTokens", "array_contains", search.driver_token(terms))
+         .select(fields + ["isDuplicate", "duplicateOf"])
+         .order_by("createdAt", direction=firestore.Query.DESCENDING))
+    if scan_cursor:
+        q = q.start_after(_decode_invoice_cursor(scan_cursor, coll))
+
+    found: List[Dict[str, Any]] = []
+    scanned, last = 0, None
+    with metrics.stage("firestore_search"):
+        for doc in q.limit(max_scan).stream():
+            scanned, last = scanned + 1, doc
+            data = _serialize_invoice(doc)
+            if search.matches(data, terms):
+                found.append(data)
+                if len(found) >= SEARCH_WINDOW:
+                    break
+    # sort es estable: dentro del mismo puntaje se mantiene el orden por fecha
+    found.sort(key=lambda data: search.score(data, terms), reverse=True)
+    more = last is not None and (len(found) >= SEARCH_WINDOW or scanned >= max_scan)
+    return found, _encode_invoice_cursor(last) if more else None, scanned
+
+
+@app.get("/invoices/search")
+def search_invoices():
+    """
+    Busca facturas por razón social, concepto, número, RUC emisor o nombre
+    de archivo (sin distinguir mayúsculas ni acentos; cada término puede ser
+    el comienzo de una palabra y todos deben aparecer). Solo admin.
+    Query: q (requerido), page_size (default 20, máx. 100) y cursor (nextCursor
+    de la página anterior). El orden por relevancia es local a cada ventana
+    de SEARCH_WINDOW coincidencias (las ventanas van de las facturas más
+    recientes a las más antiguas): la respuesta lo indica con
+    ranking="window" y windows (ventanas que aportaron a la página). Si una
+    ventana se agota sin llenar la página se sigue con la siguiente; si se
+    leyeron SEARCH_MAX_SCAN facturas antes de llenarla, la respuesta trae
+    partial=true y nextCursor para seguir buscando.
     """
     try:
-        uid, role = _extract_bearer_uid_and_role()
-        require_admin(uid, role)  # Solo admin puede procesar con IA
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+        require_admin(uid, role)
     except Exception as e:
         return jsonify({"error": "no autorizado", "detail": str(e)}), 403
 
-    # Obtener documento de Firestore
     try:
-        doc_ref = firestore_client.collection("invoices").document(invoice_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return jsonify({"error": "factura no encontrada"}), 404
-        
-        data = doc.to_dict()
-        storage_path = data["storagePath"]
-        
-    except Exception as e:
-        return jsonify({"error": "error leyendo Firestore", "detail": str(e)}), 500
+        terms = search.query_terms(request.args.get("q", ""))
+        page_size = int(request.args.get("page_size", SEARCH_DEFAULT_PAGE_SIZE))
+        if page_size < 1:
+            raise ValueError("'page_size' debe ser mayor que 0")
+        page_size = min(page_size, SEARCH_MAX_PAGE_SIZE)
+        scan_cursor, offset = _decode_search_cursor(request.args["cursor"]) \
+            if request.args.get("cursor") else (None, 0)
+    except ValueError as e:
+        return jsonify({"error": "parámetros inválidos", "detail": str(e)}), 400
 
-    # Descargar PDF de Cloud Storage
     try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(storage_path)
-        
-        # Descargar contenido
-        pdf_bytes = blob.download_as_bytes()
-        pdf_stream = io.BytesIO(pdf_bytes)
-        
-        # Extraer texto
-        pdf_text = extract_text_from_pdf(pdf_stream)
-        
-        if not pdf_text or len(pdf_text.strip()) < 50:
-            return jsonify({
-                "error": "No se pudo extraer texto del PDF",
-                "detail": "El PDF podría estar escaneado o no contener texto"
-            }), 400
-        
-    except Exception as e:
-        print(f"Error descargando de Storage: {e}")
-        return jsonify({"error": "error descargando PDF", "detail": str(e)}), 500
+        window, next_window, scanned = _search_window(terms, scan_cursor, SEARCH_MAX_SCAN)
+        items = window[offset:offset + page_size]
+        consumed, windows = offset + len(items), 1
+        # Ventana agotada sin llenar la página: seguir con la siguiente
+        # mientras quede presupuesto de lectura
+        while len(items) < page_size and next_window and scanned < SEARCH_MAX_SCAN:
+            scan_cursor = next_window
+            window, next_window, read = _search_window(terms, scan_cursor, SEARCH_MAX_SCAN - scanned)
+            taken = window[:page_size - len(items)]
+            items += taken
+            consumed, scanned, windows = len(taken), scanned + read, windows + 1
+        if consumed < len(window):
+            next_cursor = _encode_search_cursor(scan_cursor, consumed)
+        elif next_window:
+            next_cursor = _encode_search_cursor(next_window, 0)
+        else:
+            next_cursor = None
+
+        supplier_directory.enrich_invoices(items)
 
-    # Procesar con Gemini
-    try:
-        extracted_data = process_invoice_with_gemini(pdf_text)
-        
-        # Verificar si hubo error en el procesamiento
-        if extracted_data.get("error"):
-            print(f"❌ Error en IA: {extracted_data.get('error')}")
-            return jsonify({
-                "error": "Error al procesar con IA",
-                "detail": extracted_data.get("error"),
-                "resumen": extracted_data.get("resumen", "No se pudo procesar el documento")
-            }), 500
-        
-        # Solo actualizar si el procesamiento fue exitoso
-        doc_ref.update({
-            "es_factura": extracted_data.get("es_factura", False),
-            "resumen": extracted_data.get("resumen"),
-            "monto_total": extracted_data.get("monto_total"),
-            "moneda": extracted_data.get("moneda"),
-            "ruc_emisor": extracted_data.get("ruc_emisor"),
-            "razon_social_emisor": extracted_data.get("razon_social_emisor"),
-            "fecha_emision": extracted_data.get("fecha_emision"),
-            "fecha_vencimiento": extracted_data.get("fecha_vencimiento"),
-            "numero_factura": extracted_data.get("numero_factura"),
-            "concepto": extracted_data.get("concepto"),
-            "confidence": extracted_data.get("confidence", 0),
-            "processed": True,
-            "processedAt": firestore.SERVER_TIMESTAMP
-        })
-        
-        print(f"✅ Documento procesado exitosamente: {invoice_id}")
-        
         return jsonify({
-            "message": "Documento procesado exitosamente con IA",
-            "invoiceId": invoice_id,
-            "extracted_data": extracted_data,
-            "es_factura": extracted_data.get("es_factura", False)
+            "items": items,
+            "total": len(items),
+            "pageSize": page_size,
+            "terms": terms,
+            "scanned": scanned,
+            # Relevancia ordenada solo dentro de cada ventana de coincidencias
+            "ranking": "window",
+            "windows": windows,
+            # Página corta por el tope de lectura, no porque no haya más resultados
+            "partial": next_cursor is not None and len(items) < page_size,
+            "nextCursor": next_cursor
         }), 200
-        
     except Exception as e:
-        print(f"❌ Error procesando con IA: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            "error": "Error al procesar con IA",
-            "detail": str(e)
-        }), 500
+        print(f"Error buscando facturas: {e}")
+        return jsonify({"error": "error buscando facturas", "detail": str(e)}), 500
 
 
-@app.get("/invoices")
-def list_invoices():
+def _iter_invoice_pages(q, role: Optional[str], page_size: int):
     """
-    Lista facturas. Si es admin, ve todas. Si es proveedor, solo las suyas.
+    Recorre la consulta por páginas con cursor (el último documento de cada
+    página) y devuelve listas de facturas serializadas. Solo hay una página
+    en memoria a la vez.
+    """
+    cursor = None
+    while True:
+        page_q = q.start_after(cursor) if cursor is not None else q
+        with metrics.stage("firestore_read"):
+            docs = list(page_q.limit(page_size).stream())
+        if not docs:
+            return
+        items = [_serialize_invoice(d) for d in docs]
+        if role == "admin":
+            supplier_directory.enrich_invoices(items)
+        yield items
+        if len(docs) < page_size:
+            return
+        cursor = docs[-1]
+
+
+# Prefijos que Excel/Sheets interpretan como fórmula al abrir el CSV
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+_CSV_NUMBER = re.compile(r"-?\d+(\.\d+)?")
+
+
+def _csv_value(value) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    # Texto que viene de los proveedores o de Gemini (razón social, concepto,
+    # nombre de archivo): un apóstrofo delante evita que se ejecute como
+    # fórmula. Los montos negativos se dejan como números.
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES) and not _CSV_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+@app.get("/invoices/export")
+def export_invoices():
+    """
+    Exporta facturas para contabilidad. Mismos filtros y permisos que
+    GET /invoices (status, supplierUid solo admin, processed, created_from,
+    created_to) y format=csv (default) o ndjson.
+    La respuesta se genera en streaming mientras se pagina Firestore, así que
+    el primer renglón sale enseguida y la memoria no crece con el total.
     """
     try:
         uid, role = _extract_bearer_uid_and_role()
     except Exception as e:
         return jsonify({"error": "no autorizado", "detail": str(e)}), 401
 
-    # Consulta Firestore según el rol
+    export_format = request.args.get("format", "csv").lower()
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({"error": "parámetros inválidos", "detail": "'format' debe ser csv o ndjson"}), 400
     try:
-        coll = firestore_client.collection("invoices")
-        
-        if role == "admin":
-            # Admin ve todas las facturas
-            q = coll.order_by("createdAt", direction=firestore.Query.DESCENDING).limit(100)
-        else:
-            # Proveedor solo ve las suyas
-            q = coll.where("supplierUid", "==", uid)\
-                   .order_by("createdAt", direction=firestore.Query.DESCENDING)\
-                   .limit(100)
-        
-        docs = q.stream()
-        
-        # Serializar a JSON
-        items = []
-        for d in docs:
-            data = d.to_dict() or {}
-            data["invoiceId"] = d.id
-            
-            # Convertir timestamps
-            for field in ["createdAt", "processedAt"]:
-                if field in data and data[field] is not None:
-                    try:
-                        data[field] = data[field].to_datetime().isoformat()
-                    except:
-                        pass
-            
-            # Si es admin, agregar info del proveedor (email y RUC)
-            if role == "admin" and "supplierUid" in data:
-                try:
-                    # Obtener info del proveedor desde Auth
-                    from firebase_admin import auth as admin_auth
-                    user_record = admin_auth.get_user(data["supplierUid"])
-                    data["supplierEmail"] = user_record.email
-                    
-                    # Intentar obtener RUC desde colección suppliers
-                    supplier_doc = firestore_client.collection("suppliers").document(data["supplierUid"]).get()
-                    if supplier_doc.exists:
-                        supplier_data = supplier_doc.to_dict()
-                        data["supplierRuc"] = supplier_data.get("ruc")
-                except Exception as e:
-                    print(f"Error obteniendo info del proveedor: {e}")
-                    # No fallar si no se puede obtener info del proveedor
-                    pass
-            
-            items.append(data)
-        
-        return jsonify({"items": items, "total": len(items)}), 200
-        
-    except Exception as e:
-        print(f"Error listando facturas: {e}")
-        return jsonify({"error": "error listando facturas", "detail": str(e)}), 500
+        q, applied = _build_invoices_query(uid, role, request.args)
+    except ValueError as e:
+        return jsonify({"error": "parámetros inválidos", "detail": str(e)}), 400
+
+    if export_format == "csv":
+        # Solo los campos de las columnas (createdAt también sirve de cursor)
+        q = q.select([f for f in INVOICES_EXPORT_FIELDS if f not in ("invoiceId", "supplierEmail", "supplierRuc")])
+
+    def _generate():
+        exported = 0
+        started = time.monotonic()
+        try:
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=INVOICES_EXPORT_FIELDS, extrasaction="ignore")
+                # BOM para que Excel abra el UTF-8 (tildes, ñ) correctamente
+                buffer.write("\ufeff")
+                writer.writeheader()
+                yield buffer.getvalue()
+                for items in _iter_invoice_pages(q, role, INVOICES_EXPORT_PAGE_SIZE):
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows({k: _csv_value(v) for k, v in item.items()} for item in items)
+                    exported += len(items)
+                    yield buffer.getvalue()
+            else:
+                for items in _iter_invoice_pages(q, role, INVOICES_EXPORT_PAGE_SIZE):
+                    exported += len(items)
+                    yield "".join(app.json.dumps(item) + "\n" for item in items)
+        except Exception as e:
+            # Los headers ya se enviaron: se registra y, en NDJSON, se avisa en una línea final
+            print(f"Error exportando facturas (tras {exported} filas): {e}")
+            if export_format == "ndjson":
+                yield app.json.dumps({"error": "error exportando facturas", "detail": str(e)}) + "\n"
+            return
+        print(f"📤 Exportación {export_format}: {exported} facturas en {time.monotonic() - started:.1f}s (filtros: {applied})")
+
+    filename = f"facturas-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(
+        _generate(),
+        status=200,
+        mimetype="text/csv" if export_format == "csv" else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+def _apply_status_chunk(changes: List[tuple], uid: str, expected: Optional[set] = None,
+                        known: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Aplica [(invoice_id, status)] (IDs únicos) con un get_all y un batch, sin
+    transacción: cada update lleva como precondición el update_time leído.
+    Si otra escritura tocó alguna factura el commit falla; se releen solo las
+    facturas del batch y se reintenta con las lecturas nuevas, descartando
+    únicamente las que cambiaron STATUS_UPDATE_ATTEMPTS veces. Los contadores
+    se suman con Increment en un shard.
+    `expected`: solo se cambian las facturas que siguen en alguno de esos
+    estados. `known`: snapshots ya leídos por una consulta (invoice_id ->
+    snapshot con status), se usan en el primer intento en vez de releerlos.
+    """
+    refs = {invoice_id: firestore_client.collection("invoices").document(invoice_id) for invoice_id, _ in changes}
+    results: Dict[str, Dict[str, Any]] = {}
+    conflicts: Dict[str, int] = {}
+
+    def _read(invoice_ids) -> Dict[str, Any]:
+        with metrics.stage("firestore_read"):
+            return {
+                snap.reference.path: snap
+                for snap in firestore_client.get_all([refs[i] for i in invoice_ids], field_paths=["status"])
+            }
+
+    if known:
+        snaps = {refs[invoice_id].path: snap for invoice_id, snap in known.items() if invoice_id in refs}
+    else:
+        snaps = _read([invoice_id for invoice_id, _ in changes])
+    pending = list(changes)
+
+    while pending:
+        batch = firestore_client.batch()
+        by_status: Dict[str, int] = {}
+        applied: Dict[str, Dict[str, Any]] = {}
+
+        for invoice_id, new_status in pending:
+            snap = snaps.get(refs[invoice_id].path)
+            if snap is None or not snap.exists:
+                results[invoice_id] = {"invoiceId": invoice_id, "ok": False, "error": "factura no encontrada"}
+                continue
+            old_status = (snap.to_dict() or {}).get("status", "Recibida")
+            if expected is not None and old_status not in expected:
+                results[invoice_id] = {
+                    "invoiceId": invoice_id, "ok": False, "skipped": True,
+                    "error": f"la factura ya está en estado {old_status}"
+                }
+                continue
+            batch.update(refs[invoice_id], {
+                "status": new_status,
+                "lastUpdatedAt": firestore.SERVER_TIMESTAMP,
+                "lastUpdatedBy": uid
+            }, option=firestore_client.write_option(last_update_time=snap.update_time))
+            if old_status != new_status:
+                by_status[old_status] = by_status.get(old_status, 0) - 1
+                by_status[new_status] = by_status.get(new_status, 0) + 1
+            applied[invoice_id] = {
+                "invoiceId": invoice_id, "ok": True, "newStatus": new_status, "previousStatus": old_status
+            }
+
+        if not applied:
+            return results
+
+        _add_stats_delta(batch, by_status=by_status)
+        _bump_list_version(batch)
+
+        try:
+            with metrics.stage("firestore_write"):
+                batch.commit()
+        except gexceptions.FailedPrecondition:
+            # Alguien escribió entre la lectura y el commit: releer el batch y
+            # culpar solo a las facturas cuyo update_time cambió
+            fresh = _read(list(applied))
+            changed = [
+                invoice_id for invoice_id in applied
+                if getattr(fresh.get(refs[invoice_id].path), "update_time", None)
+                != snaps[refs[invoice_id].path].update_time
+            ]
+            for invoice_id in changed or list(applied):
+                conflicts[invoice_id] = conflicts.get(invoice_id, 0) + 1
+                if conflicts[invoice_id] >= STATUS_UPDATE_ATTEMPTS:
+                    results[invoice_id] = {
+                        "invoiceId": invoice_id, "ok": False,
+                        "error": "la factura cambió durante la actualización; reintente"
+                    }
+            pending = [(i, status) for i, status in pending if i in applied and i not in results]
+            snaps = fresh
+            continue
+        results.update(applied)
+        return results
+
+    return results
+
+
+def apply_status_updates(changes: List[tuple], uid: str) -> List[Dict[str, Any]]:
+    """
+    Cambia el estado de varias facturas en batches de Firestore (hasta 500
+    escrituras cada uno: STATUS_CHUNK_SIZE facturas más los shards de
+    contadores y versión) y devuelve un resultado por factura, en el orden recibido.
+    """
+    per_chunk = STATUS_CHUNK_SIZE
+    results: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(changes), per_chunk):
+        chunk = changes[i:i + per_chunk]
+        try:
+            results.update(_apply_status_chunk(chunk, uid))
+        except Exception as e:
+            print(f"Error actualizando estados ({len(chunk)} facturas): {e}")
+            for invoice_id, _ in chunk:
+                results[invoice_id] = {"invoiceId": invoice_id, "ok": False, "error": str(e)}
+    return [results[invoice_id] for invoice_id, _ in changes]
 
 
 @app.patch("/invoices/<invoice_id>/status")
@@ -509,7 +3047,7 @@ def update_invoice_status(invoice_id: str):
     Body: {"status": "Por Pagar" | "Pagada" | "Vencida" | "Recibida"}
     """
     try:
-        uid, role = _extract_bearer_uid_and_role()
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
         require_admin(uid, role)
     except Exception as e:
         return jsonify({"error": "no autorizado", "detail": str(e)}), 403
@@ -520,26 +3058,19 @@ def update_invoice_status(invoice_id: str):
         return jsonify({"error": "falta campo 'status' en el body"}), 400
     
     new_status = data["status"]
-    valid_statuses = ["Recibida", "Por Pagar", "Pagada", "Vencida"]
     
-    if new_status not in valid_statuses:
+    if new_status not in VALID_STATUSES:
         return jsonify({
-            "error": f"estado inválido. Debe ser uno de: {', '.join(valid_statuses)}"
+            "error": f"estado inválido. Debe ser uno de: {', '.join(VALID_STATUSES)}"
         }), 400
 
-    # Actualizar Firestore
+    # Actualizar Firestore junto con los contadores del dashboard
     try:
-        doc_ref = firestore_client.collection("invoices").document(invoice_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return jsonify({"error": "factura no encontrada"}), 404
-        
-        doc_ref.update({
-            "status": new_status,
-            "lastUpdatedAt": firestore.SERVER_TIMESTAMP,
-            "lastUpdatedBy": uid
-        })
+        result = _apply_status_chunk([(invoice_id, new_status)], uid)[invoice_id]
+        if not result["ok"]:
+            if result["error"] == "factura no encontrada":
+                return jsonify({"error": "factura no encontrada"}), 404
+            return jsonify({"error": "error actualizando estado", "detail": result["error"]}), 409
         
         return jsonify({
             "message": "Estado actualizado",
@@ -552,49 +3083,322 @@ def update_invoice_status(invoice_id: str):
         return jsonify({"error": "error actualizando estado", "detail": str(e)}), 500
 
 
+def _parse_bulk_status_body(data: Dict[str, Any]) -> tuple:
+    """
+    Convierte el body de PATCH /invoices/status en [(invoice_id, status)] válidos
+    y una lista de rechazos por ítem. Lanza ValueError si el body no es válido.
+    """
+    if "updates" in data:
+        items = data["updates"]
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            raise ValueError("'updates' debe ser una lista de {invoiceId, status}")
+        pairs = [(i.get("invoiceId"), i.get("status")) for i in items]
+    elif "invoiceIds" in data:
+        invoice_ids = data["invoiceIds"]
+        if not isinstance(invoice_ids, list):
+            raise ValueError("'invoiceIds' debe ser una lista de IDs")
+        if data.get("status") not in VALID_STATUSES:
+            raise ValueError(f"'status' debe ser uno de: {', '.join(VALID_STATUSES)}")
+        pairs = [(invoice_id, data["status"]) for invoice_id in invoice_ids]
+    else:
+        raise ValueError("envíe 'updates' o 'invoiceIds' con 'status'")
+
+    if not pairs:
+        raise ValueError("no hay facturas para actualizar")
+    if len(pairs) > STATUS_BULK_MAX_ITEMS:
+        raise ValueError(f"máximo {STATUS_BULK_MAX_ITEMS} facturas por request")
+
+    changes, rejected, seen = [], [], set()
+    for position, (invoice_id, status) in enumerate(pairs):
+        if not isinstance(invoice_id, str) or not invoice_id or "/" in invoice_id:
+            rejected.append((position, {"invoiceId": invoice_id, "ok": False, "error": "invoiceId inválido"}))
+        elif invoice_id in seen:
+            rejected.append((position, {"invoiceId": invoice_id, "ok": False, "error": "invoiceId repetido"}))
+        elif status not in VALID_STATUSES:
+            rejected.append((position, {"invoiceId": invoice_id, "ok": False, "error": "estado inválido"}))
+        else:
+            seen.add(invoice_id)
+            changes.append((position, (invoice_id, status)))
+    return changes, rejected
+
+
+@app.patch("/invoices/status")
+def update_invoice_status_bulk():
+    """
+    Cambia el estado de varias facturas a la vez. Solo admins.
+    Body: {"updates": [{"invoiceId": "...", "status": "Pagada"}, ...]}
+       o  {"invoiceIds": ["...", ...], "status": "Pagada"}
+    Devuelve un resultado por ítem (en el orden recibido) y el resumen.
+    """
+    try:
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+        require_admin(uid, role)
+    except Exception as e:
+        return jsonify({"error": "no autorizado", "detail": str(e)}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        changes, rejected = _parse_bulk_status_body(data)
+    except ValueError as e:
+        return jsonify({"error": "body inválido", "detail": str(e)}), 400
+
+    applied = apply_status_updates([change for _, change in changes], uid)
+    results = sorted(
+        rejected + [(position, result) for (position, _), result in zip(changes, applied)],
+        key=lambda item: item[0],
+    )
+    results = [result for _, result in results]
+    updated = sum(1 for r in results if r["ok"])
+
+    return jsonify({
+        "results": results,
+        "updated": updated,
+        "failed": len(results) - updated
+    }), 200
+
+
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _overdue_checkpoint_ref():
+    return firestore_client.collection("sweeps").document("overdue")
+
+
+def sweep_overdue_invoices(as_of: Optional[str] = None, write: bool = True, restart: bool = False,
+                           max_seconds: float = SWEEP_MAX_SECONDS) -> Dict[str, Any]:
+    """
+    Pasa a "Vencida" las facturas Recibida / Por Pagar con fecha_vencimiento
+    anterior a `as_of` (YYYY-MM-DD, default: hoy en Perú). Consulta solo esas
+    facturas (índice status + fecha_vencimiento), por páginas del tamaño de un
+    batch, y las actualiza con _apply_status_chunk (contadores del dashboard
+    incluidos). Tras cada página guarda el cursor en sweeps/overdue: si se
+    corta por `max_seconds` o por un error, la siguiente corrida del mismo
+    día sigue desde ahí. Las fechas que no son ISO se cuentan como skipped.
+    """
+    started = time.monotonic()
+    as_of = as_of or datetime.now(LOCAL_TZ).date().isoformat()
+    coll = firestore_client.collection("invoices")
+    checkpoint_ref = _overdue_checkpoint_ref()
+
+    checkpoint = checkpoint_ref.get()
+    checkpoint = checkpoint.to_dict() or {} if checkpoint.exists else {}
+    cursor = None
+    if not restart and checkpoint.get("asOf") == as_of and not checkpoint.get("complete"):
+        cursor = checkpoint.get("cursor")
+    resumed = cursor is not None
+
+    q = (coll.where("status", "in", OVERDUE_FROM_STATUSES)
+         .where("fecha_vencimiento", "<", as_of)
+         .order_by("fecha_vencimiento")
+         .select(["status", "fecha_vencimiento"]))
+    counts = {"scanned": 0, "updated": 0, "skipped": 0, "failed": 0}
+    complete = False
+    while True:
+        page_q = q
+        if cursor:
+            page_q = q.start_after(firestore.DocumentSnapshot(
+                coll.document(cursor["id"]), {"fecha_vencimiento": cursor["fecha_vencimiento"]},
+                exists=True, read_time=None, create_time=None, update_time=None,
+            ))
+        with metrics.stage("firestore_read"):
+            docs = list(page_q.limit(OVERDUE_PAGE_SIZE).stream())
+        counts["scanned"] += len(docs)
+
+        due = {
+            doc.id: doc for doc in docs
+            if _ISO_DATE.fullmatch(str((doc.to_dict() or {}).get("fecha_vencimiento") or ""))
+        }
+        counts["skipped"] += len(docs) - len(due)
+        if due and write:
+            results = _apply_status_chunk(
+                [(invoice_id, OVERDUE_STATUS) for invoice_id in due], OVERDUE_SWEEP_UID,
+                expected=set(OVERDUE_FROM_STATUSES), known=due,
+            )
+            for result in results.values():
+                outcome = "updated" if result["ok"] else "skipped" if result.get("skipped") else "failed"
+                counts[outcome] += 1
+        else:
+            counts["updated"] += len(due)
+
+        if len(docs) < OVERDUE_PAGE_SIZE:
+            complete, cursor = True, None
+        else:
+            cursor = {"fecha_vencimiento": (docs[-1].to_dict() or {}).get("fecha_vencimiento"), "id": docs[-1].id}
+        if write:
+            checkpoint_ref.set({
+                "asOf": as_of,
+                "cursor": cursor,
+                "complete": complete,
+                "counts": counts,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+        if complete or time.monotonic() - started >= max_seconds:
+            break
+
+    for outcome in ("updated", "skipped", "failed"):
+        if write and counts[outcome]:
+            metrics.overdue_sweep.inc(counts[outcome], result=outcome)
+    return {
+        "asOf": as_of,
+        **counts,
+        "complete": complete,
+        "resumed": resumed,
+        "elapsedMs": int((time.monotonic() - started) * 1000),
+    }
+
+
+@app.post("/admin/sweep-overdue")
+def sweep_overdue():
+    """
+    Marca como "Vencida" las facturas Recibida / Por Pagar cuya fecha de
+    vencimiento ya pasó. Pensado para Cloud Scheduler o cron: acepta un admin
+    o `Authorization: Bearer <SWEEP_TOKEN>`.
+    Body opcional: {"asOf": "YYYY-MM-DD", "dryRun": true, "restart": true}.
+    Si no termina en SWEEP_MAX_SECONDS responde complete=false y la
+    siguiente llamada continúa desde el último checkpoint.
+    """
+    auth_header = request.headers.get("Authorization", "")
+    if not (SWEEP_TOKEN and auth_header == f"Bearer {SWEEP_TOKEN}"):
+        try:
+            uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
+            require_admin(uid, role)
+        except Exception as e:
+            return jsonify({"error": "no autorizado", "detail": str(e)}), 403
+
+    data = request.get_json(silent=True) or {}
+    as_of = data.get("asOf")
+    if as_of is not None:
+        try:
+            if not _ISO_DATE.fullmatch(str(as_of)):
+                raise ValueError
+            datetime.strptime(as_of, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "body inválido", "detail": "'asOf' debe ser una fecha YYYY-MM-DD"}), 400
+
+    try:
+        summary = sweep_overdue_invoices(
+            as_of, write=not data.get("dryRun", False), restart=bool(data.get("restart", False))
+        )
+    except Exception as e:
+        print(f"Error en el barrido de vencidas: {e}")
+        return jsonify({"error": "error en el barrido de vencidas", "detail": str(e)}), 500
+    print(f"⏰ Barrido de vencidas ({summary['asOf']}{', simulación' if data.get('dryRun') else ''}): "
+          f"{summary['updated']} vencidas, {summary['skipped']} omitidas, {summary['failed']} con error")
+    return jsonify(summary), 200
+
+
+@app.cli.command("sweep-overdue")
+@click.option("--as-of", help="Fecha de corte YYYY-MM-DD (default: hoy en Perú)")
+@click.option("--dry-run", is_flag=True, help="Solo cuenta, sin escribir")
+@click.option("--restart", is_flag=True, help="Ignorar el checkpoint de una corrida incompleta")
+def sweep_overdue_command(as_of: Optional[str], dry_run: bool, restart: bool):
+    """Marca como Vencida las facturas con fecha_vencimiento pasada (flask --app app sweep-overdue)."""
+    summary = sweep_overdue_invoices(as_of, write=not dry_run, restart=restart, max_seconds=float("inf"))
+    print(f"{'🔍' if dry_run else '✅'} {summary['scanned']} facturas leídas, {summary['updated']} "
+          f"{'a marcar' if dry_run else 'marcadas'} como Vencida, {summary['skipped']} omitidas, "
+          f"{summary['failed']} con error ({summary['elapsedMs']} ms)")
+
+
+def _encode_supplier_cursor(doc) -> str:
+    """Cursor opaco (id y RUC del último perfil) para el listado filtrado."""
+    raw = json.dumps({"id": doc.id, "ruc": (doc.to_dict() or {}).get("ruc")}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_supplier_cursor(token: str, coll):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        doc_id, ruc = raw["id"], raw.get("ruc")
+    except Exception:
+        raise ValueError("'page_token' inválido para el listado filtrado")
+    return firestore.DocumentSnapshot(
+        coll.document(doc_id), {"ruc": ruc},
+        exists=True, read_time=None, create_time=None, update_time=None,
+    )
+
+
+def _serialize_supplier(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "uid": entry["uid"],
+        "email": entry["email"],
+        "displayName": entry["displayName"],
+        "createdAt": entry["createdAt"],
+        "role": entry["role"],
+        "profile": entry["profile"],
+    }
+
+
 @app.get("/suppliers")
 def list_suppliers():
     """
-    Lista todos los proveedores (usuarios registrados). Solo admins.
+    Lista los proveedores (usuarios registrados) por páginas. Solo admins.
+    Query opcional:
+      page_size (default 100, máx. 1000), page_token (nextPageToken de la
+      página anterior), status (estado del perfil) y ruc_prefix.
+    Sin filtros se recorre Firebase Auth con list_users; con filtros se
+    consulta la colección suppliers. En ambos casos cada página cuesta una
+    consulta + un get_users + un get_all, sin importar el total de proveedores.
     """
     try:
-        uid, role = _extract_bearer_uid_and_role()
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
         require_admin(uid, role)
     except Exception as e:
         return jsonify({"error": "no autorizado", "detail": str(e)}), 403
 
     try:
-        # Listar usuarios de Firebase Auth
-        users = []
-        page = fb_auth.list_users()
-        
-        while page:
-            for user in page.users:
-                # Obtener perfil de Firestore desde colección 'suppliers'
-                supplier_doc = firestore_client.collection("suppliers").document(user.uid).get()
-                supplier_data = supplier_doc.to_dict() if supplier_doc.exists else {}
-                
-                users.append({
-                    "uid": user.uid,
-                    "email": user.email,
-                    "displayName": user.display_name,
-                    "createdAt": user.user_metadata.creation_timestamp,
-                    "role": user.custom_claims.get("role") if user.custom_claims else None,
-                    "profile": {
-                        "ruc": supplier_data.get("ruc"),
-                        "razonSocial": supplier_data.get("razonSocial"),
-                        "representanteLegal": supplier_data.get("representanteLegal"),
-                        "direccion": supplier_data.get("direccion"),
-                        "status": supplier_data.get("status")
-                    }
-                })
-            
-            # Siguiente página
-            page = page.get_next_page()
-            if not page:
-                break
-        
-        return jsonify({"suppliers": users, "total": len(users)}), 200
+        page_size = int(request.args.get("page_size", SUPPLIERS_DEFAULT_PAGE_SIZE))
+        if page_size < 1:
+            raise ValueError("'page_size' debe ser mayor que 0")
+        page_size = min(page_size, SUPPLIERS_MAX_PAGE_SIZE)
+        page_token = request.args.get("page_token") or None
+        status = request.args.get("status") or None
+        ruc_prefix = request.args.get("ruc_prefix") or None
+        if ruc_prefix is not None and (not ruc_prefix.isdigit() or len(ruc_prefix) > 11):
+            raise ValueError("'ruc_prefix' debe tener entre 1 y 11 dígitos")
+    except ValueError as e:
+        return jsonify({"error": "parámetros inválidos", "detail": str(e)}), 400
+
+    applied = {k: v for k, v in (("status", status), ("ruc_prefix", ruc_prefix)) if v is not None}
+
+    try:
+        if not applied:
+            # Una página de Firebase Auth; los perfiles se leen con un get_all
+            page = fb_auth.list_users(page_token=page_token, max_results=page_size)
+            directory = supplier_directory.get_many((u.uid for u in page.users), known_users=page.users)
+            suppliers = [_serialize_supplier(directory[u.uid]) for u in page.users]
+            next_token = page.next_page_token or None
+        else:
+            # Filtros sobre el perfil: consulta a suppliers y datos de Auth en lote
+            coll = firestore_client.collection("suppliers")
+            q = coll
+            if status:
+                q = q.where("status", "==", status)
+            if ruc_prefix:
+                q = q.where("ruc", ">=", ruc_prefix).where("ruc", "<=", ruc_prefix + "\uf8ff").order_by("ruc")
+            else:
+                q = q.order_by("__name__")
+            if page_token:
+                try:
+                    q = q.start_after(_decode_supplier_cursor(page_token, coll))
+                except ValueError as e:
+                    return jsonify({"error": "parámetros inválidos", "detail": str(e)}), 400
+
+            docs = list(q.limit(page_size + 1).stream())
+            has_more = len(docs) > page_size
+            docs = docs[:page_size]
+            directory = supplier_directory.get_many(
+                (d.id for d in docs), known_profiles={d.id: d.to_dict() or {} for d in docs}
+            )
+            suppliers = [_serialize_supplier(directory[d.id]) for d in docs]
+            next_token = _encode_supplier_cursor(docs[-1]) if has_more else None
+
+        return jsonify({
+            "suppliers": suppliers,
+            "total": len(suppliers),
+            "pageSize": page_size,
+            "filters": applied,
+            "nextPageToken": next_token
+        }), 200
         
     except Exception as e:
         print(f"Error listando proveedores: {e}")
@@ -607,73 +3411,30 @@ def dashboard_stats():
     Devuelve estadísticas para el dashboard de admin.
     """
     try:
-        uid, role = _extract_bearer_uid_and_role()
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
         require_admin(uid, role)
     except Exception as e:
         return jsonify({"error": "no autorizado", "detail": str(e)}), 403
 
     try:
-        # Contar facturas por estado
-        invoices_coll = firestore_client.collection("invoices")
-        
-        all_invoices = list(invoices_coll.stream())
-        
-        stats = {
-            "total_invoices": len(all_invoices),
-            "by_status": {
-                "Recibida": 0,
-                "Por Pagar": 0,
-                "Pagada": 0,
-                "Vencida": 0
-            },
-            "processed_count": 0,
-            "total_suppliers": 0,
-            "recent_invoices": []
-        }
-        
-        # Contar por estado
-        for doc in all_invoices:
-            data = doc.to_dict()
-            status = data.get("status", "Recibida")
-            if status in stats["by_status"]:
-                stats["by_status"][status] += 1
-            
-            if data.get("processed"):
-                stats["processed_count"] += 1
-        
-        # Contar proveedores únicos
-        unique_suppliers = set(doc.to_dict().get("supplierUid") for doc in all_invoices if doc.to_dict().get("supplierUid"))
-        stats["total_suppliers"] = len(unique_suppliers)
-        
-        # Facturas recientes (últimas 5) - ordenar por createdAt
-        def get_created_at(doc):
-            data = doc.to_dict()
-            created_at = data.get("createdAt")
-            if created_at:
-                try:
-                    return created_at.timestamp() if hasattr(created_at, 'timestamp') else 0
-                except:
-                    return 0
-            return 0
-        
-        recent = sorted(all_invoices, key=get_created_at, reverse=True)[:5]
-        
-        for doc in recent:
-            data = doc.to_dict()
-            created_at = data.get("createdAt")
-            try:
-                created_at_str = created_at.isoformat() if hasattr(created_at, 'isoformat') else None
-            except:
-                created_at_str = None
-            
-            stats["recent_invoices"].append({
-                "invoiceId": doc.id,
-                "status": data.get("status"),
-                "monto_total": data.get("monto_total"),
-                "createdAt": created_at_str
-            })
-        
-        return jsonify(stats), 200
+        # Validador: la versión de los listados sube con cada escritura que
+        # cambia contadores o facturas recientes. Se revisa antes de leer los
+        # shards de contadores y de consultar las facturas recientes.
+        version, last_modified = _stats_version()
+        etag = f"stats-{version}" if version is not None else None
+        if etag:
+            not_modified = _not_modified(etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+
+        # Dos consultas chicas: los shards de contadores (se mantienen al
+        # escribir facturas) y las últimas facturas
+        stats = read_dashboard_stats()
+
+        response = jsonify(stats)
+        if etag:
+            _with_validators(response, etag, last_modified)
+        return response, 200
         
     except Exception as e:
         print(f"Error obteniendo estadísticas: {e}")
@@ -687,7 +3448,7 @@ def set_user_role():
     Body: {"uid": "user-uid", "role": "admin" | "proveedor"}
     """
     try:
-        uid, role = _extract_bearer_uid_and_role()
+        uid, role = _extract_bearer_uid_and_role(check_revoked=AUTH_CHECK_REVOKED_ADMIN)
         require_admin(uid, role)
     except Exception as e:
         return jsonify({"error": "no autorizado", "detail": str(e)}), 403
@@ -705,6 +3466,7 @@ def set_user_role():
     try:
         # Asignar custom claim
         fb_auth.set_custom_user_claims(target_uid, {"role": target_role})
+        supplier_directory.invalidate(target_uid)
         
         return jsonify({
             "message": "Rol asignado exitosamente",
@@ -733,13 +3495,21 @@ def get_profile():
     try:
         doc = firestore_client.collection("suppliers").document(uid).get()
         
+        # El update_time del documento identifica la versión del perfil
+        stamp = doc.update_time.timestamp() if doc.exists and doc.update_time else 0
+        etag = "profile-" + hashlib.sha1(f"{uid}|{role}|{stamp}".encode()).hexdigest()[:20]
+        last_modified = doc.update_time if doc.exists else None
+        not_modified = _not_modified(etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
         if doc.exists:
             data = doc.to_dict()
             data["uid"] = uid
             data["role"] = role
-            return jsonify(data), 200
+            return _with_validators(jsonify(data), etag, last_modified), 200
         else:
-            return jsonify({"uid": uid, "role": role}), 200
+            return _with_validators(jsonify({"uid": uid, "role": role}), etag, last_modified), 200
             
     except Exception as e:
         print(f"Error obteniendo perfil: {e}")
@@ -774,7 +3544,12 @@ def update_profile():
             "updatedAt": firestore.SERVER_TIMESTAMP
         }
         
-        doc_ref.set(profile_data, merge=True)
+        # El RUC del perfil aparece en GET /invoices (admin): subir la versión de su ETag
+        batch = firestore_client.batch()
+        batch.set(doc_ref, profile_data, merge=True)
+        _bump_list_version(batch)
+        batch.commit()
+        supplier_directory.invalidate(uid)
         
         # Respuesta sin SERVER_TIMESTAMP (no es serializable a JSON)
         response_data = {
@@ -792,6 +3567,38 @@ def update_profile():
         return jsonify({"error": "error actualizando perfil", "detail": str(e)}), 500
 
 
+# -----------------------------------------------------------------------------
+# Arranque
+# -----------------------------------------------------------------------------
+STARTUP_IMPORT_MS = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+print(f"⏱️ app.py importado en {STARTUP_IMPORT_MS} ms (clientes sin inicializar)")
+# Con `python app.py` los procesos "spawn" del pool de pdftext vuelven a
+# importar este archivo como __mp_main__: ahí no se precalienta nada (si no,
+# cada proceso abriría sus propios clientes y su propio pool).
+if WARMUP_ON_START and __name__ != "__mp_main__":
+    services.registry.warmup()
+
+
+@app.route("/_warmup", methods=["GET", "POST"])
+def warmup():
+    """
+    Inicializa en segundo plano los clientes perezosos (Firestore, Storage,
+    Auth, Gemini y sus SDKs) y devuelve el reporte de arranque. Con
+    ?wait=true espera a que terminen. Pensado para el startup probe / warmup
+    de Cloud Run; no expone datos.
+    """
+    wait = request.args.get("wait", "false").lower() == "true"
+    targets = ["import:google.cloud.firestore", "firestore", "import:google.cloud.storage", "storage", "auth"]
+    if GEMINI_AI_ENABLED:
+        targets += ["import:google.generativeai", "gemini"]
+    started = services.registry.warmup(targets, background=not wait)
+    return jsonify({
+        "warmupStarted": started,
+        "importMs": STARTUP_IMPORT_MS,
+        "components": services.registry.report(),
+    }), 200 if wait else 202
+
+
 # -----------------------------------------------------------------------------
 # Main (para ejecución local)
 # -----------------------------------------------------------------------------
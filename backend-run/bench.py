@@ -0,0 +1,317 @@
+"""
+Benchmark offline del backend con los fakes en memoria de fakes.py.
+
+Carga app.py con NEO_BACKENDS=fake, siembra una base realista (por defecto
+50k facturas y 2k proveedores) y recorre las rutas principales con el test
+client de Flask. Por escenario reporta latencia p50/p95/p99, llamadas a los
+backends por request y memoria pico, en JSON.
+
+Uso:
+    python bench.py --output bench.json
+    python bench.py --invoices 5000 --suppliers 200 --requests 50
+    python bench.py --baseline bench.json --max-regression 0.25   # exit 1 si empeora el p95
+
+La latencia simulada de Firestore/Storage/Auth (--latency-ms) y de Gemini
+(--gemini-latency-ms) se aplica solo durante las mediciones, no al sembrar.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+
+STATUSES = ["Recibida", "Por Pagar", "Pagada", "Vencida"]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _ruc_for(i: int, valid: bool = True) -> str:
+    """RUC de prueba con dígito verificador correcto (o alterado si valid=False)."""
+    import sunat_extractor
+
+    base = f"20{i:08d}"
+    check = next(d for d in "0123456789" if sunat_extractor.is_valid_ruc(base + d))
+    if not valid:
+        check = str((int(check) + 1) % 10)
+    return base + check
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+        import app
+        import fakes
+
+        self.app = app
+        self.fakes = fakes
+        self.latency = fakes.FakeLatency()
+        self.stats = fakes.CallStats()
+        self.backends = fakes.make_backends(self.latency, self.stats)
+        app.configure_backends(**self.backends)
+        self.fs = self.backends["firestore_client"]
+        self.storage = self.backends["storage_client"]
+        self.auth = self.backends["auth"]
+        self.client = app.app.test_client()
+        self.supplier_uids: List[str] = []
+        self.invoice_ids: List[str] = []
+
+    def headers(self, uid: str) -> Dict[str, str]:
+        return {"Authorization": "Bearer " + self.auth.token_for(uid)}
+
+    # -------------------------------------------------------------------------
+    # Datos
+    # -------------------------------------------------------------------------
+    def seed(self):
+        args = self.args
+        self.auth.add_user("bench-admin", role="admin")
+        for i in range(args.suppliers):
+            uid = f"sup_{i:05d}"
+            self.auth.add_user(uid, role="proveedor")
+            self.fs.seed(f"suppliers/{uid}", {
+                "ruc": _ruc_for(i),
+                "razonSocial": f"PROVEEDOR {i} S.A.C.",
+                "representanteLegal": "Representante",
+                "direccion": "Lima",
+                "status": "activo",
+            })
+            self.supplier_uids.append(uid)
+
+        now = datetime.now(timezone.utc)
+        for i in range(args.invoices):
+            invoice_id = f"inv_{i:07d}"
+            supplier_uid = self.supplier_uids[i % len(self.supplier_uids)]
+            processed = self.rng.random() < 0.7
+            self.fs.seed(f"invoices/{invoice_id}", {
+                "supplierUid": supplier_uid,
+                "storagePath": f"invoices/{supplier_uid}/{invoice_id}.pdf",
+                "originalFilename": f"{invoice_id}.pdf",
+                "status": self.rng.choice(STATUSES),
+                "processed": processed,
+                "monto_total": f"{self.rng.randint(100, 99999)}.00" if processed else None,
+                "createdAt": now - timedelta(minutes=i),
+            })
+            self.invoice_ids.append(invoice_id)
+        self.app.rebuild_dashboard_stats(write=True)
+
+    # -------------------------------------------------------------------------
+    # Medición
+    # -------------------------------------------------------------------------
+    def measure(self, name: str, requests: int, call: Callable[[int], Any]) -> Dict[str, Any]:
+        latencies: List[float] = []
+        errors = 0
+        self.stats.reset()
+        if self.args.trace_memory:
+            tracemalloc.start()
+        for i in range(requests):
+            started = time.perf_counter()
+            response = call(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+        peak_kb = None
+        if self.args.trace_memory:
+            peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+        calls = self.stats.snapshot()
+        latencies.sort()
+        result = {
+            "requests": requests,
+            "errors": errors,
+            "p50_ms": round(_percentile(latencies, 50), 2),
+            "p95_ms": round(_percentile(latencies, 95), 2),
+            "p99_ms": round(_percentile(latencies, 99), 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+            "backend_calls_per_request": {op: round(n / requests, 2) for op, n in sorted(calls.items())},
+            "peak_memory_kb": peak_kb,
+        }
+        print(f"  {name:<32} p50={result['p50_ms']:>8} ms  p95={result['p95_ms']:>8} ms  "
+              f"p99={result['p99_ms']:>8} ms  errores={errors}", file=sys.stderr)
+        return result
+
+    def run(self) -> Dict[str, Any]:
+        args = self.args
+        admin = self.headers("bench-admin")
+        n = args.requests
+        results: Dict[str, Any] = {}
+
+        started = time.perf_counter()
+        self.seed()
+        seed_seconds = round(time.perf_counter() - started, 2)
+        print(f"🌱 Sembrado: {args.invoices} facturas, {args.suppliers} proveedores en {seed_seconds}s", file=sys.stderr)
+
+        self.latency.default = args.latency_ms / 1000
+        self.latency.per_op["gemini_generate"] = args.gemini_latency_ms / 1000
+
+        def upload(i):
+            uid = self.supplier_uids[i % len(self.supplier_uids)]
+            pdf = self.fakes.make_invoice_pdf(
+                ruc=_ruc_for(i, valid=self.rng.random() >= args.gemini_share),
+                numero=f"F{900 + i % 99:03d}-{i:08d}",
+                total=f"{1000 + i}.00",
+            )
+            return self.client.post(
+                "/invoices", headers=self.headers(uid),
+                data={"file": (io.BytesIO(pdf), f"bench_{i}.pdf")},
+                content_type="multipart/form-data",
+            )
+
+        uploaded: List[str] = []
+
+        def upload_and_keep(i):
+            response = upload(i)
+            if response.status_code < 300:
+                uploaded.append(response.get_json()["invoiceId"])
+            return response
+
+        results["POST /invoices"] = self.measure("POST /invoices", n, upload_and_keep)
+        results["GET /invoices (admin)"] = self.measure(
+            "GET /invoices (admin)", n, lambda i: self.client.get("/invoices?page_size=100", headers=admin))
+        results["GET /invoices (admin, status)"] = self.measure(
+            "GET /invoices (admin, status)", n,
+            lambda i: self.client.get(f"/invoices?page_size=100&status={STATUSES[i % 4]}", headers=admin))
+        results["GET /invoices (proveedor)"] = self.measure(
+            "GET /invoices (proveedor)", n,
+            lambda i: self.client.get("/invoices", headers=self.headers(self.supplier_uids[i % len(self.supplier_uids)])))
+        results["GET /dashboard/stats"] = self.measure(
+            "GET /dashboard/stats", n, lambda i: self.client.get("/dashboard/stats", headers=admin))
+        results["GET /suppliers"] = self.measure(
+            "GET /suppliers", max(1, n // 10), lambda i: self.client.get("/suppliers", headers=admin))
+
+        # /process responde 202; además se mide el tiempo hasta que termina cada trabajo
+        job_ids: List[str] = []
+
+        def process(i):
+            invoice_id = uploaded[i % len(uploaded)]
+            response = self.client.post(f"/invoices/{invoice_id}/process?refresh=true", headers=admin)
+            if response.status_code == 202:
+                job_ids.append(response.get_json()["jobId"])
+            return response
+
+        if uploaded:
+            results["POST /invoices/<id>/process"] = self.measure("POST /invoices/<id>/process", n, process)
+            results["process job (end-to-end)"] = self.wait_jobs(job_ids)
+
+        return {
+            "config": {
+                "invoices": args.invoices,
+                "suppliers": args.suppliers,
+                "requests": n,
+                "latencyMs": args.latency_ms,
+                "geminiLatencyMs": args.gemini_latency_ms,
+                "geminiShare": args.gemini_share,
+                "seed": args.seed,
+            },
+            "seedSeconds": seed_seconds,
+            "maxRssKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "scenarios": results,
+        }
+
+    def wait_jobs(self, job_ids: List[str], timeout: float = 600.0) -> Dict[str, Any]:
+        deadline = time.monotonic() + timeout
+        pending = set(job_ids)
+        finished: Dict[str, Dict[str, Any]] = {}
+        while pending and time.monotonic() < deadline:
+            for job_id in list(pending):
+                job = self.app.job_queue.get(job_id)
+                if job and job["status"] in self.app.jobs.FINISHED_STATES:
+                    finished[job_id] = self.app.jobs.with_timings(job)
+                    pending.discard(job_id)
+            time.sleep(0.05)
+        totals = sorted(float((j.get("queuedMs") or 0) + (j.get("runMs") or 0)) for j in finished.values())
+        runs = sorted(float(j.get("runMs") or 0) for j in finished.values())
+        result = {
+            "requests": len(job_ids),
+            "errors": len(pending) + sum(1 for j in finished.values() if j["status"] != self.app.jobs.JOB_DONE),
+            "p50_ms": _percentile(totals, 50),
+            "p95_ms": _percentile(totals, 95),
+            "p99_ms": _percentile(totals, 99),
+            "run_p50_ms": _percentile(runs, 50),
+            "run_p95_ms": _percentile(runs, 95),
+        }
+        print(f"  {'process job (end-to-end)':<32} p50={result['p50_ms']:>8} ms  p95={result['p95_ms']:>8} ms  "
+              f"errores={result['errors']}", file=sys.stderr)
+        return result
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline_path: str, max_regression: float) -> List[str]:
+    """Devuelve los escenarios cuyo p95 empeoró más de max_regression respecto al baseline."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or not previous.get("p95_ms"):
+            continue
+        ratio = current["p95_ms"] / previous["p95_ms"]
+        if ratio > 1 + max_regression:
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms (x{ratio:.2f})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del backend (fakes en memoria)")
+    parser.add_argument("--invoices", type=int, default=50000)
+    parser.add_argument("--suppliers", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200, help="requests por escenario")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latencia simulada por llamada a Firestore/Storage/Auth")
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0, help="latencia simulada de Gemini")
+    parser.add_argument("--gemini-share", type=float, default=0.3,
+                        help="fracción de PDFs que el extractor local no resuelve (van a Gemini)")
+    parser.add_argument("--trace-memory", action="store_true", help="medir memoria pico por escenario (tracemalloc, más lento)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true", help="no silenciar los logs de app.py")
+    parser.add_argument("--output", help="archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="aumento de p95 tolerado (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Configuración de la app antes de importarla
+    os.environ["NEO_BACKENDS"] = "fake"
+    os.environ.setdefault("JOB_QUEUE_BACKEND", "memory")
+    os.environ.setdefault("PDF_TEXT_PROCESSES", "0")
+
+    if args.verbose:
+        report = Bench(args).run()
+    else:
+        # Los print de app.py (uno o varios por request) distorsionan los tiempos y ensucian la salida
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = Bench(args).run()
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📄 Resultados en {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        regressions = compare_with_baseline(report, args.baseline, args.max_regression)
+        for line in regressions:
+            print(f"❌ Regresión: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Micro-benchmark de serialización de respuestas (responses.py).
+
+Compara, sobre un listado de facturas como el de GET /invoices (1000 por
+defecto, con timestamps de Firestore):
+
+  - flask:  conversión de timestamps campo por campo + jsonify estándar de Flask
+  - orjson: OrjsonProvider (datetime nativo, sin conversión previa)
+
+y el tamaño/tiempo de comprimir el resultado con gzip y brotli.
+
+Uso:
+    python bench_json.py
+    python bench_json.py --invoices 5000 --repeat 20 --output bench_json.json
+"""
+import argparse
+import gzip
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import responses
+
+try:
+    from google.api_core.datetime_helpers import DatetimeWithNanoseconds as _Timestamp
+except ImportError:
+    _Timestamp = datetime
+
+STATUSES = ["Recibida", "Por Pagar", "Pagada", "Vencida"]
+
+
+class _Doc:
+    """Snapshot mínimo (id + to_dict) como los que devuelve Firestore."""
+
+    def __init__(self, doc_id: str, data: Dict[str, Any]):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+
+def _make_docs(n: int, seed: int) -> List[_Doc]:
+    rng = random.Random(seed)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(n):
+        created = base + timedelta(minutes=rng.randint(0, 500_000))
+        processed = rng.random() < 0.7
+        ts = lambda d: _Timestamp(d.year, d.month, d.day, d.hour, d.minute, d.second, rng.randint(0, 999_999), tzinfo=timezone.utc)
+        docs.append(_Doc(f"inv_{i:012x}", {
+            "supplierUid": f"uid_{rng.randint(0, 1999):05d}",
+            "storagePath": f"invoices/uid/{i}.pdf",
+            "originalFilename": f"factura_{i}.pdf",
+            "pdfSha256": f"{rng.getrandbits(256):064x}",
+            "pdfSize": rng.randint(20_000, 2_000_000),
+            "deduplicated": False,
+            "status": rng.choice(STATUSES),
+            "es_factura": processed,
+            "monto_total": f"{rng.uniform(50, 50_000):.2f}" if processed else None,
+            "moneda": "PEN" if processed else None,
+            "ruc_emisor": f"20{rng.randint(0, 10**9 - 1):09d}" if processed else None,
+            "razon_social_emisor": "Distribuidora Peruana S.A.C." if processed else None,
+            "fecha_emision": created.date().isoformat() if processed else None,
+            "fecha_vencimiento": (created + timedelta(days=30)).date().isoformat() if processed else None,
+            "numero_factura": f"F001-{i:08d}" if processed else None,
+            "concepto": "Servicio de mantenimiento de equipos" if processed else None,
+            "confidence": rng.randint(60, 100) if processed else None,
+            "extractor": rng.choice(["local", "gemini"]) if processed else None,
+            "processed": processed,
+            "createdAt": ts(created),
+            "processedAt": ts(created + timedelta(minutes=5)) if processed else None,
+            "lastUpdatedAt": ts(created + timedelta(days=2)),
+            "supplierEmail": f"proveedor{i}@example.com",
+            "supplierRuc": f"20{rng.randint(0, 10**9 - 1):09d}",
+        }))
+    return docs
+
+
+def _legacy_serialize(d) -> Dict[str, Any]:
+    """Serialización previa a responses.py (conversión campo por campo)."""
+    data = d.to_dict() or {}
+    data["invoiceId"] = d.id
+    for field in ["createdAt", "processedAt"]:
+        if field in data and data[field] is not None:
+            try:
+                data[field] = data[field].to_datetime().isoformat()
+            except Exception:
+                pass
+    return data
+
+
+def _orjson_serialize(d) -> Dict[str, Any]:
+    data = d.to_dict() or {}
+    data["invoiceId"] = d.id
+    return data
+
+
+def _time_it(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "min_ms": round(samples[0], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    docs = _make_docs(args.invoices, args.seed)
+
+    flask_app = Flask("bench_flask")
+    flask_app.json = DefaultJSONProvider(flask_app)
+    orjson_app = Flask("bench_orjson")
+    if responses.orjson is None:
+        raise SystemExit("orjson no está instalado")
+    orjson_app.json = responses.OrjsonProvider(orjson_app)
+
+    def _payload(serialize):
+        items = [serialize(d) for d in docs]
+        return {"items": items, "total": len(items), "pageSize": len(items), "filters": {}, "nextCursor": None}
+
+    def _flask():
+        with flask_app.app_context():
+            return flask_app.json.response(_payload(_legacy_serialize)).get_data()
+
+    def _orjson():
+        with orjson_app.app_context():
+            return orjson_app.json.response(_payload(_orjson_serialize)).get_data()
+
+    # Calentamiento
+    flask_body, orjson_body = _flask(), _orjson()
+    assert len(json.loads(orjson_body)["items"]) == args.invoices
+
+    report: Dict[str, Any] = {
+        "invoices": args.invoices,
+        "repeat": args.repeat,
+        "serialize": {
+            "flask": {**_time_it(_flask, args.repeat), "bytes": len(flask_body)},
+            "orjson": {**_time_it(_orjson, args.repeat), "bytes": len(orjson_body)},
+        },
+        "compress": {},
+    }
+    flask_ms = report["serialize"]["flask"]["median_ms"]
+    orjson_ms = report["serialize"]["orjson"]["median_ms"]
+    report["serialize"]["speedup"] = round(flask_ms / orjson_ms, 2) if orjson_ms else None
+
+    report["compress"]["gzip"] = {
+        **_time_it(lambda: gzip.compress(orjson_body, compresslevel=responses.GZIP_LEVEL), args.repeat),
+        "bytes": len(gzip.compress(orjson_body, compresslevel=responses.GZIP_LEVEL)),
+    }
+    if responses.brotli is not None:
+        report["compress"]["br"] = {
+            **_time_it(lambda: responses.brotli.compress(orjson_body, quality=responses.BROTLI_QUALITY), args.repeat),
+            "bytes": len(responses.brotli.compress(orjson_body, quality=responses.BROTLI_QUALITY)),
+        }
+    return report
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark de serialización JSON y compresión")
+    parser.add_argument("--invoices", type=int, default=1000, help="facturas en el payload (default: 1000)")
+    parser.add_argument("--repeat", type=int, default=50, help="repeticiones por medición (default: 50)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="archivo JSON de resultados (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    report = run(args)
+    s = report["serialize"]
+    print(f"  flask   {s['flask']['median_ms']:>8} ms  {s['flask']['bytes']:>9} bytes", file=sys.stderr)
+    print(f"  orjson  {s['orjson']['median_ms']:>8} ms  {s['orjson']['bytes']:>9} bytes  (x{s['speedup']})", file=sys.stderr)
+    for name, result in report["compress"].items():
+        print(f"  {name:<7} {result['median_ms']:>8} ms  {result['bytes']:>9} bytes", file=sys.stderr)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"📄 Resultados en {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
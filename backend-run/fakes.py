@@ -0,0 +1,1114 @@
+"""
+Backends en memoria (Firestore, Cloud Storage, Firebase Auth y Gemini) para
+ejecutar app.py sin credenciales de GCP: benchmarks y pruebas locales.
+
+Cada fake imita solo la parte de la API que usa app.py, cuenta las llamadas
+por operación y puede simular latencia de red (ver FakeLatency).
+"""
+import copy
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from google.api_core import exceptions as gexc
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import _helpers as fs_helpers
+from google.cloud.firestore_v1 import transforms as fs_transforms
+from firebase_admin import _user_identifier as fb_identifiers
+
+
+# -----------------------------------------------------------------------------
+# Latencia y contadores
+# -----------------------------------------------------------------------------
+class FakeLatency:
+    """
+    Latencia simulada (en segundos) por operación. Las operaciones no listadas
+    usan `default`. Ej.: FakeLatency(default=0.002, gemini_generate=0.8)
+    """
+
+    def __init__(self, default: float = 0.0, **per_op: float):
+        self.default = default
+        self.per_op = per_op
+
+    def sleep(self, op: str):
+        delay = self.per_op.get(op, self.default)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CallStats:
+    """Contador de llamadas por operación, seguro entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, op: str, n: int = 1):
+        with self._lock:
+            self._counts[op] += n
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class _Backend:
+    def __init__(self, latency: Optional[FakeLatency] = None, stats: Optional[CallStats] = None):
+        self.latency = latency or FakeLatency()
+        self.stats = stats or CallStats()
+
+    def _call(self, op: str, n: int = 1):
+        self.stats.add(op, n)
+        self.latency.sleep(op)
+
+
+# -----------------------------------------------------------------------------
+# Firestore
+# -----------------------------------------------------------------------------
+_MISSING = object()
+
+
+def _now() -> DatetimeWithNanoseconds:
+    return DatetimeWithNanoseconds.now(timezone.utc)
+
+
+def _get_path(data: Dict[str, Any], field_path: str):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set_path(data: Dict[str, Any], field_path: str, value):
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        nxt = data.get(part)
+        if not isinstance(nxt, dict):
+            nxt = {}
+            data[part] = nxt
+        data = nxt
+    data[parts[-1]] = value
+
+
+def _delete_path(data: Dict[str, Any], field_path: str):
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        data = data.get(part)
+        if not isinstance(data, dict):
+            return
+    data.pop(parts[-1], None)
+
+
+def _apply_value(current, value):
+    """Resuelve sentinels y transforms de Firestore sobre el valor actual."""
+    if value is fs_transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, fs_transforms.Increment):
+        base = current if isinstance(current, (int, float)) and current is not _MISSING else 0
+        return base + value.value
+    if isinstance(value, fs_transforms.ArrayUnion):
+        base = list(current) if isinstance(current, list) else []
+        return base + [v for v in value.values if v not in base]
+    if isinstance(value, fs_transforms.ArrayRemove):
+        base = list(current) if isinstance(current, list) else []
+        return [v for v in base if v not in value.values]
+    if isinstance(value, dict):
+        return {k: _apply_value(_MISSING, v) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+def _merge_into(target: Dict[str, Any], data: Dict[str, Any]):
+    for key, value in data.items():
+        if value is fs_transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        else:
+            target[key] = _apply_value(target.get(key, _MISSING), value)
+
+
+def _sort_key(value):
+    """Orden aproximado entre tipos, similar al de Firestore."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+class _Doc:
+    __slots__ = ("data", "create_time", "update_time")
+
+    def __init__(self, data, create_time, update_time):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time or _now()
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        if self._data is None:
+            return None
+        value = _get_path(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestore", path: str):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, name: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None) -> FakeDocumentSnapshot:
+        self._client._call("doc_get")
+        return self._client._snapshot(self.path, field_paths)
+
+    def set(self, document_data: Dict[str, Any], merge: bool = False):
+        self._client._call("doc_set")
+        self._client._commit([("set", self.path, document_data, {"merge": merge})])
+
+    def create(self, document_data: Dict[str, Any]):
+        self._client._call("doc_create")
+        self._client._commit([("create", self.path, document_data, {})])
+
+    def update(self, field_updates: Dict[str, Any], option=None):
+        self._client._call("doc_update")
+        self._client._commit([("update", self.path, field_updates, {"option": option})])
+
+    def delete(self, option=None):
+        self._client._call("doc_delete")
+        self._client._commit([("delete", self.path, None, {"option": option})])
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeFirestore", collection_path: str, filters=(), orders=(),
+                 limit=None, projection=None, start_after=None, start_at=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._projection = projection
+        self._start_after = start_after
+        self._start_at = start_at
+
+    def _copy(self, **kwargs) -> "FakeQuery":
+        params = dict(
+            filters=self._filters, orders=self._orders, limit=self._limit,
+            projection=self._projection, start_after=self._start_after, start_at=self._start_at,
+        )
+        params.update(kwargs)
+        return FakeQuery(self._client, self._collection_path, **params)
+
+    def where(self, field_path: str = None, op_string: str = None, value=None, filter=None) -> "FakeQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit=count)
+
+    def select(self, field_paths: Iterable[str]) -> "FakeQuery":
+        return self._copy(projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot) -> "FakeQuery":
+        return self._copy(start_after=document_fields_or_snapshot, start_at=None)
+
+    def start_at(self, document_fields_or_snapshot) -> "FakeQuery":
+        return self._copy(start_at=document_fields_or_snapshot, start_after=None)
+
+    @staticmethod
+    def _match(data: Dict[str, Any], field_path: str, op: str, value) -> bool:
+        current = _get_path(data, field_path)
+        if op == "!=" or op == "not-in":
+            if current is _MISSING or current is None:
+                return False
+            return current != value if op == "!=" else current not in value
+        if current is _MISSING:
+            return False
+        if op == "==":
+            return current == value
+        if op == "in":
+            return current in value
+        if op == "array_contains":
+            return isinstance(current, list) and value in current
+        if op == "array_contains_any":
+            return isinstance(current, list) and any(v in current for v in value)
+        if _sort_key(current)[0] != _sort_key(value)[0]:
+            return False
+        if op == "<":
+            return _sort_key(current) < _sort_key(value)
+        if op == "<=":
+            return _sort_key(current) <= _sort_key(value)
+        if op == ">":
+            return _sort_key(current) > _sort_key(value)
+        if op == ">=":
+            return _sort_key(current) >= _sort_key(value)
+        raise ValueError(f"operador no soportado por el fake: {op}")
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        # Firestore ordena implícitamente por los campos con desigualdad
+        for field_path, op, _ in self._filters:
+            if op in ("<", "<=", ">", ">=", "!=", "not-in") and field_path not in [o[0] for o in orders]:
+                orders.append((field_path, "ASCENDING"))
+        last_dir = orders[-1][1] if orders else "ASCENDING"
+        if "__name__" not in [o[0] for o in orders]:
+            orders.append(("__name__", last_dir))
+        return orders
+
+    def _cursor_values(self, cursor, orders):
+        if isinstance(cursor, (FakeDocumentSnapshot,)) or hasattr(cursor, "reference"):
+            data = cursor._data or {}
+            values = []
+            for field_path, _ in orders:
+                if field_path == "__name__":
+                    values.append(cursor.reference.id)
+                else:
+                    values.append(_get_path(data, field_path))
+            return values
+        return [cursor.get(f, _MISSING) if f != "__name__" else cursor.get("__name__", _MISSING)
+                for f, _ in orders]
+
+    def _run(self) -> List[FakeDocumentSnapshot]:
+        client = self._client
+        orders = self._effective_orders()
+        with client._lock:
+            rows = []
+            for path, doc in client._collection_docs(self._collection_path):
+                if all(self._match(doc.data, f, op, v) for f, op, v in self._filters):
+                    if all(f == "__name__" or _get_path(doc.data, f) is not _MISSING for f, _ in orders):
+                        rows.append((path, doc))
+
+            def key_of(row):
+                path, doc = row
+                return [
+                    _sort_key(path.rsplit("/", 1)[-1] if f == "__name__" else _get_path(doc.data, f))
+                    for f, _ in orders
+                ]
+
+            def compare(a_key, b_key):
+                for (_, direction), a, b in zip(orders, a_key, b_key):
+                    if a != b:
+                        result = -1 if a < b else 1
+                        return -result if direction == "DESCENDING" else result
+                return 0
+
+            # Ordenamientos estables del último campo al primero (cada uno con su dirección)
+            for index in range(len(orders) - 1, -1, -1):
+                field_path, direction = orders[index]
+                if field_path == "__name__":
+                    rows.sort(key=lambda row: _sort_key(row[0].rsplit("/", 1)[-1]), reverse=direction == "DESCENDING")
+                else:
+                    rows.sort(key=lambda row: _sort_key(_get_path(row[1].data, field_path)),
+                              reverse=direction == "DESCENDING")
+
+            cursor = self._start_after if self._start_after is not None else self._start_at
+            if cursor is not None:
+                values = self._cursor_values(cursor, orders)
+                n = len([v for v in values if v is not _MISSING])
+                cursor_key = [_sort_key(v) for v in values[:n]]
+                kept = []
+                for row in rows:
+                    cmp = compare(key_of(row)[:n], cursor_key)
+                    if cmp > 0 or (cmp == 0 and self._start_at is not None):
+                        kept.append(row)
+                rows = kept
+
+            if self._limit is not None:
+                rows = rows[: self._limit]
+
+            snaps = []
+            for path, doc in rows:
+                data = doc.data
+                if self._projection is not None:
+                    projected = {}
+                    for f in self._projection:
+                        value = _get_path(data, f)
+                        if f != "__name__" and value is not _MISSING:
+                            _set_path(projected, f, value)
+                    data = projected
+                snaps.append(FakeDocumentSnapshot(
+                    FakeDocumentReference(client, path), copy.deepcopy(data),
+                    doc.create_time, doc.update_time,
+                ))
+        client._call("query", 1)
+        client.stats.add("query_docs", len(snaps))
+        return snaps
+
+    def stream(self, transaction=None):
+        return iter(self._run())
+
+    def get(self, transaction=None):
+        return self._run()
+
+    def count(self, alias: str = "count"):
+        return _FakeCountQuery(self, alias)
+
+
+class _FakeAggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class _FakeCountQuery:
+    def __init__(self, query: FakeQuery, alias: str):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        n = len(self._query._copy(projection=["__name__"])._run())
+        return [[_FakeAggregationResult(self._alias, n)]]
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: "FakeFirestore", path: str):
+        super().__init__(client, path)
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        document_id = document_id or uuid.uuid4().hex[:20]
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def add(self, document_data: Dict[str, Any]):
+        ref = self.document()
+        ref.set(document_data)
+        return _now(), ref
+
+    def list_documents(self):
+        with self._client._lock:
+            return [FakeDocumentReference(self._client, p) for p, _ in self._client._collection_docs(self.path)]
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference.path, document_data, {"merge": merge}))
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference.path, document_data, {}))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(("update", reference.path, field_updates, {"option": option}))
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference.path, None, {"option": option}))
+
+    def commit(self):
+        self._client._call("batch_commit")
+        self._client.stats.add("batch_writes", len(self._writes))
+        results = self._client._commit(self._writes)
+        self._writes = []
+        return results
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Transacción compatible con firestore.transactional: serializa las
+    transacciones con un lock global y aplica las escrituras al confirmar.
+    """
+
+    def __init__(self, client: "FakeFirestore", max_attempts: int = 5):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id = None
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        if self._id is not None:
+            self._id = None
+            self._client._txn_lock.release()
+
+    def _begin(self, retry_id=None):
+        self._client._txn_lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        try:
+            self._client._call("transaction_commit")
+            return self._client._commit(self._writes)
+        finally:
+            self._clean_up()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, field_paths=None):
+        return self._client.get_all(references, field_paths=field_paths, transaction=self)
+
+
+class FakeFirestore(_Backend):
+    """Cliente Firestore en memoria (subconjunto usado por app.py)."""
+
+    def __init__(self, latency: Optional[FakeLatency] = None, stats: Optional[CallStats] = None):
+        super().__init__(latency, stats)
+        self._docs: Dict[str, _Doc] = {}
+        self._lock = threading.RLock()
+        self._txn_lock = threading.RLock()
+        self._clock = itertools.count(1)
+        # Documentos por colección, se descarta en cada escritura (consultas repetidas sin recorrer todo)
+        self._collection_cache: Dict[str, List[tuple]] = {}
+
+    # --- API pública ---------------------------------------------------------
+    def collection(self, path: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, path)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts=max_attempts)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return _write_option(**kwargs)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._call("get_all")
+        self.stats.add("get_all_docs", len(references))
+        for ref in references:
+            yield self._snapshot(ref.path, field_paths)
+
+    # --- Utilidades para benchmarks -----------------------------------------
+    def seed(self, path: str, data: Dict[str, Any]):
+        """Inserta un documento sin contar llamadas ni aplicar latencia."""
+        with self._lock:
+            ts = self._tick()
+            self._docs[path] = _Doc(copy.deepcopy(data), ts, ts)
+            self._collection_cache.clear()
+
+    def count_documents(self, collection_path: str) -> int:
+        with self._lock:
+            return sum(1 for _ in self._collection_docs(collection_path))
+
+    # --- Internos -----------------------------------------------------------
+    def _tick(self) -> DatetimeWithNanoseconds:
+        next(self._clock)
+        return _now()
+
+    def _collection_docs(self, collection_path: str):
+        with self._lock:
+            rows = self._collection_cache.get(collection_path)
+            if rows is None:
+                depth = collection_path.count("/") + 1
+                prefix = collection_path + "/"
+                rows = [
+                    (path, doc) for path, doc in self._docs.items()
+                    if path.startswith(prefix) and path.count("/") == depth
+                ]
+                self._collection_cache[collection_path] = rows
+        return iter(rows)
+
+    def _snapshot(self, path: str, field_paths=None) -> FakeDocumentSnapshot:
+        with self._lock:
+            doc = self._docs.get(path)
+            ref = FakeDocumentReference(self, path)
+            if doc is None:
+                return FakeDocumentSnapshot(ref, None)
+            data = copy.deepcopy(doc.data)
+            if field_paths is not None:
+                projected = {}
+                for f in field_paths:
+                    value = _get_path(data, f)
+                    if value is not _MISSING:
+                        _set_path(projected, f, value)
+                data = projected
+            return FakeDocumentSnapshot(ref, data, doc.create_time, doc.update_time)
+
+    def _check_option(self, path: str, option):
+        if option is None:
+            return
+        doc = self._docs.get(path)
+        last_update_time = getattr(option, "_last_update_time", None)
+        if last_update_time is not None:
+            if doc is None or doc.update_time != last_update_time:
+                raise gexc.FailedPrecondition(f"precondición fallida: {path}")
+        exists = getattr(option, "_exists", None)
+        if exists is not None and (doc is not None) != exists:
+            raise gexc.FailedPrecondition(f"precondición fallida: {path}")
+
+    def _commit(self, writes) -> List[Any]:
+        with self._lock:
+            # Validar todo antes de aplicar: los commits son atómicos
+            staged = {}
+            for op, path, data, opts in writes:
+                current = staged.get(path, self._docs.get(path))
+                if op == "create" and current is not None:
+                    raise gexc.AlreadyExists(f"el documento ya existe: {path}")
+                if op == "update" and current is None:
+                    raise gexc.NotFound(f"no existe el documento: {path}")
+                if opts.get("option") is not None:
+                    self._check_option(path, opts["option"])
+                ts = self._tick()
+                if op == "delete":
+                    staged[path] = None
+                    continue
+                if op == "update":
+                    new_data = copy.deepcopy(current.data)
+                    for field_path, value in data.items():
+                        if value is fs_transforms.DELETE_FIELD:
+                            _delete_path(new_data, field_path)
+                        else:
+                            _set_path(new_data, field_path, _apply_value(_get_path(new_data, field_path), value))
+                    staged[path] = _Doc(new_data, current.create_time, ts)
+                elif op == "set" and opts.get("merge") and current is not None:
+                    new_data = copy.deepcopy(current.data)
+                    _merge_into(new_data, data)
+                    staged[path] = _Doc(new_data, current.create_time, ts)
+                else:
+                    new_data = {}
+                    _merge_into(new_data, data)
+                    staged[path] = _Doc(new_data, ts if current is None else current.create_time, ts)
+            results = []
+            self._collection_cache.clear()
+            for path, doc in staged.items():
+                if doc is None:
+                    self._docs.pop(path, None)
+                else:
+                    self._docs[path] = doc
+                    results.append(doc.update_time)
+            return results
+
+
+def _write_option(**kwargs):
+    if "last_update_time" in kwargs:
+        return fs_helpers.LastUpdateOption(kwargs["last_update_time"])
+    if "exists" in kwargs:
+        return fs_helpers.ExistsOption(kwargs["exists"])
+    raise TypeError("write_option necesita last_update_time o exists")
+
+
+# -----------------------------------------------------------------------------
+# Cloud Storage
+# -----------------------------------------------------------------------------
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.cache_control = None
+        self.metadata = None
+        self.chunk_size = None
+        self.size = None
+        self.md5_hash = None
+        self.updated = None
+
+    def _client(self) -> "FakeStorage":
+        return self.bucket.client
+
+    def _store(self, data: bytes, content_type: Optional[str]):
+        client = self._client()
+        with client._lock:
+            client._objects[(self.bucket.name, self.name)] = {
+                "data": bytes(data),
+                "content_type": content_type or self.content_type,
+                "cache_control": self.cache_control,
+                "metadata": dict(self.metadata or {}),
+                "updated": _now(),
+            }
+        self.size = len(data)
+        client.stats.add("bytes_uploaded", len(data))
+
+    def upload_from_string(self, data, content_type: str = "application/octet-stream", **kwargs):
+        self._client()._call("blob_upload")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._store(data, content_type)
+
+    def upload_from_file(self, file_obj, content_type: Optional[str] = None, size: Optional[int] = None, **kwargs):
+        self._client()._call("blob_upload")
+        chunk = self.chunk_size or (1024 * 1024)
+        parts = []
+        while True:
+            data = file_obj.read(chunk)
+            if not data:
+                break
+            parts.append(data)
+        self._store(b"".join(parts), content_type)
+
+    def upload_from_filename(self, filename: str, content_type: Optional[str] = None, **kwargs):
+        with open(filename, "rb") as fh:
+            self.upload_from_file(fh, content_type=content_type)
+
+    def _object(self):
+        client = self._client()
+        with client._lock:
+            obj = client._objects.get((self.bucket.name, self.name))
+        if obj is None:
+            raise gexc.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        return obj
+
+    def download_as_bytes(self, start: Optional[int] = None, end: Optional[int] = None, **kwargs) -> bytes:
+        self._client()._call("blob_download")
+        data = self._object()["data"]
+        if start is not None or end is not None:
+            data = data[start or 0: (end + 1) if end is not None else None]
+        self._client().stats.add("bytes_downloaded", len(data))
+        return data
+
+    def open(self, mode: str = "rb", **kwargs):
+        import io
+        return io.BytesIO(self.download_as_bytes())
+
+    def exists(self, **kwargs) -> bool:
+        self._client()._call("blob_exists")
+        try:
+            self._object()
+            return True
+        except gexc.NotFound:
+            return False
+
+    def reload(self, **kwargs):
+        self._client()._call("blob_reload")
+        obj = self._object()
+        self.size = len(obj["data"])
+        self.content_type = obj["content_type"]
+        self.cache_control = obj["cache_control"]
+        self.metadata = dict(obj["metadata"]) or None
+        self.updated = obj["updated"]
+
+    def patch(self, **kwargs):
+        self._client()._call("blob_patch")
+        obj = self._object()
+        obj["cache_control"] = self.cache_control
+        if self.metadata is not None:
+            obj["metadata"] = dict(self.metadata)
+        if self.content_type:
+            obj["content_type"] = self.content_type
+
+    def delete(self, **kwargs):
+        self._client()._call("blob_delete")
+        client = self._client()
+        with client._lock:
+            if client._objects.pop((self.bucket.name, self.name), None) is None:
+                raise gexc.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def generate_signed_url(self, expiration=None, method: str = "GET", version: str = "v4", **kwargs) -> str:
+        self._client()._call("sign_url")
+        return f"https://storage.fake/{self.bucket.name}/{self.name}?X-Goog-Method={method}&X-Goog-Signature=fake"
+
+    def create_resumable_upload_session(self, content_type=None, size=None, **kwargs) -> str:
+        self._client()._call("resumable_session")
+        return f"https://storage.fake/upload/{self.bucket.name}/{self.name}?upload_id={uuid.uuid4().hex}"
+
+
+class FakeBucket:
+    def __init__(self, client: "FakeStorage", name: str):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name: str, chunk_size: Optional[int] = None) -> FakeBlob:
+        blob = FakeBlob(self, blob_name)
+        blob.chunk_size = chunk_size
+        return blob
+
+    def get_blob(self, blob_name: str, **kwargs) -> Optional[FakeBlob]:
+        blob = FakeBlob(self, blob_name)
+        try:
+            blob.reload()
+        except gexc.NotFound:
+            return None
+        return blob
+
+
+class FakeStorage(_Backend):
+    """Cliente Cloud Storage en memoria."""
+
+    def __init__(self, latency: Optional[FakeLatency] = None, stats: Optional[CallStats] = None):
+        super().__init__(latency, stats)
+        self._objects: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, bucket_name: str) -> FakeBucket:
+        return FakeBucket(self, bucket_name)
+
+    def seed(self, bucket_name: str, blob_name: str, data: bytes, content_type: str = "application/pdf"):
+        with self._lock:
+            self._objects[(bucket_name, blob_name)] = {
+                "data": bytes(data), "content_type": content_type,
+                "cache_control": None, "metadata": {}, "updated": _now(),
+            }
+
+
+# -----------------------------------------------------------------------------
+# Firebase Auth
+# -----------------------------------------------------------------------------
+class _FakeUserMetadata:
+    def __init__(self, creation_timestamp: int):
+        self.creation_timestamp = creation_timestamp
+
+
+class FakeUserRecord:
+    def __init__(self, uid: str, email: Optional[str], display_name: Optional[str] = None,
+                 custom_claims: Optional[Dict[str, Any]] = None, creation_timestamp: int = 0):
+        self.uid = uid
+        self.email = email
+        self.display_name = display_name
+        self.custom_claims = custom_claims
+        self.user_metadata = _FakeUserMetadata(creation_timestamp)
+
+
+class _FakeGetUsersResult:
+    def __init__(self, users, not_found):
+        self.users = users
+        self.not_found = not_found
+
+
+class _FakeUsersPage:
+    def __init__(self, auth: "FakeAuth", users, next_page_token: str):
+        self._auth = auth
+        self.users = users
+        self.next_page_token = next_page_token
+
+    @property
+    def has_next_page(self) -> bool:
+        return bool(self.next_page_token)
+
+    def get_next_page(self):
+        if not self.has_next_page:
+            return None
+        return self._auth.list_users(page_token=self.next_page_token, max_results=len(self.users) or 1000)
+
+    def iterate_all(self):
+        page = self
+        while page:
+            for user in page.users:
+                yield user
+            page = page.get_next_page()
+
+
+class FakeAuth(_Backend):
+    """
+    Firebase Auth en memoria. Los tokens válidos tienen la forma
+    "fake:<uid>" y el rol se toma de los custom claims del usuario.
+    """
+
+    UidIdentifier = fb_identifiers.UidIdentifier
+
+    class UserNotFoundError(Exception):
+        pass
+
+    class RevokedIdTokenError(Exception):
+        pass
+
+    def __init__(self, latency: Optional[FakeLatency] = None, stats: Optional[CallStats] = None,
+                 token_ttl: int = 3600):
+        super().__init__(latency, stats)
+        self._users: Dict[str, FakeUserRecord] = {}
+        self._lock = threading.Lock()
+        self._revoked: Dict[str, float] = {}
+        self.token_ttl = token_ttl
+
+    def add_user(self, uid: str, email: Optional[str] = None, role: Optional[str] = None,
+                 display_name: Optional[str] = None) -> FakeUserRecord:
+        user = FakeUserRecord(uid, email or f"{uid}@example.com", display_name,
+                              {"role": role} if role else None, int(time.time() * 1000))
+        with self._lock:
+            self._users[uid] = user
+        return user
+
+    @staticmethod
+    def token_for(uid: str) -> str:
+        return f"fake:{uid}"
+
+    def verify_id_token(self, id_token: str, app=None, check_revoked: bool = False, clock_skew_seconds: int = 0):
+        self._call("verify_id_token")
+        if not id_token.startswith("fake:"):
+            raise ValueError("token inválido")
+        uid = id_token.split(":", 1)[1]
+        with self._lock:
+            user = self._users.get(uid)
+        if user is None:
+            raise ValueError("usuario inexistente")
+        if check_revoked and uid in self._revoked:
+            raise self.RevokedIdTokenError("token revocado")
+        now = int(time.time())
+        decoded = {"uid": uid, "sub": uid, "iat": now, "exp": now + self.token_ttl}
+        decoded.update(user.custom_claims or {})
+        return decoded
+
+    def revoke_refresh_tokens(self, uid: str, app=None):
+        self._revoked[uid] = time.time()
+
+    def get_user(self, uid: str, app=None) -> FakeUserRecord:
+        self._call("get_user")
+        with self._lock:
+            user = self._users.get(uid)
+        if user is None:
+            raise self.UserNotFoundError(uid)
+        return user
+
+    def get_users(self, identifiers, app=None) -> _FakeGetUsersResult:
+        identifiers = list(identifiers)
+        if len(identifiers) > 100:
+            raise ValueError("get_users acepta como máximo 100 identificadores")
+        self._call("get_users")
+        users, not_found = [], []
+        with self._lock:
+            for ident in identifiers:
+                user = self._users.get(getattr(ident, "uid", ident))
+                (users.append(user) if user else not_found.append(ident))
+        return _FakeGetUsersResult(users, not_found)
+
+    def list_users(self, page_token: Optional[str] = None, max_results: int = 1000, app=None) -> _FakeUsersPage:
+        self._call("list_users")
+        with self._lock:
+            uids = sorted(self._users)
+        start = int(page_token) if page_token else 0
+        chunk = [self._users[u] for u in uids[start:start + max_results]]
+        next_token = str(start + max_results) if start + max_results < len(uids) else ""
+        return _FakeUsersPage(self, chunk, next_token)
+
+    def set_custom_user_claims(self, uid: str, custom_claims, app=None):
+        self._call("set_custom_user_claims")
+        with self._lock:
+            user = self._users.get(uid)
+            if user is None:
+                raise self.UserNotFoundError(uid)
+            user.custom_claims = custom_claims
+
+
+# -----------------------------------------------------------------------------
+# Gemini
+# -----------------------------------------------------------------------------
+class _FakeGeminiResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.candidates = []
+
+
+class FakeGeminiModel(_Backend):
+    """
+    Modelo Gemini local: devuelve el JSON del esquema de extracción usando
+    expresiones simples sobre el texto del prompt. `fail_every` permite
+    simular errores transitorios (cada N llamadas lanza `error_cls`) y
+    fail_next(...) encola errores para las próximas llamadas.
+    """
+
+    def __init__(self, latency: Optional[FakeLatency] = None, stats: Optional[CallStats] = None,
+                 fail_every: int = 0, error_cls=gexc.ServiceUnavailable):
+        super().__init__(latency, stats)
+        self.fail_every = fail_every
+        self.error_cls = error_cls
+        self._calls = itertools.count(1)
+        self._scripted: List[Optional[BaseException]] = []
+        self._scripted_lock = threading.Lock()
+        self.request_options: List[Optional[Dict[str, Any]]] = []
+
+    def fail_next(self, *errors: Optional[BaseException]):
+        """Las próximas llamadas lanzan estos errores en orden (None = responde normal)."""
+        with self._scripted_lock:
+            self._scripted.extend(errors)
+
+    @staticmethod
+    def _extract(text: str) -> Dict[str, Any]:
+        ruc = re.search(r"\b(10|15|17|20)\d{9}\b", text)
+        numero = re.search(r"\b([EF][A-Z0-9]{3})\s*-\s*(\d{1,8})\b", text)
+        total = re.search(r"TOTAL[^0-9]{0,20}([\d,]+\.\d{2})", text, re.IGNORECASE)
+        fechas = re.findall(r"\b(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})\b", text)
+
+        def iso(value):
+            if value and "/" in value:
+                d, m, y = value.split("/")
+                return f"{y}-{m}-{d}"
+            return value
+
+        return {
+            "es_factura": bool(ruc and numero),
+            "resumen": None,
+            "monto_total": total.group(1).replace(",", "") if total else None,
+            "moneda": "USD" if re.search(r"\bUSD\b|D[OÓ]LARES", text, re.IGNORECASE) else "PEN",
+            "ruc_emisor": ruc.group(0) if ruc else None,
+            "razon_social_emisor": None,
+            "fecha_emision": iso(fechas[0]) if fechas else None,
+            "fecha_vencimiento": iso(fechas[1]) if len(fechas) > 1 else None,
+            "numero_factura": f"{numero.group(1)}-{numero.group(2)}" if numero else None,
+            "concepto": "Servicios",
+            "confidence": 90 if ruc and numero else 30,
+        }
+
+    def generate_content(self, contents, generation_config=None, request_options=None, **kwargs):
+        self._call("gemini_generate")
+        prompt = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+        self.stats.add("gemini_prompt_chars", len(prompt))
+        self.request_options.append(request_options)
+        with self._scripted_lock:
+            error = self._scripted.pop(0) if self._scripted else None
+        if error is not None:
+            raise error
+        if self.fail_every and next(self._calls) % self.fail_every == 0:
+            raise self.error_cls("fallo simulado")
+        # Modo por lotes: bloques delimitados por <<<FACTURA id>>> ... <<<FIN id>>>
+        blocks = re.findall(r"<<<FACTURA (\S+)>>>\n(.*?)\n<<<FIN \1>>>", prompt, re.DOTALL)
+        if blocks:
+            payload = [{"invoiceId": inv_id, **self._extract(text)} for inv_id, text in blocks]
+        else:
+            # Solo el texto del documento (las instrucciones mencionan PEN/USD)
+            document = prompt.split("Texto del documento:", 1)[-1].split("Devuelve SOLO", 1)[0]
+            payload = self._extract(document)
+        return _FakeGeminiResponse("```json\n" + json.dumps(payload, ensure_ascii=False) + "\n```")
+
+    def count_tokens(self, contents, **kwargs):
+        class _Count:
+            total_tokens = len(str(contents)) // 4
+        return _Count()
+
+
+# -----------------------------------------------------------------------------
+# PDFs sintéticos
+# -----------------------------------------------------------------------------
+def make_invoice_pdf(ruc: str = "20100047218", numero: str = "F001-00000123", total: str = "1500.00",
+                     emision: str = "2025-11-01", vencimiento: str = "2025-12-01", pages: int = 1) -> bytes:
+    """
+    Genera un PDF mínimo y válido con texto de una factura SUNAT. No necesita
+    dependencias externas: escribe los objetos PDF a mano.
+    """
+    lines = [
+        "FACTURA ELECTRONICA",
+        f"RUC: {ruc}",
+        "EMPRESA DE PRUEBA S.A.C.",
+        f"{numero}",
+        f"Fecha de Emision: {emision}",
+        f"Fecha de Vencimiento: {vencimiento}",
+        "Moneda: SOLES",
+        "Descripcion: Servicios de consultoria",
+        f"IMPORTE TOTAL: S/ {total}",
+    ]
+    objects = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    page_objs = []
+    for p in range(pages):
+        text_ops = ["BT", "/F1 11 Tf", "14 TL", "50 780 Td"]
+        for line in lines if p == 0 else [f"Pagina {p + 1}"] + lines[3:]:
+            safe = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            text_ops.append(f"({safe}) Tj T*")
+        text_ops.append("ET")
+        stream = "\n".join(text_ops).encode("latin-1")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_objs.append((content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"))
+        page_objs.append((page_id, (
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()))
+        page_ids.append(page_id)
+    objects.append((1, b"<< /Type /Catalog /Pages 2 0 R >>"))
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects.append((2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()))
+    objects.append((3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    objects.extend(page_objs)
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for obj_id, _ in objects:
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+# -----------------------------------------------------------------------------
+# Conjunto de backends
+# -----------------------------------------------------------------------------
+def make_backends(latency: Optional[FakeLatency] = None, stats: Optional[CallStats] = None) -> Dict[str, Any]:
+    """
+    Crea los cuatro fakes compartiendo latencia y contador, listos para
+    app.configure_backends(**make_backends()).
+    """
+    latency = latency or FakeLatency()
+    stats = stats or CallStats()
+    return {
+        "firestore_client": FakeFirestore(latency, stats),
+        "storage_client": FakeStorage(latency, stats),
+        "auth": FakeAuth(latency, stats),
+        "gemini_model": FakeGeminiModel(latency, stats),
+    }
@@ -0,0 +1,294 @@
+"""
+Cliente de Gemini con límite de tasa, reintentos y circuit breaker.
+
+Todas las llamadas de la app (requests, trabajos de la cola, lotes con
+varios hilos) pasan por una sola instancia de GeminiClient:
+
+    gemini_api = GeminiClient(GEMINI_MODEL, rpm=15, tpm=250_000)
+    response = gemini_api.generate(prompt)
+
+- RateLimiter: token bucket compartido entre hilos, por requests/min y por
+  tokens/min (estimados). Es adaptativo: cada 429 baja la tasa a la mitad y
+  cada éxito la recupera de a poco hasta el máximo configurado.
+- Reintentos con backoff exponencial y jitter completo solo para errores
+  transitorios (429, 500, 503, 504, timeouts de red).
+- Deadline por llamada: la espera en el limitador, los intentos y los
+  backoffs comparten el mismo presupuesto; cada intento recibe como timeout
+  lo que queda.
+- CircuitBreaker: tras N fallos transitorios seguidos se abre y rechaza al
+  instante (GeminiUnavailable) durante `reset_seconds`; luego deja pasar una
+  llamada de prueba.
+
+`model` es cualquier objeto con generate_content(prompt, request_options=...)
+(el GenerativeModel del SDK o FakeGeminiModel de fakes.py, que simula
+fallos con fail_every). `sleep`, `clock` y `rng` se pueden inyectar para
+probar sin esperas reales.
+"""
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+
+class GeminiError(Exception):
+    """La llamada a Gemini falló (tras los reintentos si el error era transitorio)."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class GeminiUnavailable(GeminiError):
+    """No se llamó a Gemini: circuito abierto o deadline agotado esperando turno."""
+
+    def __init__(self, message: str):
+        super().__init__(message, retryable=True)
+
+
+# Nombres de google.api_core.exceptions (y afines) que vale la pena reintentar
+RETRYABLE_ERRORS = {
+    "TooManyRequests", "ResourceExhausted",                      # 429
+    "InternalServerError", "ServiceUnavailable", "BadGateway",   # 5xx
+    "DeadlineExceeded", "GatewayTimeout", "RetryError",
+    "TimeoutError", "ConnectionError", "ReadTimeout", "ConnectTimeout",
+}
+RATE_LIMIT_ERRORS = {"TooManyRequests", "ResourceExhausted"}
+
+
+def _error_names(error: BaseException) -> set:
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def is_retryable(error: BaseException) -> bool:
+    return bool(_error_names(error) & RETRYABLE_ERRORS)
+
+
+def is_rate_limit(error: BaseException) -> bool:
+    return bool(_error_names(error) & RATE_LIMIT_ERRORS)
+
+
+class RateLimiter:
+    """
+    Dos token buckets (requests/min y tokens/min) con la misma tasa relativa.
+    `scale` (0-1] es la fracción de la tasa configurada que se usa ahora.
+    """
+
+    def __init__(self, rpm: float, tpm: float, clock: Callable[[], float] = time.monotonic,
+                 min_scale: float = 0.1, recovery: float = 0.05):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_scale = min_scale
+        self.recovery = recovery
+        self.scale = 1.0
+        self._clock = clock
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = clock()
+        self._cond = threading.Condition()
+        self.throttled = 0
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm * self.scale / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm * self.scale / 60)
+
+    def _wait_needed(self, tokens: float) -> float:
+        """Segundos hasta que haya 1 request y `tokens` disponibles (0 si ya hay)."""
+        tokens = min(tokens, self.tpm)
+        missing_requests = max(0.0, 1 - self._requests)
+        missing_tokens = max(0.0, tokens - self._tokens)
+        return max(
+            missing_requests * 60 / (self.rpm * self.scale),
+            missing_tokens * 60 / (self.tpm * self.scale),
+        )
+
+    def acquire(self, tokens: float, deadline: float, sleep: Callable[[float], None] = None) -> float:
+        """
+        Reserva una request y `tokens`. Bloquea hasta tenerlos; si no alcanzan
+        antes de `deadline` (valor de clock) lanza GeminiUnavailable.
+        Devuelve los segundos esperados.
+        """
+        started = self._clock()
+        with self._cond:
+            while True:
+                self._refill()
+                wait = self._wait_needed(tokens)
+                if wait <= 1e-6:  # tolerancia a redondeos del refill
+                    self._requests -= 1
+                    self._tokens -= min(tokens, self.tpm)
+                    return self._clock() - started
+                if self._clock() + wait > deadline:
+                    self.throttled += 1
+                    raise GeminiUnavailable("límite de tasa de Gemini: no hay cupo antes del deadline")
+                if sleep is None:
+                    self._cond.wait(wait)
+                else:
+                    # Reloj inyectado (pruebas): esperar sin bloquear a otros hilos de verdad
+                    self._cond.release()
+                    try:
+                        sleep(wait)
+                    finally:
+                        self._cond.acquire()
+
+    def penalize(self):
+        """Recibimos un 429: bajar la tasa a la mitad (hasta min_scale)."""
+        with self._cond:
+            self._refill()
+            self.scale = max(self.min_scale, self.scale / 2)
+
+    def reward(self):
+        """Llamada exitosa: recuperar la tasa de a poco."""
+        with self._cond:
+            if self.scale < 1.0:
+                self._refill()
+                self.scale = min(1.0, self.scale + self.recovery)
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {"scale": round(self.scale, 3), "throttled": self.throttled}
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int, reset_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                # Una sola llamada de prueba; el resto sigue fallando rápido
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.opened_count += 1
+                    print(f"🔌 Circuito de Gemini abierto por {self.reset_seconds}s ({self.failures} fallos seguidos)")
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opened": self.opened_count}
+
+
+class GeminiClient:
+    def __init__(self, model: Any, rpm: float = 15, tpm: float = 250_000, timeout: float = 30.0,
+                 deadline: float = 90.0, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 20.0,
+                 breaker_threshold: int = 5, breaker_reset_seconds: float = 30.0, output_tokens: int = 512,
+                 sleep: Optional[Callable[[float], None]] = None, clock: Callable[[], float] = time.monotonic,
+                 rng: Optional[random.Random] = None):
+        self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.output_tokens = output_tokens
+        self._sleep = sleep
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self.limiter = RateLimiter(rpm, tpm, clock=clock)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_seconds, clock=clock)
+
+    def estimate_tokens(self, prompt: str, output_tokens: Optional[int] = None) -> int:
+        """~4 caracteres por token más la salida esperada (sin llamar a count_tokens)."""
+        return len(prompt) // 4 + (self.output_tokens if output_tokens is None else output_tokens)
+
+    def _backoff(self, attempt: int) -> float:
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _pause(self, seconds: float):
+        (self._sleep or time.sleep)(seconds)
+
+    def generate(self, prompt: str, deadline: Optional[float] = None, output_tokens: Optional[int] = None,
+                 generation_config: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Llama a model.generate_content(prompt) respetando límite de tasa,
+        reintentos, deadline (segundos, default self.deadline) y circuito.
+        `output_tokens` ajusta la estimación de la salida (prompts por lotes).
+        Lanza GeminiUnavailable si no se pudo intentar y GeminiError si falló.
+        """
+        if not self.breaker.allow():
+            metrics.gemini_calls.inc(outcome="rejected")
+            raise GeminiUnavailable("Gemini no disponible temporalmente (circuito abierto)")
+
+        ends_at = self._clock() + (deadline if deadline is not None else self.deadline)
+        tokens = self.estimate_tokens(prompt, output_tokens)
+        extra = {"generation_config": generation_config} if generation_config else {}
+        attempt = 0
+        while True:
+            try:
+                waited = self.limiter.acquire(tokens, ends_at, sleep=self._sleep)
+            except GeminiUnavailable:
+                metrics.gemini_calls.inc(outcome="throttled")
+                if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                    # La llamada de prueba no llegó a salir: reabrir para liberar el turno
+                    self.breaker.record_failure()
+                raise
+            metrics.gemini_limiter_wait.observe(waited)
+
+            remaining = ends_at - self._clock()
+            try:
+                with metrics.stage("gemini"):
+                    response = self.model.generate_content(
+                        prompt, request_options={"timeout": max(1.0, min(self.timeout, remaining))}, **extra
+                    )
+            except Exception as e:
+                retryable = is_retryable(e)
+                if is_rate_limit(e):
+                    self.limiter.penalize()
+                if not retryable:
+                    # Error del request (prompt inválido, API key, ...): Gemini respondió, el circuito sigue cerrado
+                    self.breaker.record_success()
+                    metrics.gemini_calls.inc(outcome="error")
+                    raise GeminiError(f"{type(e).__name__}: {e}", retryable=False) from e
+                self.breaker.record_failure()
+                delay = self._backoff(attempt)
+                attempt += 1
+                if attempt > self.max_retries or self.breaker.state == CircuitBreaker.OPEN \
+                        or self._clock() + delay >= ends_at:
+                    metrics.gemini_calls.inc(outcome="error")
+                    raise GeminiError(f"{type(e).__name__}: {e}", retryable=True) from e
+                metrics.gemini_calls.inc(outcome="retry")
+                print(f"🔁 Gemini {type(e).__name__}, reintento {attempt}/{self.max_retries} en {delay:.1f}s")
+                self._pause(delay)
+                continue
+
+            self.breaker.record_success()
+            self.limiter.reward()
+            metrics.gemini_calls.inc(outcome="ok")
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.limiter.stats(), "circuit": self.breaker.stats()}
@@ -0,0 +1,371 @@
+"""
+Cola de trabajos en segundo plano para el backend.
+
+Los endpoints encolan trabajos (ej. procesar una factura con IA) y responden
+202 de inmediato; un pool de hilos los ejecuta y registra su estado:
+queued -> running -> done | failed, con tiempos de espera y de ejecución.
+
+El backend de la cola es intercambiable (JobQueue). Se incluyen:
+  - InMemoryJobQueue: dentro del proceso, sin dependencias.
+  - SQLiteJobQueue: persistente en un archivo; sobrevive reinicios del worker
+    y puede compartirse entre procesos de gunicorn de la misma instancia.
+Para Cloud Tasks/PubSub basta con implementar la misma interfaz.
+"""
+import abc
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+
+class JobError(Exception):
+    """Error controlado de un trabajo: se guarda `detail` como resultado del fallo."""
+
+    def __init__(self, message: str, detail: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.detail = detail or {}
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _elapsed_ms(start_iso: Optional[str], end_iso: Optional[str]) -> Optional[int]:
+    if not start_iso or not end_iso:
+        return None
+    start = datetime.fromisoformat(start_iso)
+    end = datetime.fromisoformat(end_iso)
+    return round((end - start).total_seconds() * 1000)
+
+
+def new_job(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "jobId": f"job_{uuid.uuid4().hex[:16]}",
+        "kind": kind,
+        "payload": payload,
+        "status": JOB_QUEUED,
+        "attempts": 0,
+        "createdAt": _now_iso(),
+        "startedAt": None,
+        "finishedAt": None,
+        "result": None,
+        "error": None,
+    }
+
+
+def with_timings(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Agrega queuedMs/runMs calculados a partir de las marcas de tiempo."""
+    job = dict(job)
+    job["queuedMs"] = _elapsed_ms(job.get("createdAt"), job.get("startedAt"))
+    job["runMs"] = _elapsed_ms(job.get("startedAt"), job.get("finishedAt"))
+    return job
+
+
+class JobQueue(abc.ABC):
+    """Interfaz de los backends de la cola (instanciar uno incompleto falla con TypeError)."""
+
+    @abc.abstractmethod
+    def enqueue(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Agrega un trabajo creado con new_job()."""
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """El trabajo con ese id, o None si esta cola no lo conoce."""
+
+    @abc.abstractmethod
+    def claim(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Toma el trabajo más antiguo en cola y lo marca como running (o None tras `timeout`)."""
+
+    @abc.abstractmethod
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Marca el trabajo como done/failed con su resultado o error."""
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Cantidad de trabajos por estado."""
+
+
+class InMemoryJobQueue(JobQueue):
+    """Cola en memoria del proceso. Conserva hasta `max_finished` trabajos terminados."""
+
+    def __init__(self, max_finished: int = 10000):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._pending = deque()
+        self._finished = deque()
+        self._max_finished = max_finished
+        self._cond = threading.Condition()
+
+    def enqueue(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        job = dict(job)
+        with self._cond:
+            self._jobs[job["jobId"]] = job
+            self._pending.append(job["jobId"])
+            self._cond.notify()
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def claim(self, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            job = self._jobs[self._pending.popleft()]
+            job["status"] = JOB_RUNNING
+            job["startedAt"] = _now_iso()
+            job["attempts"] += 1
+            return dict(job)
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(status=status, result=result, error=error, finishedAt=_now_iso())
+            self._finished.append(job_id)
+            while len(self._finished) > self._max_finished:
+                self._jobs.pop(self._finished.popleft(), None)
+            return dict(job)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Cola persistida en SQLite. Los trabajos que quedaron en running más de
+    `stale_after` segundos (ej. el proceso murió) vuelven a la cola al iniciar.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT,
+        result TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+    """
+
+    def __init__(self, path: str, stale_after: float = 600.0, retention_seconds: float = 7 * 24 * 3600,
+                 poll_interval: float = 0.5):
+        self._path = path
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._poll_interval = poll_interval
+        self._retention_seconds = retention_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self._SCHEMA)
+        self._requeue_stale(stale_after)
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "jobId": row["job_id"],
+            "kind": row["kind"],
+            "payload": json.loads(row["payload"]),
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "createdAt": row["created_at"],
+            "startedAt": row["started_at"],
+            "finishedAt": row["finished_at"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+
+    def _requeue_stale(self, stale_after: float):
+        cutoff = datetime.fromtimestamp(time.time() - stale_after, timezone.utc).isoformat()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND started_at < ?",
+                (JOB_QUEUED, JOB_RUNNING, cutoff),
+            )
+
+    def enqueue(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, payload, status, attempts, created_at) VALUES (?, ?, ?, ?, 0, ?)",
+                (job["jobId"], job["kind"], json.dumps(job["payload"]), JOB_QUEUED, job["createdAt"]),
+            )
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _claim_once(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            # BEGIN IMMEDIATE toma el lock de escritura: dos procesos no reclaman el mismo trabajo
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE job_id = ?",
+                    (JOB_RUNNING, _now_iso(), row["job_id"]),
+                )
+                claimed = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row["job_id"],)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(claimed)
+
+    def claim(self, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._claim_once()
+            if job is not None:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Los enqueue locales despiertan al worker; el polling cubre otros procesos
+            self._wakeup.wait(min(remaining, self._poll_interval))
+            self._wakeup.clear()
+
+    def finish(self, job_id, status, result=None, error=None):
+        cutoff = datetime.fromtimestamp(time.time() - self._retention_seconds, timezone.utc).isoformat()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, error, _now_iso(), job_id),
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (*FINISHED_STATES, cutoff)
+            )
+        return self.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        with self._lock:
+            for row in self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+                counts[row["status"]] = row["n"]
+        return counts
+
+
+def create_queue(backend: str, path: Optional[str] = None) -> JobQueue:
+    """Crea el backend configurado ("memory" o "sqlite")."""
+    if backend == "memory":
+        return InMemoryJobQueue()
+    if backend == "sqlite":
+        return SQLiteJobQueue(path or "/tmp/neo-jobs.sqlite3")
+    raise ValueError(f"JOB_QUEUE_BACKEND desconocido: {backend}")
+
+
+class JobWorkerPool:
+    """
+    Hilos que consumen la cola y ejecutan el handler registrado para cada `kind`.
+    El handler recibe el payload y devuelve un dict con el resultado; si lanza
+    JobError o cualquier excepción el trabajo queda en failed.
+    `on_update(job)` se llama en cada cambio de estado (ej. para reflejarlo en Firestore).
+    """
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]],
+                 workers: int = 4, on_update: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.on_update = on_update
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Arranca los hilos (idempotente). Se llama en el primer enqueue, no al importar."""
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if kind not in self.handlers:
+            raise ValueError(f"tipo de trabajo desconocido: {kind}")
+        self.start()
+        job = new_job(kind, payload)
+        # Registrar "queued" antes de que un worker pueda tomarlo y reportar "running"
+        self._notify(job)
+        return with_timings(self.queue.enqueue(job))
+
+    def _notify(self, job: Dict[str, Any]):
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(with_timings(job))
+        except Exception as e:
+            print(f"⚠️ No se pudo registrar el estado del trabajo {job.get('jobId')}: {e}")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(timeout=1.0)
+            except Exception as e:
+                print(f"❌ Error leyendo la cola de trabajos: {e}")
+                time.sleep(1.0)
+                continue
+            if job is None:
+                continue
+            self._notify(job)
+            self._run(job)
+
+    def _run(self, job: Dict[str, Any]):
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise JobError(f"tipo de trabajo desconocido: {job['kind']}")
+            result = handler(job["payload"])
+            finished = self.queue.finish(job["jobId"], JOB_DONE, result=result)
+        except JobError as e:
+            finished = self.queue.finish(job["jobId"], JOB_FAILED, result=e.detail, error=str(e))
+        except Exception as e:
+            traceback.print_exc()
+            finished = self.queue.finish(job["jobId"], JOB_FAILED, error=str(e))
+        if finished:
+            self._notify(finished)
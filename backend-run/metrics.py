@@ -0,0 +1,216 @@
+"""
+Métricas en memoria del proceso, en formato de texto de Prometheus.
+
+Uso típico en app.py:
+
+    with metrics.stage("gcs_download"):
+        pdf_bytes = blob.download_as_bytes()
+
+stage() mide la duración en el histograma neo_stage_duration_seconds{stage=...},
+cuenta los errores en neo_stage_errors_total{stage=...} y, si hay una request
+de Flask en curso, la agrega al header Server-Timing de esa respuesta.
+
+Las métricas son por proceso: con varios workers de gunicorn cada uno expone
+las suyas (Prometheus las agrega por instancia).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import g, has_request_context
+
+# Límites de los histogramas de duración (segundos)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Límites para tamaños (bytes / caracteres) y páginas
+SIZE_BUCKETS = (1_000, 4_000, 16_000, 64_000, 256_000, 1_000_000, 4_000_000, 16_000_000)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+
+def _labels_key(labelnames: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [(n, v) for n, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{n}="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for n, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        # clave -> [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        # Gauges calculados al exportar: nombre -> (ayuda, función que devuelve {labels: valor})
+        self._gauges: List[Tuple[str, str, Tuple[str, ...], Callable[[], Dict[Tuple[str, ...], float]]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...],
+                  labelnames: Tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(name, help_text, buckets, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(self, name: str, help_text: str, labelnames: Tuple[str, ...],
+                       callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        """Gauge cuyo valor se lee al exportar (ej. estadísticas de una caché)."""
+        self._gauges.append((name, help_text, labelnames, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, labelnames, callback in self._gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                values = callback()
+            except Exception:
+                values = {}
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_duration = registry.histogram(
+    "neo_stage_duration_seconds", "Duración de cada etapa (Firestore, GCS, PDF, Gemini)",
+    DURATION_BUCKETS, ("stage",))
+stage_errors = registry.counter(
+    "neo_stage_errors_total", "Errores por etapa", ("stage",))
+stage_bytes = registry.counter(
+    "neo_stage_bytes_total", "Bytes transferidos por etapa (subidas y descargas de GCS)", ("stage",))
+pdf_pages = registry.histogram(
+    "neo_pdf_pages", "Páginas leídas / totales por PDF procesado", PAGE_BUCKETS, ("kind",))
+gemini_chars = registry.histogram(
+    "neo_gemini_chars", "Tamaño en caracteres de prompts y respuestas de Gemini", SIZE_BUCKETS, ("kind",))
+gemini_calls = registry.counter(
+    "neo_gemini_calls_total", "Llamadas a Gemini por resultado (ok, retry, error, throttled, rejected)", ("outcome",))
+gemini_limiter_wait = registry.histogram(
+    "neo_gemini_limiter_wait_seconds", "Espera en el limitador de tasa antes de cada llamada a Gemini",
+    DURATION_BUCKETS)
+gemini_batch_items = registry.counter(
+    "neo_gemini_batch_items_total", "Facturas enviadas en prompts por lotes (ok, fallback individual, error)", ("outcome",))
+pdf_text_sidecar = registry.counter(
+    "neo_pdf_text_sidecar_total", "Textos de PDF guardados en pdf_texts: hit, miss y stored", ("result",))
+overdue_sweep = registry.counter(
+    "neo_overdue_sweep_total", "Facturas del barrido de vencidas: updated, skipped y failed", ("result",))
+http_duration = registry.histogram(
+    "neo_http_request_duration_seconds", "Duración de las requests HTTP por endpoint",
+    DURATION_BUCKETS, ("endpoint", "method", "status"))
+
+
+def _server_timing_entries() -> Optional[list]:
+    if not has_request_context():
+        return None
+    if "server_timing" not in g:
+        g.server_timing = []
+    return g.server_timing
+
+
+@contextmanager
+def stage(name: str):
+    """Mide una etapa: histograma, errores y entrada Server-Timing de la request actual."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_duration.observe(elapsed, stage=name)
+        entries = _server_timing_entries()
+        if entries is not None:
+            entries.append((name, elapsed))
+
+
+def record_error(name: str):
+    """Error de una etapa que no se propaga como excepción (ej. respuesta inválida)."""
+    stage_errors.inc(stage=name)
+
+
+def server_timing_header(total_seconds: Optional[float] = None) -> Optional[str]:
+    """Valor del header Server-Timing con las etapas medidas en esta request."""
+    entries = list(g.get("server_timing") or []) if has_request_context() else []
+    if total_seconds is not None:
+        entries.append(("total", total_seconds))
+    if not entries:
+        return None
+    # Una misma etapa puede repetirse (ej. dos lecturas de Firestore): se suman
+    merged: Dict[str, float] = {}
+    for name, elapsed in entries:
+        merged[name] = merged.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in merged.items())
@@ -0,0 +1,262 @@
+"""
+Extracción de texto de PDFs con presupuesto y fuera del hilo de la request.
+
+Solo se necesitan los primeros miles de caracteres de una factura, así que el
+extractor deja de leer páginas en cuanto alcanza `max_chars` (o `max_pages`)
+y junta las partes una sola vez al final. Cada documento corre en un pool de
+procesos con timeout: un PDF malformado que cuelga al parser se corta matando
+su proceso, sin bloquear a los workers de Flask.
+
+El parser es intercambiable (TextBackend). Hoy se usa PyPDF2; para otro basta
+con implementar `extract` y registrarlo con register_backend.
+
+Los procesos del pool se crean con "spawn": importan este módulo y, además,
+el script principal del padre. Con gunicorn ese script es el de gunicorn y
+no hace nada al importarse; con `python app.py` el hijo vuelve a importar app.py como
+__mp_main__ (Flask, el registry de servicios...), por eso app.py deja el
+warmup y app.run fuera de ese caso.
+"""
+import abc
+import inspect
+import io
+import multiprocessing
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Union
+
+
+class PdfTextError(Exception):
+    """El PDF no se pudo leer (formato inválido, timeout, proceso caído)."""
+
+
+class PdfTextTimeout(PdfTextError):
+    """La extracción superó el timeout por documento."""
+
+
+class TextBackend(abc.ABC):
+    """
+    Interfaz de un parser de PDF. `extract` debe devolver las partes de texto
+    leídas sin pasar de `max_chars` (aprox.) ni de `max_pages`, y el total de
+    páginas del documento si lo conoce. `data` son los bytes del PDF o la ruta
+    de un archivo local (así no se copian los bytes al proceso del pool).
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def extract(self, data: Union[bytes, str], max_chars: int, max_pages: int) -> Dict[str, Any]:
+        """{"parts": [...], "pagesRead": n, "totalPages": n}"""
+
+
+class PyPDF2Backend(TextBackend):
+    name = "pypdf2"
+
+    def extract(self, data: Union[bytes, str], max_chars: int, max_pages: int) -> Dict[str, Any]:
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(io.BytesIO(data) if isinstance(data, bytes) else data, strict=False)
+        total_pages = len(reader.pages)
+        parts: List[str] = []
+        chars = 0
+        pages_read = 0
+        for page in reader.pages:
+            if pages_read >= max_pages or chars >= max_chars:
+                break
+            page_text = page.extract_text() or ""
+            parts.append(page_text)
+            chars += len(page_text) + 1
+            pages_read += 1
+        return {"parts": parts, "pagesRead": pages_read, "totalPages": total_pages}
+
+
+_BACKENDS: Dict[str, type] = {PyPDF2Backend.name: PyPDF2Backend}
+
+# Versión del formato de texto (normalize_text/text_quality): cambiarla invalida los textos guardados
+TEXT_FORMAT_VERSION = "1"
+# Menos caracteres visibles por página suele indicar un PDF escaneado o sin mapa Unicode
+MIN_CHARS_PER_PAGE = 200
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Texto listo para guardar y enviar a Gemini: sin caracteres de control,
+    saltos de línea \n, espacios repetidos colapsados y sin líneas vacías de más.
+    """
+    text = _CONTROL_CHARS.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    lines = (_SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def text_quality(text: str, pages: int) -> float:
+    """
+    Señal de 0 a 1 de qué tan utilizable es el texto extraído: proporción de
+    caracteres alfanuméricos entre los visibles, penalizada si hay poco texto
+    por página.
+    """
+    visible = [c for c in text if not c.isspace()]
+    if not visible:
+        return 0.0
+    alnum = sum(1 for c in visible if c.isalnum()) / len(visible)
+    density = min(1.0, len(visible) / (max(pages, 1) * MIN_CHARS_PER_PAGE))
+    return round(alnum * density, 3)
+
+
+def register_backend(backend_cls: type):
+    """Registra un TextBackend para poder elegirlo por nombre (PDF_TEXT_BACKEND)."""
+    if inspect.isabstract(backend_cls):
+        raise TypeError(f"{backend_cls.__name__} no implementa extract()")
+    _BACKENDS[backend_cls.name] = backend_cls
+    return backend_cls
+
+
+def available_backends() -> List[str]:
+    return sorted(_BACKENDS)
+
+
+def _run_backend(backend_cls: type, data: Union[bytes, str], max_chars: int, max_pages: int) -> Dict[str, Any]:
+    """
+    Se ejecuta dentro del proceso del pool (o inline si processes=0). Recibe la
+    clase y no el nombre: el proceso hijo la importa desde su módulo aunque
+    se haya registrado en el padre.
+    """
+    started = time.perf_counter()
+    raw = backend_cls().extract(data, max_chars, max_pages)
+    text = normalize_text("\n".join(raw["parts"]))
+    truncated = len(text) > max_chars or raw["pagesRead"] < raw["totalPages"]
+    text = text[:max_chars]
+    return {
+        "text": text,
+        "pagesRead": raw["pagesRead"],
+        "totalPages": raw["totalPages"],
+        "truncated": truncated,
+        "quality": text_quality(text, raw["pagesRead"]),
+        "backend": backend_cls.name,
+        "elapsedMs": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+class _Slot:
+    """Un proceso del pool: su propio ProcessPoolExecutor de un worker."""
+
+    def __init__(self):
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+
+class PdfTextExtractor:
+    """
+    Extrae texto de PDFs (bytes o ruta de archivo) con presupuesto de caracteres/páginas.
+
+    processes > 0: `processes` procesos "spawn" (uno por slot, creados al primer
+    uso). Cada llamada toma un slot libre antes de enviar el documento (si
+    están todos ocupados espera su turno), así el timeout corre desde que el
+    proceso empieza a parsear y no cuenta la espera en cola. Si un documento
+    lo supera se mata solo el proceso de su slot; los demás siguen.
+    processes = 0: corre en el hilo que llama, sin timeout (desarrollo/tests).
+    """
+
+    def __init__(self, backend: str = "pypdf2", max_chars: int = 4000, max_pages: int = 20,
+                 timeout: float = 20.0, processes: int = 2):
+        if backend not in _BACKENDS:
+            raise ValueError(f"backend de PDF desconocido: {backend} (disponibles: {available_backends()})")
+        self.backend = backend
+        self.max_chars = max_chars
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.processes = processes
+        self._slots = [_Slot() for _ in range(max(processes, 0))]
+        self._free: "queue.Queue[_Slot]" = queue.Queue()
+        for slot in self._slots:
+            self._free.put(slot)
+        self._lock = threading.Lock()
+        self.timeouts = 0
+        self.failures = 0
+
+    def _count(self, kind: str):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+
+    def _slot_executor(self, slot: _Slot) -> ProcessPoolExecutor:
+        if slot.executor is None:
+            executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                # Arrancar el proceso antes de medir el timeout del documento
+                executor.submit(int).result(timeout=self.timeout)
+            except BaseException:
+                self._reset_slot(executor, kill=True)
+                raise
+            slot.executor = executor
+        return slot.executor
+
+    @staticmethod
+    def _reset_slot(executor: Optional[ProcessPoolExecutor], kill: bool = False):
+        if executor is None:
+            return
+        if kill:
+            # ProcessPoolExecutor no permite cancelar una tarea en curso: se mata su proceso
+            for process in list((getattr(executor, "_processes", None) or {}).values()):
+                try:
+                    process.kill()
+                except Exception:
+                    pass
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, data: Union[bytes, str]) -> Dict[str, Any]:
+        """
+        `data`: bytes del PDF o ruta de un archivo local.
+        Devuelve {"text", "pagesRead", "totalPages", "truncated", "quality", "backend", "elapsedMs"}.
+        Lanza PdfTextTimeout si supera el timeout y PdfTextError si el PDF no se puede leer.
+        """
+        if self.processes <= 0:
+            try:
+                return _run_backend(_BACKENDS[self.backend], data, self.max_chars, self.max_pages)
+            except Exception as e:
+                self._count("failures")
+                raise PdfTextError(str(e)) from e
+
+        slot = self._free.get()
+        try:
+            for _ in range(2):
+                try:
+                    future = self._slot_executor(slot).submit(
+                        _run_backend, _BACKENDS[self.backend], data, self.max_chars, self.max_pages
+                    )
+                    return future.result(timeout=self.timeout)
+                except FuturesTimeout:
+                    self._count("timeouts")
+                    self._reset_slot(slot.executor, kill=True)
+                    slot.executor = None
+                    raise PdfTextTimeout(f"la extracción superó {self.timeout}s")
+                except (BrokenProcessPool, RuntimeError):
+                    # El proceso del slot murió: recrearlo y reintentar una vez
+                    self._reset_slot(slot.executor)
+                    slot.executor = None
+                except Exception as e:
+                    self._count("failures")
+                    raise PdfTextError(str(e)) from e
+            self._count("failures")
+            raise PdfTextError("el pool de extracción no está disponible")
+        finally:
+            self._free.put(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "processes": self.processes,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+            }
+
+    def shutdown(self):
+        for slot in self._slots:
+            executor, slot.executor = slot.executor, None
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,115 @@
+"""
+Capa de respuestas JSON: serialización con orjson y compresión gzip/brotli.
+
+    responses.init_app(app, min_size=1024)
+
+- app.json pasa a ser OrjsonProvider: jsonify, app.json.dumps y request.get_json
+  usan orjson. Los datetime (incluidos los DatetimeWithNanoseconds que devuelve
+  Firestore) salen en ISO 8601, sin convertir campo por campo.
+- Un after_request comprime las respuestas de texto/JSON de más de `min_size`
+  bytes según Accept-Encoding (br si el paquete Brotli está instalado, si no
+  gzip). Las respuestas en streaming (NDJSON, exportaciones) no se tocan.
+
+Sin orjson instalado se mantiene el proveedor estándar de Flask.
+"""
+import base64
+import gzip
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Any
+
+from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/csv", "text/plain", "text/html", "application/x-ndjson"}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # calidades altas son demasiado lentas para respuestas dinámicas
+
+
+def _default(obj: Any) -> Any:
+    """Tipos que orjson no serializa solo (las subclases de datetime caen aquí)."""
+    if isinstance(obj, (datetime, date, dt_time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask basado en orjson (compacto, sin ordenar claves)."""
+
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        # Igual que DefaultJSONProvider.response pero sin pasar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=self.option),
+            mimetype=self.mimetype,
+        )
+
+
+def _choose_encoding() -> str:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality("br") > 0:
+        return "br"
+    if accepted.quality("gzip") > 0:
+        return "gzip"
+    return ""
+
+
+def compress_response(response, min_size: int):
+    """Comprime la respuesta (ya armada) si conviene; se usa como after_request."""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _choose_encoding()
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app: Flask, min_size: int = 1024):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    else:
+        print("⚠️ orjson no instalado - se usa el serializador JSON estándar de Flask")
+    app.after_request(lambda response: compress_response(response, min_size))
@@ -0,0 +1,120 @@
+"""
+Tokens de búsqueda de facturas (GET /invoices/search).
+
+Firestore no busca por subcadenas, pero sí indexa cada elemento de un array:
+cada factura guarda en `searchTokens` los términos de sus campos de texto
+(sin acentos, en minúsculas) y sus prefijos. Ese campo es el índice
+invertido; Firestore lo mantiene solo cuando la factura se crea o se procesa,
+y una consulta array_contains + createdAt lo recorre ya ordenado:
+
+    tokens = index_tokens(invoice)                   # al escribir la factura
+    terms = query_terms("distrib peruana")           # ["distrib", "peruana"]
+    driver = driver_token(terms)                     # el término que va a Firestore
+    matches(invoice, terms) / score(invoice, terms)  # filtro y ranking en memoria
+
+Los números van sin ceros a la izquierda en ambos lados, para que
+"F001-00000042" y "42" encuentren la misma factura.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, List
+
+# Campos indexados y su peso en el ranking (de más a menos específico)
+FIELD_WEIGHTS = {
+    "numero_factura": 8,
+    "ruc_emisor": 6,
+    "razon_social_emisor": 4,
+    "originalFilename": 2,
+    "concepto": 1,
+}
+MIN_PREFIX = 2       # prefijos más cortos que esto no se indexan
+MAX_PREFIX = 15      # ni más largos (el término completo sí se guarda)
+MAX_TOKENS = 300     # tope por factura, para acotar el tamaño del documento
+MAX_QUERY_TERMS = 8
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize(value: Any) -> str:
+    """Minúsculas y sin acentos ("Compañía" -> "compania")."""
+    text = unicodedata.normalize("NFKD", str(value or ""))
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def terms(value: Any) -> List[str]:
+    """Palabras alfanuméricas de un valor; los números sin ceros a la izquierda."""
+    result = []
+    for word in _WORD.findall(normalize(value)):
+        if word.isdigit():
+            word = word.lstrip("0") or "0"
+        result.append(word)
+    return result
+
+
+def _prefixes(term: str) -> List[str]:
+    tokens = [term[:n] for n in range(MIN_PREFIX, min(len(term), MAX_PREFIX) + 1)]
+    if term not in tokens:
+        tokens.append(term)
+    return tokens
+
+
+def _field_terms(invoice: Dict[str, Any]) -> Dict[str, List[str]]:
+    fields = {field: terms(invoice.get(field)) for field in FIELD_WEIGHTS}
+    # "factura_enero.pdf": la extensión no aporta a la búsqueda
+    if fields["originalFilename"][-1:] == ["pdf"]:
+        fields["originalFilename"].pop()
+    return fields
+
+
+def index_tokens(invoice: Dict[str, Any]) -> List[str]:
+    """
+    Valor de `searchTokens` para una factura: términos y prefijos de los
+    campos de FIELD_WEIGHTS, sin repetir. Si pasan de MAX_TOKENS se recortan
+    los de los campos menos importantes.
+    """
+    seen: Dict[str, None] = {}
+    for field, words in _field_terms(invoice).items():
+        for term in words:
+            for token in _prefixes(term):
+                seen.setdefault(token)
+    return list(seen)[:MAX_TOKENS]
+
+
+def query_terms(q: str) -> List[str]:
+    """Términos de la búsqueda, sin repetir (ValueError si no queda ninguno)."""
+    result = list(dict.fromkeys(terms(q)))[:MAX_QUERY_TERMS]
+    if not result:
+        raise ValueError("'q' debe tener al menos una letra o número")
+    return result
+
+
+def driver_token(query: List[str]) -> str:
+    """
+    Término que se consulta en Firestore (el más largo: suele ser el más
+    selectivo). Se recorta a MAX_PREFIX porque es el prefijo más largo
+    indexado; los demás términos se verifican en memoria con matches().
+    """
+    return max(query, key=len)[:MAX_PREFIX]
+
+
+def matches(invoice: Dict[str, Any], query: List[str]) -> bool:
+    """Cada término de la búsqueda es prefijo de alguna palabra de la factura."""
+    words = [w for field_words in _field_terms(invoice).values() for w in field_words]
+    return all(any(w.startswith(t) for w in words) for t in query)
+
+
+def score(invoice: Dict[str, Any], query: List[str]) -> int:
+    """
+    Relevancia: por cada término, el mejor campo donde aparece (peso del
+    campo, doble si la palabra coincide completa y no solo como prefijo).
+    """
+    fields = _field_terms(invoice)
+    total = 0
+    for t in query:
+        best = 0
+        for field, words in fields.items():
+            for w in words:
+                if w.startswith(t):
+                    best = max(best, FIELD_WEIGHTS[field] * (2 if w == t else 1))
+        total += best
+    return total
@@ -0,0 +1,155 @@
+"""
+Registro de servicios con inicialización perezosa.
+
+Importar google.generativeai, google.cloud.* y firebase_admin y construir
+sus clientes cuesta segundos en cada arranque de instancia de Cloud Run,
+aunque la instancia solo atienda /health o GET /invoices. Aquí cada módulo
+pesado y cada cliente se crea la primera vez que se usa (una sola vez, con
+lock), y se registra cuánto tardó.
+
+    firestore = registry.lazy_module("google.cloud.firestore")
+    registry.register("firestore", lambda: firestore.Client())
+    firestore_client = registry.proxy("firestore")
+
+    firestore_client.collection("invoices")   # importa y crea el cliente aquí
+
+override() reemplaza un servicio ya creado o por crear (ej. los fakes de
+fakes.py); warmup() inicializa todo en segundo plano.
+"""
+import importlib
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class LazyService:
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self._value: Any = None
+        self._ready = False
+        self._lock = threading.Lock()
+        self.init_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def get(self) -> Any:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                started = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    # No se marca como listo: el siguiente uso vuelve a intentarlo
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.init_ms = round((time.perf_counter() - started) * 1000, 1)
+                self.error = None
+                self._ready = True
+        return self._value
+
+    def set(self, value: Any):
+        with self._lock:
+            self._value = value
+            self._ready = True
+            self.init_ms = 0.0
+            self.error = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+
+class ServiceProxy:
+    """Objeto que delega todo atributo al servicio (y lo crea en el primer acceso)."""
+
+    __slots__ = ("_service",)
+
+    def __init__(self, service: LazyService):
+        object.__setattr__(self, "_service", service)
+
+    def __getattr__(self, item):
+        return getattr(self._service.get(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self._service.get(), key, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._service.get()(*args, **kwargs)
+
+    def __bool__(self):
+        return bool(self._service.get())
+
+    def __repr__(self):
+        state = "listo" if self._service.ready else "sin inicializar"
+        return f"<servicio {self._service.name} ({state})>"
+
+
+class ServiceRegistry:
+    def __init__(self):
+        self._services: Dict[str, LazyService] = {}
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> LazyService:
+        service = LazyService(name, factory)
+        self._services[name] = service
+        return service
+
+    def lazy_module(self, module_name: str) -> ServiceProxy:
+        """Módulo que se importa en el primer acceso a uno de sus atributos."""
+        service = self.register(f"import:{module_name}", lambda: importlib.import_module(module_name))
+        return ServiceProxy(service)
+
+    def proxy(self, name: str) -> ServiceProxy:
+        return ServiceProxy(self._services[name])
+
+    def get(self, name: str) -> Any:
+        return self._services[name].get()
+
+    def override(self, name: str, value: Any):
+        """Fija el valor de un servicio (ej. un fake) sin ejecutar su factory."""
+        if name not in self._services:
+            self.register(name, lambda: value)
+        self._services[name].set(value)
+
+    def warmup(self, names: Optional[Iterable[str]] = None, background: bool = True) -> bool:
+        """
+        Inicializa los servicios (todos o `names`). En segundo plano devuelve
+        False si ya había un warmup en curso.
+        """
+        targets = list(names) if names is not None else list(self._services)
+
+        def _run():
+            for name in targets:
+                try:
+                    self._services[name].get()
+                except Exception as e:
+                    print(f"⚠️ Warmup de {name} falló: {e}")
+
+        if not background:
+            _run()
+            return True
+        with self._lock:
+            if self._warmup_thread is not None and self._warmup_thread.is_alive():
+                return False
+            self._warmup_thread = threading.Thread(target=_run, name="warmup", daemon=True)
+            self._warmup_thread.start()
+        return True
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Estado e inicialización (ms) de cada componente, en orden de registro."""
+        return [
+            {
+                "name": service.name,
+                "ready": service.ready,
+                "initMs": service.init_ms,
+                **({"error": service.error} if service.error else {}),
+            }
+            for service in self._services.values()
+        ]
+
+
+registry = ServiceRegistry()
@@ -0,0 +1,266 @@
+"""
+Extractor local (reglas + regex) para facturas electrónicas SUNAT.
+
+La mayoría de las facturas que suben los proveedores siguen el formato
+estándar de SUNAT: RUC de 11 dígitos, serie-número F001-00000123, importe
+total con S/ o US$ y fechas de emisión/vencimiento con etiqueta. Esos campos
+se pueden leer del texto sin llamar a Gemini.
+
+extract_invoice_fields devuelve el mismo esquema JSON que pide el prompt de
+Gemini más un `confidence` propio (0-100) calculado según qué campos se
+encontraron y validaron; el backend solo recurre a Gemini cuando la
+confianza queda por debajo del umbral configurado o falta alguno de
+REQUIRED_FIELDS (is_complete).
+"""
+import re
+import unicodedata
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+# Pesos del dígito verificador del RUC (módulo 11)
+RUC_WEIGHTS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+RUC_PREFIXES = ("10", "15", "16", "17", "20")
+
+# Aporte de cada campo a la confianza (suman 100)
+CONFIDENCE_WEIGHTS = {
+    "es_factura": 10,
+    "ruc_emisor": 25,
+    "numero_factura": 20,
+    "monto_total": 25,
+    "fecha_emision": 10,
+    "moneda": 5,
+    "fecha_vencimiento": 5,
+}
+# Sin estos campos el resultado local no se acepta aunque la confianza
+# alcance el umbral: moneda y vencimiento alimentan los totales y la mora.
+REQUIRED_FIELDS = ("ruc_emisor", "numero_factura", "monto_total", "moneda", "fecha_emision", "fecha_vencimiento")
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+
+_RUC_RE = re.compile(r"(?<!\d)(\d{11})(?!\d)")
+_SERIE_RE = re.compile(r"\b([FE][A-Z0-9]{3})\s*[-–]\s*(\d{1,8})\b")
+_AMOUNT_RE = r"(\d{1,3}(?:[.,\s]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?!\d)"
+_CURRENCY_RE = r"(S/\.?|US\$|\$|PEN|USD|SOLES|DOLARES)?"
+# Etiquetas de total en orden de preferencia. La genérica TOTAL debe ir
+# seguida directamente del importe: "TOTAL DESCUENTO", "TOTAL IGV", etc. no
+# son el total de la factura.
+_TOTAL_LABELS = (
+    r"IMPORTE\s+TOTAL[^0-9\n]*?",
+    r"TOTAL\s+A\s+PAGAR[^0-9\n]*?",
+    r"TOTAL\s+(?:DE\s+LA\s+)?VENTA[^0-9\n]*?",
+    r"(?<![A-Z])(?<!SUB\s)(?<!SUB-)TOTAL\s*:?\s*",
+)
+_DATE_NUMERIC_RE = re.compile(r"\b(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4})\b|\b(\d{4})-(\d{2})-(\d{2})\b")
+_DATE_WORDS_RE = re.compile(r"\b(\d{1,2})\s+DE\s+([A-Z]+)\s+(?:DE(?:L)?\s+)?(\d{4})\b")
+_LEGAL_FORM_RE = re.compile(r"\b(S\.?A\.?C\.?|S\.?A\.?A\.?|S\.?A\.?|E\.?I\.?R\.?L\.?|S\.?R\.?L\.?|S\.?C\.?R\.?L\.?)\s*$")
+_CUSTOMER_LABEL_RE = re.compile(r"SE[NÑ]OR|CLIENTE|ADQUIRIENTE|RAZ[OÓ]N\s+SOCIAL\s+DEL\s+CLIENTE|DESTINATARIO")
+
+
+def _normalize(text: str) -> str:
+    """Mayúsculas y sin tildes (las etiquetas vienen escritas de mil formas)."""
+    text = unicodedata.normalize("NFKD", text.upper())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def is_valid_ruc(ruc: str) -> bool:
+    """Valida un RUC peruano: 11 dígitos, prefijo conocido y dígito verificador módulo 11."""
+    if not ruc or len(ruc) != 11 or not ruc.isdigit() or ruc[:2] not in RUC_PREFIXES:
+        return False
+    total = sum(int(d) * w for d, w in zip(ruc[:10], RUC_WEIGHTS))
+    check = 11 - (total % 11)
+    if check == 10:
+        check = 0
+    elif check == 11:
+        check = 1
+    return check == int(ruc[10])
+
+
+def _find_ruc(lines: List[str]) -> Tuple[Optional[str], bool]:
+    """
+    RUC del emisor: el primer RUC válido que no esté en la línea (o la
+    anterior) de los datos del cliente. Devuelve (ruc, validado).
+    """
+    first_candidate = None
+    for i, line in enumerate(lines):
+        for match in _RUC_RE.finditer(line):
+            ruc = match.group(1)
+            near_customer = _CUSTOMER_LABEL_RE.search(line) or (i > 0 and _CUSTOMER_LABEL_RE.search(lines[i - 1]))
+            if first_candidate is None and not near_customer:
+                first_candidate = ruc
+            if is_valid_ruc(ruc) and not near_customer:
+                return ruc, True
+    return first_candidate, False
+
+
+def _find_razon_social(lines: List[str], ruc: Optional[str]) -> Optional[str]:
+    """Primera línea del encabezado con forma societaria (S.A.C., E.I.R.L., ...)."""
+    ruc_line = next((i for i, line in enumerate(lines) if ruc and ruc in line), 0)
+    window = range(max(0, ruc_line - 3), min(len(lines), ruc_line + 4))
+    for i in list(window) + list(range(min(len(lines), 10))):
+        line = lines[i].strip()
+        if _LEGAL_FORM_RE.search(line) and not _CUSTOMER_LABEL_RE.search(line) and not _RUC_RE.search(line):
+            return line
+    return None
+
+
+def _find_numero(text: str) -> Optional[str]:
+    match = _SERIE_RE.search(text)
+    if not match:
+        return None
+    return f"{match.group(1)}-{int(match.group(2)):08d}"
+
+
+def _parse_amount(raw: str) -> Optional[str]:
+    """'1,500.00' / '1.500,00' / '1 500.00' -> '1500.00'."""
+    raw = raw.strip().replace(" ", "")
+    last_dot, last_comma = raw.rfind("."), raw.rfind(",")
+    decimal_pos = max(last_dot, last_comma)
+    if decimal_pos != -1 and len(raw) - decimal_pos - 1 in (1, 2):
+        integer, decimals = raw[:decimal_pos], raw[decimal_pos + 1:]
+    else:
+        integer, decimals = raw, "00"
+    integer = re.sub(r"[.,]", "", integer)
+    if not integer.isdigit():
+        return None
+    return f"{int(integer)}.{decimals.ljust(2, '0')}"
+
+
+def _currency_code(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    if token.startswith("S/") or token in ("PEN", "SOLES"):
+        return "PEN"
+    if token in ("US$", "$", "USD", "DOLARES"):
+        return "USD"
+    return None
+
+
+def _find_total(lines: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Devuelve (monto_total, moneda del renglón del total si aparece)."""
+    for label in _TOTAL_LABELS:
+        pattern = re.compile(label + _CURRENCY_RE + r"\s*" + _AMOUNT_RE)
+        for line in lines:
+            if "IGV" in line or "GRAVADA" in line:
+                continue
+            match = pattern.search(line)
+            if match:
+                amount = _parse_amount(match.group(2))
+                if amount is not None:
+                    return amount, _currency_code(match.group(1))
+    return None, None
+
+
+def _find_currency(text: str, total_currency: Optional[str]) -> Optional[str]:
+    if total_currency:
+        return total_currency
+    match = re.search(r"MONEDA\s*:?\s*([A-Z$/.]+)", text)
+    if match:
+        code = _currency_code(match.group(1).rstrip("."))
+        if code:
+            return code
+    soles = len(re.findall(r"S/|\bSOLES\b|\bPEN\b", text))
+    dolares = len(re.findall(r"US\$|\bDOLARES\b|\bUSD\b", text))
+    if soles or dolares:
+        return "PEN" if soles >= dolares else "USD"
+    return None
+
+
+def _parse_date(fragment: str) -> Optional[str]:
+    match = _DATE_NUMERIC_RE.search(fragment)
+    if match:
+        if match.group(4):
+            year, month, day = int(match.group(4)), int(match.group(5)), int(match.group(6))
+        else:
+            day, month, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
+    else:
+        match = _DATE_WORDS_RE.search(fragment)
+        if not match or match.group(2).lower() not in MONTHS:
+            return None
+        day, month, year = int(match.group(1)), MONTHS[match.group(2).lower()], int(match.group(3))
+    try:
+        # Descarta fechas imposibles (31/02, 30/02, 29/02 en año no bisiesto)
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def _find_labeled_date(lines: List[str], label: str) -> Optional[str]:
+    pattern = re.compile(label)
+    for i, line in enumerate(lines):
+        match = pattern.search(line)
+        if match:
+            # La fecha puede estar en la misma línea o en la siguiente
+            date = _parse_date(line[match.end():]) or (i + 1 < len(lines) and _parse_date(lines[i + 1])) or None
+            if date:
+                return date
+    return None
+
+
+def _find_concepto(lines: List[str]) -> Optional[str]:
+    for line in lines:
+        match = re.search(r"\b(?:DESCRIPCION|CONCEPTO|POR CONCEPTO DE)\s*:\s*(.+)", line)
+        if match and match.group(1).strip():
+            return match.group(1).strip()
+    return None
+
+
+def is_complete(data: Dict[str, Any]) -> bool:
+    """True si el resultado trae todos los REQUIRED_FIELDS."""
+    return all(data.get(field) for field in REQUIRED_FIELDS)
+
+
+def extract_invoice_fields(text: str) -> Dict[str, Any]:
+    """
+    Extrae los campos de una factura SUNAT del texto del PDF. Devuelve el
+    esquema de process_invoice_with_gemini con `confidence` local y
+    `extractor: "local"`.
+    """
+    original_lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    lines = [_normalize(line) for line in original_lines]
+    normalized = "\n".join(lines)
+
+    ruc, ruc_valid = _find_ruc(lines)
+    numero = _find_numero(normalized)
+    total, total_currency = _find_total(lines)
+    moneda = _find_currency(normalized, total_currency)
+    fecha_emision = _find_labeled_date(lines, r"FECHA\s+(?:DE\s+)?EMISION|F\.\s*EMISION|EMITIDO")
+    fecha_vencimiento = _find_labeled_date(lines, r"FECHA\s+(?:DE\s+)?VENCIMIENTO|F\.\s*VENCIMIENTO|^\s*VENCE\b\s*(?:EL\b)?\s*:?")
+    es_factura = bool(re.search(r"\bFACTURA\b", normalized)) and numero is not None and numero.startswith(("F", "E"))
+
+    razon_social = _find_razon_social(lines, ruc)
+    if razon_social:
+        # Devolver la línea tal como venía (con tildes y mayúsculas originales)
+        razon_social = original_lines[lines.index(razon_social)]
+    concepto = _find_concepto(lines)
+    if concepto:
+        line_index = next(i for i, line in enumerate(lines) if concepto in line)
+        concepto = original_lines[line_index].split(":", 1)[-1].strip()
+
+    found = {
+        "es_factura": es_factura,
+        "ruc_emisor": ruc_valid,
+        "numero_factura": numero is not None,
+        "monto_total": total is not None,
+        "fecha_emision": fecha_emision is not None,
+        "moneda": moneda is not None,
+        "fecha_vencimiento": fecha_vencimiento is not None,
+    }
+    confidence = sum(weight for field, weight in CONFIDENCE_WEIGHTS.items() if found[field])
+
+    return {
+        "es_factura": es_factura,
+        "resumen": None,
+        "monto_total": total,
+        "moneda": moneda,
+        "ruc_emisor": ruc,
+        "razon_social_emisor": razon_social,
+        "fecha_emision": fecha_emision,
+        "fecha_vencimiento": fecha_vencimiento,
+        "numero_factura": numero,
+        "concepto": concepto,
+        "confidence": confidence,
+        "extractor": "local",
+    }
@@ -0,0 +1,56 @@
+"""
+Fixtures comunes: app.py importado con los backends en memoria de fakes.py.
+Cada test recibe backends nuevos (Firestore, Storage, Auth y Gemini vacíos).
+
+    cd backend-run
+    python -m pytest -q
+"""
+import io
+import os
+import sys
+
+# Antes de importar app: sin procesos para el texto de los PDFs ni cola en disco
+os.environ["NEO_BACKENDS"] = "fake"
+os.environ.setdefault("PDF_TEXT_PROCESSES", "0")
+os.environ.setdefault("JOB_QUEUE_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as app_module
+import fakes
+
+
+@pytest.fixture
+def backends():
+    created = fakes.make_backends()
+    app_module.configure_backends(**created)
+    created["auth"].add_user("admin", role="admin")
+    created["auth"].add_user("sup1", role="proveedor")
+    created["auth"].add_user("sup2", role="proveedor")
+    return created
+
+
+@pytest.fixture
+def db(backends):
+    return backends["firestore_client"]
+
+
+@pytest.fixture
+def client(backends):
+    return app_module.app.test_client()
+
+
+def auth_headers(uid: str) -> dict:
+    return {"Authorization": "Bearer " + fakes.FakeAuth.token_for(uid)}
+
+
+def upload(client, uid: str, **pdf_fields):
+    """Sube un PDF generado con fakes.make_invoice_pdf y devuelve el JSON de la respuesta."""
+    pdf = fakes.make_invoice_pdf(**pdf_fields)
+    response = client.post(
+        "/invoices", headers=auth_headers(uid),
+        data={"file": (io.BytesIO(pdf), "factura.pdf")}, content_type="multipart/form-data",
+    )
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
@@ -0,0 +1,26 @@
+"""Cambio de estado masivo (PATCH /invoices/status)."""
+from conftest import auth_headers, upload
+
+
+def test_bulk_status_reports_duplicate_and_missing_ids(client):
+    ids = [upload(client, "sup1", numero=f"F001-{n:08d}")["invoiceId"] for n in range(3)]
+
+    response = client.patch("/invoices/status", headers=auth_headers("admin"), json={
+        "invoiceIds": ids + ["inv_000000000000", ids[0]], "status": "Por Pagar",
+    })
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body["updated"], body["failed"]) == (3, 2)
+    errors = [item.get("error") for item in body["results"]]
+    assert errors == [None, None, None, "factura no encontrada", "invoiceId repetido"]
+
+    by_status = client.get("/dashboard/stats", headers=auth_headers("admin")).get_json()["by_status"]
+    assert by_status["Por Pagar"] == 3
+    assert by_status["Recibida"] == 0
+
+
+def test_bulk_status_rejects_invalid_body(client):
+    response = client.patch("/invoices/status", headers=auth_headers("admin"), json={"invoiceIds": "x"})
+    assert response.status_code == 400
+    response = client.patch("/invoices/status", headers=auth_headers("sup1"), json={"invoiceIds": [], "status": "Pagada"})
+    assert response.status_code == 403
@@ -0,0 +1,28 @@
+"""Deduplicación de PDFs subidos y de facturas por (RUC, número)."""
+import app as app_module
+from conftest import auth_headers, upload
+
+
+def test_same_pdf_reuses_the_stored_file(client):
+    first = upload(client, "sup1")
+    second = upload(client, "sup1")
+
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True
+    assert second["storagePath"] == first["storagePath"]
+    assert second["invoiceId"] != first["invoiceId"]
+
+
+def test_same_ruc_and_number_is_flagged_as_duplicate(client, db):
+    original = upload(client, "sup1", numero="F001-42", total="321.00")["invoiceId"]
+    copy = upload(client, "sup2", numero="F001-00000042", total="999.00")["invoiceId"]
+    other = upload(client, "sup1", numero="F001-43")["invoiceId"]
+    for invoice_id in (original, copy, other):
+        _, status_code = app_module._process_invoice_pipeline(invoice_id)
+        assert status_code == 200
+
+    assert db.collection("invoices").document(copy).get().to_dict()["duplicateOf"] == original
+    assert db.collection("invoices").document(other).get().to_dict()["duplicateOf"] is None
+
+    body = client.get("/invoices/duplicates", headers=auth_headers("admin")).get_json()
+    assert [(item["invoiceId"], item["original"]["invoiceId"]) for item in body["items"]] == [(copy, original)]
@@ -0,0 +1,53 @@
+"""ETag y GET condicional de los listados y del dashboard."""
+import app as app_module
+from conftest import auth_headers, upload
+
+
+def test_list_etag_revalidates_until_a_write(client):
+    invoice_id = upload(client, "sup1")["invoiceId"]
+
+    first = client.get("/invoices", headers=auth_headers("admin"))
+    etag = first.headers["ETag"]
+    cached = client.get("/invoices", headers={**auth_headers("admin"), "If-None-Match": etag})
+    assert cached.status_code == 304
+
+    client.patch(f"/invoices/{invoice_id}/status", headers=auth_headers("admin"), json={"status": "Pagada"})
+    fresh = client.get("/invoices", headers={**auth_headers("admin"), "If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["ETag"] != etag
+    assert fresh.get_json()["items"][0]["status"] == "Pagada"
+
+
+def test_dashboard_etag(client):
+    upload(client, "sup1")
+
+    etag = client.get("/dashboard/stats", headers=auth_headers("admin")).headers["ETag"]
+    cached = client.get("/dashboard/stats", headers={**auth_headers("admin"), "If-None-Match": etag})
+    assert cached.status_code == 304
+
+    upload(client, "sup2", numero="F001-00000999")
+    fresh = client.get("/dashboard/stats", headers={**auth_headers("admin"), "If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.get_json()["total_invoices"] == 2
+
+
+def test_dashboard_304_skips_counter_and_recent_queries(client, backends):
+    upload(client, "sup1")
+    etag = client.get("/dashboard/stats", headers=auth_headers("admin")).headers["ETag"]
+    stats = backends["firestore_client"].stats
+    stats.reset()
+
+    cached = client.get("/dashboard/stats", headers={**auth_headers("admin"), "If-None-Match": etag})
+
+    assert cached.status_code == 304
+    assert stats.snapshot().get("query") == 1  # solo los shards de la versión
+
+
+def test_rebuild_changes_dashboard_etag(client):
+    upload(client, "sup1")
+    etag = client.get("/dashboard/stats", headers=auth_headers("admin")).headers["ETag"]
+
+    app_module.rebuild_dashboard_stats(write=True)
+
+    fresh = client.get("/dashboard/stats", headers={**auth_headers("admin"), "If-None-Match": etag})
+    assert fresh.status_code == 200
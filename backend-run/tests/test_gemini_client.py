@@ -0,0 +1,165 @@
+"""GeminiClient contra FakeGeminiModel con reloj y sleep falsos (sin esperas reales)."""
+import random
+
+import pytest
+from google.api_core import exceptions as gexc
+
+import fakes
+from gemini_client import CircuitBreaker, GeminiClient, GeminiError, GeminiUnavailable, RateLimiter
+
+
+class FakeClock:
+    """Reloj monotónico que solo avanza con sleep()."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def model():
+    return fakes.FakeGeminiModel()
+
+
+def _client(model, clock, **kwargs) -> GeminiClient:
+    options = {"rpm": 60, "tpm": 1_000_000, "timeout": 10, "deadline": 60, "max_retries": 4,
+               "base_delay": 1.0, "max_delay": 8.0, "breaker_threshold": 3, "breaker_reset_seconds": 30}
+    options.update(kwargs)
+    return GeminiClient(model, sleep=clock.sleep, clock=clock, rng=random.Random(7), **options)
+
+
+def _calls(model) -> int:
+    return model.stats.snapshot().get("gemini_generate", 0)
+
+
+def test_retries_429_and_503_then_succeeds(model, clock):
+    client = _client(model, clock)
+    model.fail_next(gexc.TooManyRequests("429"), gexc.ServiceUnavailable("503"))
+
+    assert client.generate("Texto del documento: RUC 20100047218 F001-1").text
+    assert _calls(model) == 3
+    # Dos backoffs con jitter completo: uniform(0, base * 2**intento)
+    backoffs = clock.sleeps
+    assert len(backoffs) == 2
+    assert 0 <= backoffs[0] <= 1.0 and 0 <= backoffs[1] <= 2.0
+    # El 429 bajó la tasa a la mitad y el éxito la recuperó un poco
+    assert client.limiter.scale == pytest.approx(0.5 + client.limiter.recovery)
+
+
+def test_timeouts_are_retried(model, clock):
+    client = _client(model, clock)
+    model.fail_next(gexc.DeadlineExceeded("timeout"), TimeoutError("read timeout"))
+
+    client.generate("prompt")
+
+    assert _calls(model) == 3
+
+
+def test_non_retryable_error_fails_at_once(model, clock):
+    client = _client(model, clock)
+    model.fail_next(gexc.InvalidArgument("prompt inválido"))
+
+    with pytest.raises(GeminiError) as raised:
+        client.generate("prompt")
+
+    assert raised.value.retryable is False
+    assert _calls(model) == 1
+    assert clock.sleeps == []
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_deadline_bounds_attempts_and_timeouts(model, clock):
+    client = _client(model, clock, deadline=5, timeout=30, max_retries=50, breaker_threshold=100)
+    model.fail_every, model.error_cls = 1, gexc.ServiceUnavailable
+    started = clock.now
+
+    with pytest.raises(GeminiError) as raised:
+        client.generate("prompt")
+
+    assert raised.value.retryable is True
+    assert clock.now - started < 5  # nunca se duerme más allá del deadline
+    assert _calls(model) < 50
+    # Cada intento recibe como timeout lo que queda del deadline, no el timeout completo
+    assert all(options["timeout"] <= 5 for options in model.request_options)
+
+
+def test_circuit_opens_then_lets_a_single_probe_through(model, clock):
+    client = _client(model, clock, max_retries=0, breaker_threshold=3, breaker_reset_seconds=30)
+    model.fail_next(*[gexc.ServiceUnavailable("503")] * 3)
+    for _ in range(3):
+        with pytest.raises(GeminiError):
+            client.generate("prompt")
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    # Abierto: falla rápido sin llamar al modelo
+    with pytest.raises(GeminiUnavailable):
+        client.generate("prompt")
+    assert _calls(model) == 3
+
+    # Pasado reset_seconds: una sola llamada de prueba
+    clock.now += 30
+    assert client.breaker.allow() is True
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+    assert client.breaker.allow() is False
+    client.breaker.record_success()
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+    assert client.generate("prompt")
+    assert _calls(model) == 4
+
+
+def test_failed_probe_reopens_the_circuit(model, clock):
+    client = _client(model, clock, max_retries=0, breaker_threshold=1, breaker_reset_seconds=10)
+    model.fail_next(gexc.ServiceUnavailable("503"), gexc.ServiceUnavailable("503"))
+    with pytest.raises(GeminiError):
+        client.generate("prompt")
+
+    clock.now += 10
+    with pytest.raises(GeminiError):
+        client.generate("prompt")  # la prueba falla
+
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert client.breaker.opened_count == 2
+    with pytest.raises(GeminiUnavailable):
+        client.generate("prompt")
+
+
+def test_rate_limiter_penalize_and_reward(clock):
+    limiter = RateLimiter(rpm=60, tpm=1_000_000, clock=clock, min_scale=0.1, recovery=0.05)
+
+    for _ in range(5):
+        limiter.penalize()
+    assert limiter.scale == pytest.approx(0.1)  # no baja de min_scale
+
+    for _ in range(3):
+        limiter.reward()
+    assert limiter.scale == pytest.approx(0.25)
+    for _ in range(100):
+        limiter.reward()
+    assert limiter.scale == 1.0
+
+
+def test_rate_limiter_waits_for_a_slot_or_gives_up(clock):
+    limiter = RateLimiter(rpm=2, tpm=1_000_000, clock=clock)
+    limiter.acquire(10, deadline=clock.now + 60, sleep=clock.sleep)
+    limiter.acquire(10, deadline=clock.now + 60, sleep=clock.sleep)
+
+    # Sin cupo: 2 rpm repone una request cada 30 s
+    waited = limiter.acquire(10, deadline=clock.now + 60, sleep=clock.sleep)
+    assert waited == pytest.approx(30)
+
+    with pytest.raises(GeminiUnavailable):
+        limiter.acquire(10, deadline=clock.now + 5, sleep=clock.sleep)
+    assert limiter.throttled == 1
@@ -0,0 +1,36 @@
+"""Contadores de errores por etapa para fallos que no se propagan como excepción."""
+import app as app_module
+import metrics
+from conftest import auth_headers
+
+
+def _errors(stage: str) -> float:
+    return metrics.stage_errors._values.get((stage,), 0)
+
+
+def test_finalize_of_a_non_pdf_counts_a_scan_error(client, backends):
+    target = client.post("/invoices/upload-url", headers=auth_headers("sup1"), json={"filename": "a.pdf"}).get_json()
+    backends["storage_client"].seed(app_module.BUCKET_NAME, target["storagePath"], b"no soy un pdf")
+    before = _errors("pdf_scan")
+
+    response = client.post(f"/invoices/{target['invoiceId']}/finalize", headers=auth_headers("sup1"))
+
+    assert response.status_code == 400
+    assert _errors("pdf_scan") == before + 1
+
+
+def test_unparseable_gemini_response_counts_a_parse_error(backends, monkeypatch):
+    monkeypatch.setattr(app_module, "_gemini_response_text", lambda response: "sin JSON")
+    before = _errors("gemini_parse")
+
+    data = app_module.process_invoice_with_gemini("RUC 20100047218 F001-1")
+
+    assert data["confidence"] == 0
+    assert _errors("gemini_parse") == before + 1
+
+
+def test_low_confidence_local_extraction_counts_an_error(backends):
+    before = _errors("local_extract")
+
+    assert app_module._extract_locally("texto sin datos de factura") is None
+    assert _errors("local_extract") == before + 1
@@ -0,0 +1,64 @@
+"""Barrido de facturas vencidas (sweep_overdue_invoices)."""
+import fakes
+import app as app_module
+from conftest import auth_headers
+
+INVOICES = {
+    # id: (status, fecha_vencimiento, ¿debe quedar Vencida?)
+    "inv_a": ("Recibida", "2025-12-31", True),
+    "inv_b": ("Por Pagar", "2025-06-01", True),
+    "inv_c": ("Recibida", "2026-01-01", False),   # vence hoy: todavía no
+    "inv_d": ("Pagada", "2025-01-01", False),
+    "inv_e": ("Por Pagar", "01/02/2025", False),  # fecha no ISO: se omite
+    "inv_f": ("Recibida", None, False),
+}
+
+
+def _seed(db):
+    for invoice_id, (status, due, _) in INVOICES.items():
+        db.seed(f"invoices/{invoice_id}", {
+            "supplierUid": "sup1", "status": status, "fecha_vencimiento": due,
+            "processed": True, "createdAt": fakes._now(),
+        })
+    app_module.rebuild_dashboard_stats(write=True)
+
+
+def _statuses(db):
+    return {invoice_id: db.collection("invoices").document(invoice_id).get().to_dict()["status"]
+            for invoice_id in INVOICES}
+
+
+def test_sweep_marks_only_overdue_invoices(db):
+    _seed(db)
+
+    result = app_module.sweep_overdue_invoices("2026-01-01")
+
+    assert result["complete"] is True
+    assert result["updated"] == 2
+    assert result["skipped"] == 1
+    statuses = _statuses(db)
+    for invoice_id, (status, _, overdue) in INVOICES.items():
+        assert statuses[invoice_id] == ("Vencida" if overdue else status)
+
+    stats = app_module.read_dashboard_stats()
+    assert stats["by_status"] == app_module.rebuild_dashboard_stats(write=False)["by_status"]
+    assert stats["by_status"]["Vencida"] == 2
+
+    # Una segunda corrida del mismo día no cambia nada
+    assert app_module.sweep_overdue_invoices("2026-01-01")["updated"] == 0
+
+
+def test_sweep_dry_run_writes_nothing(db):
+    _seed(db)
+    before = _statuses(db)
+
+    result = app_module.sweep_overdue_invoices("2026-01-01", write=False)
+
+    assert result["updated"] == 2
+    assert _statuses(db) == before
+
+
+def test_sweep_endpoint_requires_admin(client):
+    assert client.post("/admin/sweep-overdue", headers=auth_headers("sup1"), json={}).status_code == 403
+    response = client.post("/admin/sweep-overdue", headers=auth_headers("admin"), json={"asOf": "2026-13-01"})
+    assert response.status_code == 400
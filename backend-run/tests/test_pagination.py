@@ -0,0 +1,28 @@
+"""Paginación por cursor y filtros de GET /invoices."""
+from conftest import auth_headers, upload
+
+
+def test_list_follows_cursor_without_repeating(client):
+    created = [upload(client, "sup1", numero=f"F001-{n:08d}")["invoiceId"] for n in range(7)]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        query = "/invoices?page_size=3" + (f"&start_after={cursor}" if cursor else "")
+        body = client.get(query, headers=auth_headers("admin")).get_json()
+        assert len(body["items"]) <= 3
+        seen += [item["invoiceId"] for item in body["items"]]
+        pages += 1
+        cursor = body["nextCursor"]
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert seen == list(reversed(created))  # más recientes primero, sin repetidos
+
+
+def test_list_scoped_to_supplier(client):
+    upload(client, "sup1")
+    upload(client, "sup2", numero="F001-00000999")
+
+    items = client.get("/invoices", headers=auth_headers("sup1")).get_json()["items"]
+    assert [item["supplierUid"] for item in items] == ["sup1"]
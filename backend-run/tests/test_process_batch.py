@@ -0,0 +1,9 @@
+"""Validación del body de POST /invoices/process-batch."""
+from conftest import auth_headers
+
+
+def test_process_batch_rejects_non_integer_limit(client):
+    for limit in ([1], {}, None, "5"):
+        response = client.post("/invoices/process-batch", headers=auth_headers("admin"),
+                               json={"filter": {"processed": False}, "limit": limit})
+        assert response.status_code == 400
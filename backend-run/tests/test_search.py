@@ -0,0 +1,72 @@
+"""Tokens de búsqueda (search.py) y paginación de GET /invoices/search."""
+import pytest
+
+import app as app_module
+import search
+from conftest import auth_headers, upload
+
+
+def test_terms_fold_accents_case_and_leading_zeros():
+    assert search.normalize("Compañía ÁNDES") == "compania andes"
+    assert search.terms("Distribuidora Peruana S.A.C. F001-00000042") == [
+        "distribuidora", "peruana", "s", "a", "c", "f001", "42"]
+    assert search.query_terms("  Perú  peru PERÚ 0042 ") == ["peru", "42"]
+    with pytest.raises(ValueError):
+        search.query_terms("-- ¿? --")
+
+
+def test_index_tokens_match_accented_prefixes():
+    invoice = {
+        "numero_factura": "F001-00000042",
+        "razon_social_emisor": "Compañía Minera Andina S.A.",
+        "originalFilename": "factura_enero.pdf",
+    }
+    tokens = search.index_tokens(invoice)
+
+    assert {"co", "comp", "compania", "42", "enero"} <= set(tokens)
+    assert "pdf" not in tokens and "c" not in tokens  # sin extensión ni prefijos de 1 letra
+    assert search.matches(invoice, search.query_terms("compañ MINER"))
+    assert not search.matches(invoice, search.query_terms("compañ aurifera"))
+    assert search.driver_token(search.query_terms("compañ 42")) == "compan"
+    # El número completo pesa más que un prefijo de la razón social
+    assert search.score(invoice, ["42"]) > search.score(invoice, ["comp"])
+
+
+def _search(client, query: str) -> dict:
+    response = client.get(query, headers=auth_headers("admin"))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_search_cursor_round_trip(client, monkeypatch):
+    monkeypatch.setattr(app_module, "SEARCH_WINDOW", 3)
+    created = [upload(client, "sup1", numero=f"F001-{n:08d}")["invoiceId"] for n in range(7)]
+
+    token = app_module._encode_search_cursor("abc", 4)
+    assert app_module._decode_search_cursor(token) == ("abc", 4)
+    assert client.get("/invoices/search?q=factura&cursor=xyz", headers=auth_headers("admin")).status_code == 400
+
+    seen, cursor = [], None
+    while True:
+        body = _search(client, "/invoices/search?q=factura&page_size=2" + (f"&cursor={cursor}" if cursor else ""))
+        assert body["ranking"] == "window" and body["partial"] is False
+        seen += [item["invoiceId"] for item in body["items"]]
+        cursor = body["nextCursor"]
+        # Las páginas se llenan aunque crucen el borde de una ventana
+        assert len(body["items"]) == 2 or not cursor
+        if not cursor:
+            break
+
+    assert sorted(seen) == sorted(created) and len(seen) == 7  # todas, sin repetidos
+
+
+def test_scan_limit_returns_a_partial_page(client, monkeypatch):
+    monkeypatch.setattr(app_module, "SEARCH_MAX_SCAN", 2)
+    for n in range(5):
+        upload(client, "sup1", numero=f"F001-{n:08d}")
+
+    # "factura" va a Firestore; "zzz" se filtra en memoria y no coincide con nada
+    body = _search(client, "/invoices/search?q=factura zzz")
+
+    assert body["items"] == [] and body["scanned"] == 2
+    assert body["partial"] is True and body["nextCursor"]
@@ -0,0 +1,55 @@
+"""Los contadores del dashboard que se mantienen al escribir coinciden con rebuild_dashboard_stats."""
+import app as app_module
+from conftest import auth_headers, upload
+
+COUNTERS = ("total_invoices", "by_status", "processed_count", "total_suppliers")
+
+
+def _live_counters():
+    stats = app_module.read_dashboard_stats()
+    return {key: stats[key] for key in COUNTERS}
+
+
+def _rebuilt_counters():
+    stats = app_module.rebuild_dashboard_stats(write=False)
+    return {key: stats[key] for key in COUNTERS}
+
+
+def test_counters_match_rebuild_after_writes(client):
+    ids = [upload(client, "sup1", numero=f"F001-{n:08d}")["invoiceId"] for n in range(4)]
+    ids += [upload(client, "sup2", numero=f"F002-{n:08d}")["invoiceId"] for n in range(3)]
+
+    app_module._process_invoice_pipeline(ids[0])
+    app_module._process_invoice_pipeline(ids[5])
+    app_module._process_invoice_pipeline(ids[5], use_cache=False)  # reprocesar no cuenta dos veces
+    client.patch(f"/invoices/{ids[1]}/status", headers=auth_headers("admin"), json={"status": "Pagada"})
+    client.patch("/invoices/status", headers=auth_headers("admin"),
+                 json={"invoiceIds": ids[2:5], "status": "Por Pagar"})
+
+    live = _live_counters()
+    assert live == _rebuilt_counters()
+    assert live["total_invoices"] == 7
+    assert live["total_suppliers"] == 2
+    assert live["processed_count"] == 2
+    assert live["by_status"] == {"Recibida": 3, "Por Pagar": 3, "Pagada": 1, "Vencida": 0}
+
+
+def test_dashboard_does_not_rebuild_missing_counters(client, db, backends):
+    for n in range(3):
+        upload(client, "sup1", numero=f"F001-{n:08d}")
+    expected = client.get("/dashboard/stats", headers=auth_headers("admin")).get_json()
+    for shard in db.collection("stats").document("global").collection("shards").stream():
+        shard.reference.delete()
+
+    # Sin shards la request no recorre la colección: contadores en cero
+    backends["firestore_client"].stats.reset()
+    body = client.get("/dashboard/stats", headers=auth_headers("admin")).get_json()
+    assert body["total_invoices"] == 0
+    assert len(body["recent_invoices"]) == 3
+    assert backends["firestore_client"].stats.snapshot().get("query") == 3  # versión, shards, recientes
+
+    # La reconciliación es explícita (flask rebuild-stats)
+    result = app_module.app.test_cli_runner().invoke(args=["rebuild-stats"])
+    assert result.exit_code == 0
+    assert client.get("/dashboard/stats", headers=auth_headers("admin")).get_json() == expected
+    assert _live_counters() == _rebuilt_counters()
@@ -0,0 +1,113 @@
+"""Extractor local con texto tal como sale de representaciones impresas de SUNAT."""
+import app as app_module
+import sunat_extractor
+
+# Portal de SUNAT (SEE-SOL): totales con etiqueta y "Importe Total" al final
+SEE_SOL = """\
+FACTURA ELECTRONICA
+RUC: 20100047218
+E001-245
+SERVICIOS INDUSTRIALES DEL SUR S.A.C.
+AV. JAVIER PRADO ESTE 1234 - SAN ISIDRO - LIMA - LIMA
+Fecha de Vencimiento : 15/12/2025
+Fecha de Emisión : 15/11/2025
+Señor(es) : DISTRIBUIDORA NEO S.A.
+RUC : 20512345671
+Tipo de Moneda : SOLES
+Forma de pago: Crédito
+Cantidad Unidad Medida Descripción Valor Unitario
+1.00 UNIDAD MANTENIMIENTO PREVENTIVO DE EQUIPOS 5,000.00
+Sub Total Ventas : S/ 5,000.00
+Anticipos : S/ 0.00
+Descuentos : S/ 0.00
+Valor Venta : S/ 5,000.00
+IGV : S/ 900.00
+Importe Total : S/ 5,900.00
+SON: CINCO MIL NOVECIENTOS Y 00/100 SOLES
+"""
+
+# Formato de un OSE: "TOTAL DESCUENTO" e "TOTAL IGV" antes del total genérico
+OSE = """\
+TRANSPORTES ANDINOS E.I.R.L.
+Jr. Huallaga 455 - Cercado de Lima
+FACTURA ELECTRÓNICA
+RUC N° 20601234565
+F001 - 1532
+ADQUIRIENTE: MINERA DEL CENTRO S.A.A.
+RUC: 20487654320
+FECHA EMISIÓN: 03/10/2025
+FECHA VENCIMIENTO: 02/11/2025
+MONEDA: DOLARES AMERICANOS
+DESCRIPCION: Flete Lima - Huancayo
+OP. GRAVADA US$ 1,900.00
+TOTAL DESCUENTO US$ 100.00
+TOTAL IGV US$ 342.00
+TOTAL US$ 2,242.00
+"""
+
+# Factura al contado: sin fecha de vencimiento
+CONTADO = """\
+FACTURA ELECTRONICA
+RUC: 10456789019
+E001-77
+Fecha de Emisión : 20/11/2025
+Tipo de Moneda : SOLES
+Forma de pago: Contado
+Importe Total : S/ 350.00
+"""
+
+# Sin moneda en ninguna parte: importes sin símbolo
+SIN_MONEDA = """\
+FACTURA ELECTRONICA
+RUC: 20100047218
+F002-00000931
+Fecha de Emisión: 01/09/2025
+Fecha de Vencimiento: 01/10/2025
+TOTAL: 1,180.00
+"""
+
+
+def test_see_sol_invoice_is_read_completely():
+    data = sunat_extractor.extract_invoice_fields(SEE_SOL)
+
+    assert data["ruc_emisor"] == "20100047218"  # no el del cliente
+    assert data["razon_social_emisor"] == "SERVICIOS INDUSTRIALES DEL SUR S.A.C."
+    assert data["numero_factura"] == "E001-00000245"
+    assert (data["monto_total"], data["moneda"]) == ("5900.00", "PEN")
+    assert (data["fecha_emision"], data["fecha_vencimiento"]) == ("2025-11-15", "2025-12-15")
+    assert data["confidence"] == 100
+    assert sunat_extractor.is_complete(data)
+
+
+def test_generic_total_ignores_discount_and_tax_totals():
+    data = sunat_extractor.extract_invoice_fields(OSE)
+
+    assert (data["monto_total"], data["moneda"]) == ("2242.00", "USD")
+    assert data["ruc_emisor"] == "20601234565"
+    assert data["numero_factura"] == "F001-00001532"
+    assert (data["fecha_emision"], data["fecha_vencimiento"]) == ("2025-10-03", "2025-11-02")
+    assert sunat_extractor.is_complete(data)
+
+
+def test_total_label_followed_by_other_words_is_not_the_total():
+    data = sunat_extractor.extract_invoice_fields("FACTURA\nTOTAL DESCUENTOS S/ 10.00\nTOTAL ITEMS 3\n")
+
+    assert data["monto_total"] is None
+
+
+def test_missing_due_date_or_currency_is_incomplete():
+    contado = sunat_extractor.extract_invoice_fields(CONTADO)
+    sin_moneda = sunat_extractor.extract_invoice_fields(SIN_MONEDA)
+
+    # La confianza sola alcanzaría el umbral por defecto (85)...
+    assert contado["confidence"] >= 85 and contado["fecha_vencimiento"] is None
+    assert sin_moneda["confidence"] >= 85 and sin_moneda["moneda"] is None
+    # ...pero sin esos campos no se acepta el resultado local
+    assert not sunat_extractor.is_complete(contado)
+    assert not sunat_extractor.is_complete(sin_moneda)
+
+
+def test_incomplete_local_result_falls_through_to_gemini(backends):
+    assert app_module._extract_locally(SEE_SOL)["extractor"] == "local"
+    assert app_module._extract_locally(CONTADO) is None
+    assert app_module._extract_locally(SIN_MONEDA) is None
@@ -11,7 +11,7 @@ import {
   SelectValue,
 } from "@/components/ui/select";
 import { toast } from 'sonner';
-import { apiGet, apiPatch, apiPost } from '@/utils/api';
+import { apiGet, apiPatch, apiPost, openInvoicePdf } from '@/utils/api';
 import { Sparkles, RefreshCw } from 'lucide-react';
 
 interface Invoice {
@@ -80,9 +80,25 @@ export const AdminInvoicesTable = ({ refreshTrigger }: AdminInvoicesTableProps)
   const handleProcessWithAI = async (invoiceId: string) => {
     setProcessingId(invoiceId);
     try {
-      const result = await apiPost(`/invoices/${invoiceId}/process`, {});
+      // El backend encola el trabajo (202) y se consulta su estado hasta que termine
+      const { jobId } = await apiPost(`/invoices/${invoiceId}/process`, {});
+      let job = await apiGet(`/jobs/${jobId}`);
+      const deadline = Date.now() + 120000;
+      while ((job.status === 'queued' || job.status === 'running') && Date.now() < deadline) {
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        job = await apiGet(`/jobs/${jobId}`);
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.result?.detail || job.error || 'Error en el procesamiento');
+      }
+      if (job.status !== 'done') {
+        toast.info('El procesamiento sigue en curso', {
+          description: 'Actualice la lista en unos segundos'
+        });
+        return;
+      }
       toast.success('Factura procesada con IA', {
-        description: `Extraídos: ${Object.keys(result.extracted_data || {}).length} campos`
+        description: `Extraídos: ${Object.keys(job.result?.extracted_data || {}).length} campos`
       });
       fetchInvoices(); // Refrescar para mostrar datos extraídos
     } catch (error: unknown) {
@@ -106,6 +122,15 @@ export const AdminInvoicesTable = ({ refreshTrigger }: AdminInvoicesTableProps)
     return <Badge variant={variants[status] || 'default'}>{status}</Badge>;
   };
 
+  const handleOpenPdf = async (invoiceId: string) => {
+    try {
+      await openInvoicePdf(invoiceId);
+    } catch (error: unknown) {
+      console.error('Error abriendo PDF:', error);
+      toast.error('No se pudo abrir el PDF');
+    }
+  };
+
   if (loading) {
     return (
       <Card>
@@ -157,7 +182,13 @@ export const AdminInvoicesTable = ({ refreshTrigger }: AdminInvoicesTableProps)
                 {invoices.map((invoice) => (
                   <TableRow key={invoice.invoiceId}>
                     <TableCell className="font-medium">
-                      {invoice.originalFilename || 'factura.pdf'}
+                      <button
+                        type="button"
+                        className="hover:underline"
+                        onClick={() => handleOpenPdf(invoice.invoiceId)}
+                      >
+                        {invoice.originalFilename || 'factura.pdf'}
+                      </button>
                     </TableCell>
                     <TableCell className="font-mono text-xs">
                       {invoice.supplierRuc || invoice.supplierEmail || invoice.supplierUid.substring(0, 8) + '...'}
@@ -24,6 +24,8 @@ interface Supplier {
 export const AdminSuppliers = () => {
   const [suppliers, setSuppliers] = useState<Supplier[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextPageToken, setNextPageToken] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchSuppliers();
@@ -34,6 +36,7 @@ export const AdminSuppliers = () => {
     try {
       const data = await apiGet('/suppliers');
       setSuppliers(data.suppliers || []);
+      setNextPageToken(data.nextPageToken || null);
     } catch (error: unknown) {
       console.error('Error cargando proveedores:', error);
       const apiError = error as { status?: number };
@@ -45,6 +48,24 @@ export const AdminSuppliers = () => {
     }
   };
 
+  const fetchMoreSuppliers = async () => {
+    if (!nextPageToken) return;
+    setLoadingMore(true);
+    try {
+      const data = await apiGet(`/suppliers?page_token=${encodeURIComponent(nextPageToken)}`);
+      setSuppliers((prev) => [...prev, ...(data.suppliers || [])]);
+      setNextPageToken(data.nextPageToken || null);
+    } catch (error: unknown) {
+      console.error('Error cargando más proveedores:', error);
+      const apiError = error as { status?: number };
+      if (apiError.status !== 401) {
+        toast.error('No se pudieron cargar más proveedores');
+      }
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (loading) {
     return (
       <Card>
@@ -120,6 +141,13 @@ export const AdminSuppliers = () => {
                 ))}
               </TableBody>
             </Table>
+            {nextPageToken && (
+              <div className="flex justify-center pt-4">
+                <Button onClick={fetchMoreSuppliers} variant="outline" size="sm" disabled={loadingMore}>
+                  {loadingMore ? 'Cargando...' : 'Cargar más'}
+                </Button>
+              </div>
+            )}
           </div>
         )}
       </CardContent>
@@ -4,7 +4,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
 import { toast } from 'sonner';
-import { apiPostForm } from '@/utils/api';
+import { uploadInvoicePdf } from '@/utils/api';
 
 interface InvoiceUploadProps {
   onUploadSuccess: () => void;
@@ -36,10 +36,7 @@ export const InvoiceUpload = ({ onUploadSuccess }: InvoiceUploadProps) => {
     setUploading(true);
 
     try {
-      const formData = new FormData();
-      formData.append('file', file);
-
-      const result = await apiPostForm('/invoices', formData);
+      const result = await uploadInvoicePdf(file);
       
       toast.success('Factura subida exitosamente', {
         description: `ID: ${result.invoiceId} - Estado: ${result.status}`,
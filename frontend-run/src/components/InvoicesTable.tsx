@@ -3,7 +3,7 @@ import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/com
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
 import { Badge } from '@/components/ui/badge';
 import { toast } from 'sonner';
-import { apiGet } from '@/utils/api';
+import { apiGet, openInvoicePdf } from '@/utils/api';
 import { FileText } from 'lucide-react';
 
 interface Invoice {
@@ -42,6 +42,15 @@ export const InvoicesTable = ({ refreshTrigger }: InvoicesTableProps) => {
     fetchInvoices();
   }, [refreshTrigger]);
 
+  const handleOpenPdf = async (invoiceId: string) => {
+    try {
+      await openInvoicePdf(invoiceId);
+    } catch (error: unknown) {
+      console.error('Error abriendo PDF:', error);
+      toast.error('No se pudo abrir el PDF');
+    }
+  };
+
   if (loading) {
     return (
       <Card>
@@ -80,7 +89,13 @@ export const InvoicesTable = ({ refreshTrigger }: InvoicesTableProps) => {
                     <TableCell>
                       <div className="flex items-center gap-2">
                         <FileText className="h-4 w-4 text-gray-500" />
-                        <span className="font-medium">{invoice.originalFilename || 'factura.pdf'}</span>
+                        <button
+                          type="button"
+                          className="font-medium hover:underline"
+                          onClick={() => handleOpenPdf(invoice.invoiceId)}
+                        >
+                          {invoice.originalFilename || 'factura.pdf'}
+                        </button>
                       </div>
                     </TableCell>
                     <TableCell>
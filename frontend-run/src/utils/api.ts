@@ -124,4 +124,69 @@ export const apiPatch = async (path: string, data: any) => {
     if (error instanceof ApiError) throw error;
     throw new ApiError(500, 'Error de red');
   }
-};
\ No newline at end of file
+};
+/**
+ * Sube un PDF con POST /invoices: el backend detecta duplicados y guarda el
+ * texto del PDF al subirlo. Con VITE_DIRECT_UPLOAD=true usa la subida directa
+ * a Cloud Storage (sin esos dos pasos, que quedan para el procesamiento).
+ */
+export const uploadInvoicePdf = (file: File) =>
+  import.meta.env.VITE_DIRECT_UPLOAD === 'true'
+    ? uploadInvoicePdfDirect(file)
+    : uploadInvoicePdfViaBackend(file);
+
+/**
+ * Sube un PDF directo a Cloud Storage con una URL firmada del backend
+ * (POST /invoices/upload-url -> sesión resumable -> PUT) y registra la
+ * factura con POST /invoices/:id/finalize. Si la subida directa falla
+ * (ej. CORS del bucket sin configurar), usa el POST /invoices clásico.
+ */
+const uploadInvoicePdfDirect = async (file: File) => {
+  let target: { invoiceId: string; uploadUrl: string; method: string; headers: Record<string, string> };
+  try {
+    target = await apiPost('/invoices/upload-url', {
+      filename: file.name,
+      size: file.size,
+      contentType: 'application/pdf',
+    });
+  } catch (error) {
+    if (error instanceof ApiError && error.status < 500) throw error;
+    return uploadInvoicePdfViaBackend(file);
+  }
+
+  try {
+    const session = await fetch(target.uploadUrl, { method: target.method, headers: target.headers });
+    const sessionUrl = session.headers.get('Location');
+    if (!session.ok || !sessionUrl) throw new Error(`sesión de subida: ${session.status}`);
+    const upload = await fetch(sessionUrl, { method: 'PUT', body: file });
+    if (!upload.ok) throw new Error(`subida: ${upload.status}`);
+  } catch (error) {
+    console.warn('Subida directa a Storage falló, se usa el backend:', error);
+    return uploadInvoicePdfViaBackend(file);
+  }
+
+  return apiPost(`/invoices/${target.invoiceId}/finalize`, { filename: file.name });
+};
+
+const uploadInvoicePdfViaBackend = (file: File) => {
+  const formData = new FormData();
+  formData.append('file', file);
+  return apiPostForm('/invoices', formData);
+};
+
+/** Abre el PDF de una factura con la URL firmada de GET /invoices/:id/download-url. */
+export const openInvoicePdf = async (invoiceId: string) => {
+  // Abrir la pestaña antes del await para que el navegador no la bloquee
+  const tab = window.open('', '_blank');
+  try {
+    const { url } = await apiGet(`/invoices/${invoiceId}/download-url`);
+    if (tab) {
+      tab.location.href = url;
+    } else {
+      window.location.href = url;
+    }
+  } catch (error) {
+    tab?.close();
+    throw error;
+  }
+};